@@ -5,6 +5,8 @@ some related methods.
 
 from collections import deque
 
+from config import PRINT
+
 class KidneyReadException(Exception):
     pass
 
@@ -53,6 +55,32 @@ class Edge:
     def __str__(self):
         return ("V" + str(self.src.id) + "-V" + str(self.tgt.id))
 
+class AdjacencyRow(dict):
+    """The out-edges of one vertex, keyed by target id. Missing targets give None."""
+
+    def __missing__(self, tgt_id):
+        return None
+
+class AdjacencyMap(dict):
+    """A sparse adjacency matrix: adj_mat[src_id][tgt_id] is the Edge from src_id to
+    tgt_id, or None. Only vertices with out-edges have a row, so memory grows with
+    the number of edges rather than with the square of the largest vertex id.
+    """
+
+    EMPTY_ROW = AdjacencyRow()
+
+    def __missing__(self, src_id):
+        return self.EMPTY_ROW
+
+class PathLengths(dict):
+    """Shortest path lengths keyed by vertex id, 999999999 for vertices not reached.
+    Only the vertices reached are stored, so a search costs what it visits rather
+    than the number of vertices in the digraph.
+    """
+
+    def __missing__(self, v_id):
+        return 999999999
+
 class Digraph:
     """A directed graph, in which each edge has a numeric score.
 
@@ -61,20 +89,25 @@ class Digraph:
         max_n: the maximum id num of the vertices
         vs: an array of Vertex objects, such that vs[i].id == i
         es: an array of Edge objects, such that es[i].id = i
+        adj_mat: an AdjacencyMap, adj_mat[i][j] is the Edge from vertex i to vertex j or None
+        id_nums: the id num of every vertex (vertex i is id_nums[i]) if the vertices were numbered
+            densely by csr_digraph, None if the vertex ids are the id nums
     """
 
     def __init__(self, n):
-        """Create a Digraph with n vertices"""
+        """Create a Digraph with the vertices whose ids are in the list n"""
         self.n = len(n)
-        self.max_n = max(n)
-        print("n is: ")
-        print(n)
-        print("Max n is " + str(max(n)))
-        self.vs = [None for i in range(max(n) + 1)]
+        self.max_n = max(n) if len(n) > 0 else -1
+        if PRINT:
+            print("n is: ")
+            print(n)
+            print("Max n is " + str(self.max_n))
+        self.vs = [None for i in range(self.max_n + 1)]
         for i in n:
             self.vs[i] = Vertex(i)
-        self.adj_mat = [[None for x in range(max(n) + 1)] for x in range(max(n) + 1)]
+        self.adj_mat = AdjacencyMap()
         self.es = []
+        self.id_nums = None
 
     def add_edge(self, score, source, tgt):
         """Add an edge to the digraph
@@ -89,7 +122,10 @@ class Digraph:
         e = Edge(id, score, source, tgt)
         self.es.append(e)
         source.edges.append(e)
-        self.adj_mat[source.id][tgt.id] = e
+        row = self.adj_mat.get(source.id)
+        if row is None:
+            row = self.adj_mat[source.id] = AdjacencyRow()
+        row[tgt.id] = e
     
     def find_cycles(self, max_length):
         """Find cycles of length up to max_length in the digraph.
@@ -142,22 +178,25 @@ class Digraph:
                 vtx_used[v.id] = False
     
     def get_shortest_path_from_low_vtx(self, low_vtx, max_path):
-        """ Returns an array of path lengths. For each v > low_vtx, if the shortest
-            path from low_vtx to v is shorter than max_path, then element v of the array
+        """ Returns a PathLengths mapping. For each v > low_vtx, if the shortest
+            path from low_vtx to v is shorter than max_path, then element v of the mapping
             will be the length of this shortest path. Otherwise, element v will be
             999999999."""
         return self.calculate_shortest_path_lengths(self.vs[low_vtx], max_path,
                     adj_list_accessor=lambda v: (e.tgt for e in v.edges if e.tgt.id >= low_vtx))
 
     def get_shortest_path_to_low_vtx(self, low_vtx, max_path):
-        """ Returns an array of path lengths. For each v > low_vtx, if the shortest
-            path to low_vtx from v is shorter than max_path, then element v of the array
+        """ Returns a PathLengths mapping. For each v > low_vtx, if the shortest
+            path to low_vtx from v is shorter than max_path, then element v of the mapping
             will be the length of this shortest path. Otherwise, element v will be
             999999999."""
+        transp_adj_lists = {}
+        for edge in self.es:
+            if edge.src.id >= low_vtx:
+                transp_adj_lists.setdefault(edge.tgt.id, []).append(edge.src)
+
         def adj_list_accessor(v):
-            for i in range(low_vtx, len(self.vs)):
-                if self.adj_mat[i][v.id]:
-                    yield self.vs[i]
+            return transp_adj_lists.get(v.id, [])
             
         return self.calculate_shortest_path_lengths(self.vs[low_vtx], max_path,
                     adj_list_accessor=adj_list_accessor)
@@ -168,8 +207,8 @@ class Digraph:
         vertex with a greater or equal index, using paths containing
         only vertices indexed greater than or equal to from_v.
 
-        Return value: a list of distances of length equal to the number of vertices.
-        If the shortest path to a vertex is greater than max_dist, the list element
+        Return value: a PathLengths mapping of vertex ids to distances.
+        If the shortest path to a vertex is greater than max_dist, its distance
         will be 999999999.
 
         Args:
@@ -180,7 +219,7 @@ class Digraph:
         """
         # Breadth-first search
         q = deque([from_v])
-        distances = [999999999] * len(self.vs)
+        distances = PathLengths()
         distances[from_v.id] = 0
 
         while q:
@@ -202,14 +241,12 @@ class Digraph:
     def induced_subgraph(self, vertices):
         """Returns the subgraph indiced by a given list of vertices."""
 
-        subgraph = Digraph(vertices)
+        subgraph = Digraph(list(range(len(vertices))))
+        new_ids = {v.id: i for i, v in enumerate(vertices)}
         for i, v in enumerate(vertices):
-            for j, w in enumerate(vertices):
-                e = self.adj_mat[v.id][w.id]
-                if e is not None:
-                    new_src = subgraph.vs[i]
-                    new_tgt = subgraph.vs[j]
-                    subgraph.add_edge(e.score, new_src, new_tgt)
+            for e in v.edges:
+                if e.tgt.id in new_ids:
+                    subgraph.add_edge(e.score, subgraph.vs[i], subgraph.vs[new_ids[e.tgt.id]])
         return subgraph
 
     def __str__(self):
@@ -241,3 +278,44 @@ def read_digraph(lines, vertices):
 
     return digraph
 
+
+def csr_digraph(vertices, indptr, indices, scores, rows=None):
+    """Builds a digraph directly from a compressed sparse row matrix, without
+    going through the text input format.
+
+    The vertices are numbered densely, 0 to n-1 in the order of their ids, so the
+    digraph holds n vertices however large the ids are. digraph.id_nums maps them back.
+
+    Args:
+        vertices: the vertex ids, row and column i of the matrix is vertex vertices[i]
+        indptr: the row pointers, the edges of row i are indptr[i]:indptr[i+1]
+        indices: the column of every edge
+        scores: the score of every edge
+        rows: the rows whose edges are added, in that order (default: all of them)
+    """
+
+    vertices = [int(v) for v in vertices]
+    digraph = Digraph(list(range(len(vertices))))
+    digraph.id_nums = sorted(vertices)
+    if rows is None:
+        rows = range(len(vertices))
+    vs = dense_vertices(digraph, vertices)
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    scores = scores.tolist()
+    for row in rows:
+        src = vs[row]
+        for k in range(indptr[row], indptr[row + 1]):
+            tgt = vs[indices[k]]
+            if src is tgt:
+                raise KidneyReadException("Self-loop from {0} to {0} not permitted".format(digraph.id_nums[src.id]))
+            digraph.add_edge(scores[k], src, tgt)
+
+    return digraph
+
+
+def dense_vertices(digraph, vertices):
+    """Returns the Vertex of each id in vertices, in a digraph built by csr_digraph."""
+
+    index = {v: i for i, v in enumerate(digraph.id_nums)}
+    return [digraph.vs[index[int(v)]] for v in vertices]
@@ -7,7 +7,7 @@ each of these edges points towards a vertex (which represents a donor-patient pa
 in the directed graph.
 """
 
-from algorithms.kidney_solver.kidney_digraph import KidneyReadException
+from algorithms.kidney_solver.kidney_digraph import KidneyReadException, dense_vertices
 
 class Ndd:
     """A non-directed donor"""
@@ -46,7 +46,7 @@ def read_ndds(lines, digraph):
 
     # Keep track of which edges have been created already so that we can
     # detect duplicates
-    edge_exists = [[False for v in digraph.vs] for ndd in ndds]
+    edge_exists = set()
 
     for line in lines[1:edge_count+1]:
         tokens = [t for t in line.split()]
@@ -57,17 +57,33 @@ def read_ndds(lines, digraph):
             raise KidneyReadException("NDD index {} out of range.".format(src_id))
         if tgt_id < 0 or tgt_id > digraph.max_n:
             raise KidneyReadException("Vertex index {} out of range.".format(tgt_id))
-        if edge_exists[src_id][tgt_id]:
+        if (src_id, tgt_id) in edge_exists:
             raise KidneyReadException(
                     "Duplicate edge from NDD {0} to vertex {1}.".format(src_id, tgt_id))
         ndds[src_id].add_edge(NddEdge(digraph.vs[tgt_id], score))
-        edge_exists[src_id][tgt_id] = True
+        edge_exists.add((src_id, tgt_id))
 
     if lines[edge_count+1].split()[0] != "-1" or len(lines) < edge_count+2:
         raise KidneyReadException("Incorrect edge count")
 
     return ndds
 
+def csr_ndds(vertices, indptr, indices, scores, rows, digraph):
+    """Builds NDDs directly from the rows of a compressed sparse row matrix (see
+    kidney_digraph.csr_digraph). NDD i has the out-edges of row rows[i].
+    """
+
+    vs = dense_vertices(digraph, vertices)
+    indptr = indptr.tolist()
+    indices = indices.tolist()
+    scores = scores.tolist()
+    ndds = [Ndd() for _ in rows]
+    for ndd, row in zip(ndds, rows):
+        for k in range(indptr[row], indptr[row + 1]):
+            ndd.add_edge(NddEdge(vs[indices[k]], scores[k]))
+
+    return ndds
+
 class Chain(object):
     """A chain initiated by an NDD.
     
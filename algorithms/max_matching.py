@@ -1,6 +1,6 @@
 import market as Market
 from algorithms import hungarian_algorithm as HA
-import networkx as nx
+import numpy as np
 from config import ALGORITHM, PRINT
 from algorithms.LP.linear_program import solve_KEP
 
@@ -43,29 +43,26 @@ class MaxMatching:
         :return: a set of all the edges in the matching
         """
         edges = set()
-        participant_list = self.bigraph.participants.copy()
-        new_graph = self.bigraph.graph.copy()
+        graph = self.bigraph.graph
+        # every pair whose donor has a neighbour takes two rows and columns of the matrix, the donor then the recipient
+        participant_list = list()
+        vertices = list()
         for participant in self.bigraph.participants:
-            if participant.donor and len(participant.neighbours) == 0:
-                to_remove = None
-                for (p1, p2) in new_graph.edges():
-                    if p2 == participant:
-                        to_remove = p1
-                        participant_list.remove(p1)
-                if to_remove is not None:
-                    new_graph.remove_node(to_remove)
-                if participant in new_graph.nodes():
-                    new_graph.remove_node(participant)
-                participant_list.remove(participant)
+            if participant.donor and graph.out_degree(participant.id_num) > 0 and participant.partner.alive:
+                participant_list.extend([participant, participant.partner])
+                vertices.append(participant.id_num)
         if len(participant_list) == 0:
             return edges
-        matrix = (nx.adjacency_matrix(new_graph)).todense().tolist()
-        for n in range(len(matrix)):
-            matrix[n] = [-100000 if x == 0 else x for x in matrix[n]]
-        # give a score of 1 between pairs
-        for n in range(int(len(matrix) / 2)):
-            matrix[(n * 2) + 1][(n*2)] = 1
-            matrix[(n * 2)][n * 2 + 1] = 1
+        position = {vertex: i for (i, vertex) in enumerate(vertices)}
+        matrix = np.full((len(participant_list), len(participant_list)), -100000)
+        for (i, vertex) in enumerate(vertices):
+            for target in graph.successors(vertex):
+                if target in position:
+                    matrix[2 * i][2 * position[target] + 1] = graph.weight(vertex, target)
+            # give a score of 1 between pairs
+            matrix[2 * i + 1][2 * i] = 1
+            matrix[2 * i][2 * i + 1] = 1
+        matrix = matrix.tolist()
         matching = HA.max_weight_matching(matrix)
         if matching[2] <= (len(self.bigraph.participants) / 2):
             return edges
@@ -86,7 +83,7 @@ class MaxMatching:
                  a set of all unmatched donors (that could be future altruists)
         """
         G, pair_dict, weights, _ = self.bigraph.get_adj_list()
-        altruist_list = self.bigraph.get_alt_list()
+        altruist_list = self.bigraph.altruists.id_array.tolist()
         print("Altruists in this period:")
         for altruist in altruist_list:
             print(str(altruist) + ':', end=" ")
@@ -142,52 +139,37 @@ class MaxMatching:
         return edges, preserved_donors
 
 
+    def kidney_instance(self):
+        """
+        builds the input of kidney_solver_master directly from the compressed sparse rows of the market's graph,
+        instead of writing and parsing its .input and .ndds formats. Nothing in it is quadratic in the number of pairs
+        the edges of the pairs are added in the order of pair_dict and the altruists are the NDDs
+        :return: the Digraph, the list of Ndds and the list of the id_nums of the altruists (NDD i is altruist_list[i])
+        """
+        vertices, indptr, indices, weights = self.bigraph.graph.to_csr()
+        position = {vertex: i for (i, vertex) in enumerate(vertices.tolist())}
+        altruist_list = self.bigraph.altruists.id_array.tolist()
+        rows = [position[key] for key in self.bigraph.pair_dict if key not in self.bigraph.altruists]
+        d = kidney_digraph.csr_digraph(vertices, indptr, indices, weights, rows)
+        altruists = kidney_ndds.csr_ndds(vertices, indptr, indices, weights, [position[key] for key in altruist_list], d)
+        return d, altruists, altruist_list
+
     def FAST_maximum_matching(self):
         """
         finds a matching using a faster linear program -- kidney_solver_master
-        in the original algorithm, it takes input of 2 files: .input and .ndds
-        need to mimic files for both .input and .ndds from our model:P
-        digraph_lines <==> .input   &   ndd_lines <==> .ndds
+        the digraph and the NDDs are built from the graph of the market by kidney_instance
         :return: a set of all the edges in the matching
         """
 
-        G, pair_dict, weights, vertex_list = self.bigraph.get_adj_list()
-        altruist_list = self.bigraph.get_alt_list()
+        pair_dict = self.bigraph.pair_dict
+        # without pairs there is nothing to match (e.g. a small regional market), and no digraph to build
+        if len(pair_dict) == len(self.bigraph.altruists):
+            self.cycle_lengths = [[0, 0, 0, 0, 0], [0], [0, 0, 0, 0, 0]]
+            return set(), set()
+        d, altruists, altruist_list = self.kidney_instance()
         print("Altruist in this period:", end=" ")
         print(altruist_list)
 
-        # initialize .input
-        digraph_lines = list()
-        new_keys = list()  # a list of keys that excludes altruists
-        for key in G.keys():
-            if key in altruist_list:
-                continue
-            else:
-                new_keys.append(key)
-        temp_list = list()  # a list of all the neighbors of altruists
-        for alt in altruist_list:
-            for v in G[alt]:
-                temp_list.append(v)
-        digraph_lines.append(str(len(new_keys)) + "\t" + str(len(weights)-len(temp_list)) + "\n")
-        for key in new_keys:
-            for val in G[key]:
-                digraph_lines.append(str(key) + "\t" + str(val) + "\t" + str(weights[(key, val)]) + "\n")
-        digraph_lines.append(str(-1) + "\t" + str(-1) + "\t" + str(-1) + "\n")
-
-        d = kidney_digraph.read_digraph(digraph_lines, vertices=vertex_list)
-
-        #initialize .ndds
-        ndd_lines = list()
-        i = 0
-        ndd_lines.append(str(len(altruist_list)) + "\t" + str(len(temp_list)) + "\n")
-        for key in altruist_list:
-            for val in G[key]:
-                ndd_lines.append(str(i) + "\t" + str(val) + "\t" + str(weights[(key, val)]) + "\n")
-            i = i+1
-        ndd_lines.append(str(-1) + "\t" + str(-1) + "\t" + str(-1) + "\n")
-
-        altruists = kidney_ndds.read_ndds(ndd_lines, d)
-
         start_time = time.time()
         cfg = kidney_ip.OptConfig(d, altruists, self.max_cycle_size, self.max_path_size)
         opt_solution = solve_kep(cfg, formulation="picef", use_relabelled=False)
@@ -203,6 +185,9 @@ class MaxMatching:
             print(("solver_status: {}".format(opt_solution.ip_model.status)))
             print(("total_score: {}".format(opt_solution.total_score)))
         cycles, chains = opt_solution.display(altruist_list)  # Note that in each chain array, altruist is excluded
+        # the vertices of the digraph are numbered densely, pair_dict is keyed by id_num
+        cycles = [[d.id_nums[v] for v in cycle] for cycle in cycles]
+        chains = [[d.id_nums[v] for v in chain] for chain in chains]
         print("-------------------------------------------------------")
         edges = set()
         preserved_donors = set()  # preserve the donor of last pair in a chain
@@ -0,0 +1,74 @@
+import numpy as np
+
+"""
+The altruists (non-directed donors) in a market, indexed by the id_num of the altruist
+"""
+
+
+class AltruistRegistry:
+    """
+    The altruists in a market, as (recipient, donor) tuples keyed by id_num, in the order they entered the market
+    The recipient of an altruist is the "fake participant" of blood type 'X'
+    ----------
+    pairs: dict<int, (Participant, Participant)>
+        the altruists keyed by id_num
+    """
+
+    def __init__(self):
+        self.pairs = dict()
+        self._id_array = None
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __iter__(self):
+        return iter(list(self.pairs.values()))
+
+    def __contains__(self, id_num):
+        return id_num in self.pairs
+
+    def add(self, altruist):
+        """
+        :param altruist: a tuple (recipient, donor)
+        """
+        self.pairs[altruist[1].id_num] = altruist
+        self._id_array = None
+
+    def extend(self, altruists):
+        """
+        :param altruists: a list of tuples (recipient, donor)
+        """
+        for altruist in altruists:
+            self.add(altruist)
+
+    def get(self, id_num):
+        """
+        :return: the tuple (recipient, donor) of the altruist, or None if it is not in the registry
+        """
+        return self.pairs.get(id_num)
+
+    def remove(self, id_num):
+        """
+        removes an altruist, if it is in the registry
+        """
+        if self.pairs.pop(id_num, None) is not None:
+            self._id_array = None
+
+    def remove_participant(self, participant):
+        """
+        removes the altruist a participant belongs to, if it is in the registry
+        :param participant: the donor or the recipient of an altruist, or any other participant
+        """
+        altruist = self.pairs.get(participant.id_num)
+        if altruist is not None and participant in altruist:
+            self.remove(participant.id_num)
+
+    @property
+    def id_array(self):
+        """
+        :return: an array of the id_nums of the altruists, in the order they entered the market
+                 it is only rebuilt when altruists have been added or removed since the last call
+        """
+        if self._id_array is None:
+            self._id_array = np.array(list(self.pairs), dtype=np.int64)
+        return self._id_array
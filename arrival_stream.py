@@ -0,0 +1,234 @@
+import csv
+import os
+import numpy as np
+from participant import BLOOD_TYPES, PROVINCES
+from population import cpra_band, draw_time_to_critical
+from config import RANDOM_SAMPLE
+
+"""
+Pre-generated arrival streams
+All the arrivals of a simulation (the starting pool, the new pairs and the altruists of every period) can be generated
+up front, written to a file and replayed later, so that the same arrivals can be used for several market settings
+"""
+
+# columns of the pairs and altruists of a stream and the type they are stored with
+PAIR_COLUMNS = {'cpra_index': np.int8, 'cpra': np.float64, 'donor_type': np.int8, 'recipient_type': np.int8,
+                'dialysis_days': np.int32, 'donor_age': np.int16, 'patient_age': np.int16,
+                'time_to_critical': np.int32, 'province': np.int8}
+ALTRUIST_COLUMNS = {'donor_age': np.int16, 'donor_type': np.int8, 'time_to_critical': np.int32}
+
+
+class ArrivalStream:
+    """
+    The arrivals of every period of a simulation, stored column by column
+    ----------
+    pairs: dict<string, array>
+        the attributes of all pairs, in order of arrival. Blood types and provinces are integer codes
+    pair_counts: array
+        the number of pairs of the starting pool (index 0) and of every period (index i + 1)
+    altruists: dict<string, array>
+        the attributes of all altruists, in order of arrival
+    altruist_counts: array
+        the number of altruists of every period
+    """
+
+    def __init__(self, pairs, pair_counts, altruists, altruist_counts):
+        self.pairs = pairs
+        self.pair_counts = np.asarray(pair_counts, dtype=np.int64)
+        self.altruists = altruists
+        self.altruist_counts = np.asarray(altruist_counts, dtype=np.int64)
+        self.pair_offsets = np.concatenate(([0], np.cumsum(self.pair_counts)))
+        self.altruist_offsets = np.concatenate(([0], np.cumsum(self.altruist_counts)))
+
+    @property
+    def num_periods(self):
+        return len(self.altruist_counts)
+
+    def initial_pairs(self):
+        """
+        :return: a dictionary of the attribute arrays of the starting pool
+        """
+        return self.pair_cohort(-1)
+
+    def pair_cohort(self, period):
+        """
+        :param period: the period number, or -1 for the starting pool
+        :return: a dictionary of the attribute arrays of the pairs arriving in the period
+        """
+        start = self.pair_offsets[period + 1]
+        end = self.pair_offsets[period + 2]
+        return {key: column[start:end] for (key, column) in self.pairs.items()}
+
+    def altruist_cohort(self, period):
+        """
+        :param period: the period number
+        :return: a dictionary of the attribute arrays of the altruists arriving in the period
+        """
+        start = self.altruist_offsets[period]
+        end = self.altruist_offsets[period + 1]
+        return {key: column[start:end] for (key, column) in self.altruists.items()}
+
+    def save(self, path):
+        """
+        writes the stream to a compressed .npz file
+        :param path: the path of the file
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        arrays = {'pair_counts': self.pair_counts, 'altruist_counts': self.altruist_counts}
+        for (key, dtype) in PAIR_COLUMNS.items():
+            arrays['pair_' + key] = self.pairs[key].astype(dtype)
+        for (key, dtype) in ALTRUIST_COLUMNS.items():
+            arrays['altruist_' + key] = self.altruists[key].astype(dtype)
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+
+def generate_arrival_stream(population, num_periods, start_size, arrival_rate, altruists, rng=np.random, altruist_rng=np.random, perish_rng=None, per_period=1):
+    """
+    generates the arrivals of a whole simulation up front
+    the random numbers are drawn the same way as in a live batched simulation with the same per_period: the number of
+    altruists is drawn every period but they are only sampled every per_period periods. On the other periods the stream
+    has no altruists, so it counts none for them where the live simulation counts the number drawn
+    :param population: the Population to sample from
+    :param num_periods: the number of periods
+    :param start_size: the number of pairs in the starting pool
+    :param arrival_rate: the mean number of pairs arriving every period
+    :param altruists: the mean number of altruists arriving every period
+    :param rng: the numpy Generator or RandomState the pairs are drawn from
+    :param altruist_rng: the numpy Generator or RandomState the altruists are drawn from
+    :param perish_rng: the numpy Generator or RandomState time_to_critical values are drawn from, rng and altruist_rng if None
+    :param per_period: altruists enter the market every per_period periods
+    :return: an ArrivalStream
+    """
+    pair_cohorts = [population.sample_cohort(start_size, first_flag=True, rng=rng, perish_rng=perish_rng)]
+    altruist_cohorts = list()
+    altruist_counts = list()
+    for i in range(num_periods):
+        num_pairs = rng.poisson(arrival_rate, None)
+        pair_cohorts.append(population.sample_cohort(num_pairs, first_flag=False, rng=rng, perish_rng=perish_rng))
+        if RANDOM_SAMPLE:
+            num_altruists = altruist_rng.poisson(altruists, None)
+        else:
+            num_altruists = altruists
+        if i % per_period != 0:
+            num_altruists = 0
+            altruist_cohorts.append({key: np.zeros(0, dtype=dtype) for (key, dtype) in ALTRUIST_COLUMNS.items()})
+        else:
+            altruist_cohorts.append(population.sample_altruists(num_altruists, altruist_rng, perish_rng))
+        altruist_counts.append(num_altruists)
+    pairs = {key: np.concatenate([c[key] for c in pair_cohorts]) for key in PAIR_COLUMNS}
+    altruists = {key: np.concatenate([c[key] for c in altruist_cohorts]) for key in ALTRUIST_COLUMNS}
+    return ArrivalStream(pairs, [len(c['cpra']) for c in pair_cohorts], altruists, altruist_counts)
+
+
+def read_arrival_stream(path, perish_rng=np.random):
+    """
+    reads an arrival stream written by ArrivalStream.save, or an external arrival trace in .csv format
+    :param path: the path of a .npz or .csv file
+    :param perish_rng: the random generator the time_to_critical values missing from a trace are drawn from
+    :return: an ArrivalStream
+    """
+    if path.endswith('.csv'):
+        return read_arrival_trace(path, perish_rng)
+    with np.load(path) as data:
+        pairs = {key: data['pair_' + key] for key in PAIR_COLUMNS}
+        altruists = {key: data['altruist_' + key] for key in ALTRUIST_COLUMNS}
+        return ArrivalStream(pairs, data['pair_counts'], altruists, data['altruist_counts'])
+
+
+def read_arrival_trace(path, perish_rng=np.random):
+    """
+    reads an external (e.g. historical) arrival trace
+    the file has a header and one row per arrival with the columns
+        period, altruist, recipient_type, donor_type, cpra, patient_age, donor_age, dialysis_days, province, time_to_critical
+    period is -1 for the starting pool (which has no altruists), altruist is 0 or 1, blood types and provinces are
+    written as in the Participant class ('A', 'ON', ...). The recipient columns of altruists are ignored.
+    time_to_critical is optional, see parse_rows
+    :param path: the path of the .csv file
+    :param perish_rng: the random generator missing time_to_critical values are drawn from
+    :return: an ArrivalStream
+    :raise ValueError: if a row has a period below -1, or an altruist row has period -1
+    """
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    periods = np.array([int(row['period']) for row in rows], dtype=np.int64)
+    is_altruist = np.array([int(row['altruist']) == 1 for row in rows], dtype=bool)
+    # only pairs can be in the starting pool
+    bad = np.flatnonzero((periods < -1) | (is_altruist & (periods < 0)))
+    if len(bad) > 0:
+        raise ValueError("Row {} of the arrival trace has period {}, which is not valid for {}".format(
+            bad[0] + 1, periods[bad[0]], "an altruist" if is_altruist[bad[0]] else "a pair"))
+    order = np.argsort(periods, kind='stable')
+    pair_rows = [rows[i] for i in order if not is_altruist[i]]
+    altruist_rows = [rows[i] for i in order if is_altruist[i]]
+    num_periods = int(periods.max()) + 1 if len(rows) > 0 else 0
+
+    first_pairs = np.array([int(row['period']) == -1 for row in pair_rows], dtype=bool)
+    (pairs, altruists) = parse_rows(pair_rows, altruist_rows, perish_rng, first_pairs)
+    pair_counts = np.bincount(periods[~is_altruist] + 1, minlength=num_periods + 1)
+    altruist_counts = np.bincount(periods[is_altruist], minlength=num_periods)
+    return ArrivalStream(pairs, pair_counts, altruists, altruist_counts)
+
+
+def parse_rows(pair_rows, altruist_rows, perish_rng=np.random, first_pairs=None):
+    """
+    converts the rows of a .csv file of pairs and altruists into attribute arrays
+    numbers may be written as floats ("123.0") and time_to_critical may be missing or empty (e.g. in registry
+    extracts), it is then drawn from perish_rng the way Population.sample_cohort and sample_altruists draw it
+    :param pair_rows: a list of dictionaries with the columns recipient_type, donor_type, cpra, patient_age, donor_age,
+           dialysis_days, province and optionally time_to_critical, as written in the Participant class
+    :param altruist_rows: a list of dictionaries with the columns donor_type, donor_age and optionally time_to_critical
+    :param perish_rng: the random generator missing time_to_critical values are drawn from
+    :param first_pairs: a boolean array, True for the pair rows of a starting pool, all of them if None
+    :return: a dictionary of the PAIR_COLUMNS arrays and a dictionary of the ALTRUIST_COLUMNS arrays
+    """
+    if first_pairs is None:
+        first_pairs = np.ones(len(pair_rows), dtype=bool)
+    cpra = number_column(pair_rows, 'cpra', np.float64)
+    pairs = {
+        'cpra_index': cpra_band(cpra),
+        'cpra': cpra,
+        'donor_type': np.array([BLOOD_TYPES.index(row['donor_type'].strip()) for row in pair_rows], dtype=np.int8),
+        'recipient_type': np.array([BLOOD_TYPES.index(row['recipient_type'].strip()) for row in pair_rows],
+                                   dtype=np.int8),
+        'dialysis_days': number_column(pair_rows, 'dialysis_days', np.int32),
+        'donor_age': number_column(pair_rows, 'donor_age', np.int16),
+        'patient_age': number_column(pair_rows, 'patient_age', np.int16),
+        'time_to_critical': time_to_critical_column(pair_rows, first_pairs, perish_rng),
+        'province': np.array([PROVINCES.index(row['province'].strip()) for row in pair_rows], dtype=np.int8),
+    }
+    altruists = {
+        'donor_age': number_column(altruist_rows, 'donor_age', np.int16),
+        'donor_type': np.array([BLOOD_TYPES.index(row['donor_type'].strip()) for row in altruist_rows], dtype=np.int8),
+        'time_to_critical': time_to_critical_column(altruist_rows, np.zeros(len(altruist_rows), dtype=bool),
+                                                    perish_rng),
+    }
+    return pairs, altruists
+
+
+def number_column(rows, name, dtype):
+    """
+    :return: the values of a column of .csv rows as an array of dtype, integers may be written as floats
+    """
+    values = np.array([float(row[name]) for row in rows], dtype=np.float64)
+    if np.issubdtype(dtype, np.integer):
+        values = np.rint(values)
+    return values.astype(dtype)
+
+
+def time_to_critical_column(rows, first, perish_rng):
+    """
+    :param rows: rows of a .csv file, with or without a time_to_critical column
+    :param first: a boolean array, True for the rows of pairs of a starting pool
+    :param perish_rng: the random generator missing values are drawn from
+    :return: the time_to_critical values of the rows as an array, drawn with draw_time_to_critical where missing
+    """
+    values = np.array([float((row.get('time_to_critical') or '').strip() or 'nan') for row in rows], dtype=np.float64)
+    missing = np.isnan(values)
+    for flag in [True, False]:
+        draw = missing & (first == flag)
+        if np.any(draw):
+            values[draw] = draw_time_to_critical(int(np.sum(draw)), flag, perish_rng)
+    return np.rint(values).astype(np.int32)
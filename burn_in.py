@@ -0,0 +1,178 @@
+import copy
+import multiprocessing
+import os
+import sys
+import tempfile
+import numpy as np
+import config
+import simulations as s
+from market_metrics import Metrics
+from participant import RECIPIENT, ALTRUIST
+from population import cpra_band
+from checkpoint import save_checkpoint, load_checkpoint, METRICS_SKIPPED
+from config import NUM_ALTRUISTS, NUM_PERIODS
+
+"""
+Runs the burn-in of a simulation once and continues it with several policies
+Every branch starts from the market at the end of the burn-in and draws the same arrivals after it, so the policies
+are compared on the same pool. Where the fork start method is available, each branch runs in a process forked from
+the one that ran the burn-in and shares its memory copy-on-write. Elsewhere the burn-in is saved as a checkpoint and
+the branches are restored from it one after the other
+The results file of the burn-in is closed when it branches, so it holds the burn-in periods. Every branch writes a file
+of its own (named by its number) with only the periods after the burn-in, its totals continuing those of the burn-in
+"""
+
+# the directory of the simulation modules, whose copies of config values are changed by apply_config
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# the simulation at the end of the burn-in, inherited by the forked branches
+_burn_in = None
+
+
+def apply_config(overrides):
+    """
+    changes config values, in config and in every module of the simulation that imported them from config
+    :param overrides: a dictionary of config names and their new values, e.g. {'ALGORITHM': 'LP', 'CYCLE_CAP': 3}
+    :return: a dictionary of the previous values, to undo the changes with apply_config
+    """
+    previous = dict()
+    for (name, value) in overrides.items():
+        previous[name] = getattr(config, name)
+        for module in list(sys.modules.values()):
+            path = getattr(module, '__file__', None)
+            if path is not None and os.path.abspath(path).startswith(SOURCE_DIR) and hasattr(module, name):
+                setattr(module, name, value)
+    return previous
+
+
+def reweigh_pairs(population):
+    """
+    recalculates the weights of all the pairs of the population with its current weight table, e.g. after WEIGHTS has
+    changed. Altruists keep their weight
+    :param population: a Population
+    """
+    population.update_weight_tensor()
+    table = population.table
+    flags = table.column('flags')
+    recipients = np.flatnonzero(((flags & RECIPIENT) != 0) & ((flags & ALTRUIST) == 0) & (table.column('partner') >= 0))
+    donors = table.column('partner')[recipients]
+    blood_type = table.column('blood_type')
+    weights = population.calculate_weights(cpra_band(table.column('cpra')[recipients]), blood_type[donors],
+                                           blood_type[recipients])
+    with table.lock:
+        table.column('weight')[recipients] = weights
+        table.column('weight')[donors] = weights
+
+
+def start_branch(simulation, overrides, branch_num):
+    """
+    switches a simulation at the end of its burn-in to the policy of a branch
+    :param simulation: a Simulations instance
+    :param overrides: the config values of the branch, CYCLE_CAP, CHAIN_CAP and NUM_ALTRUISTS are applied to the
+           simulation and WEIGHTS to the pairs and edges already in the market
+    :param branch_num: the number of the branch, which names its results file
+    """
+    apply_config(overrides)
+    market = simulation.market
+    market.max_cycle_size = overrides.get('CYCLE_CAP', market.max_cycle_size)
+    market.max_path_size = overrides.get('CHAIN_CAP', market.max_path_size)
+    simulation.altruists = overrides.get('NUM_ALTRUISTS', simulation.altruists)
+    if 'WEIGHTS' in overrides:
+        reweigh_pairs(simulation.population)
+        market.refresh_weights()
+    # the branch writes its own results file, with the rows of its periods only but continuing the counts of the burn-in
+    metrics = Metrics(num_altruists=simulation.altruists, per_period=simulation.per_period,
+                      weights=market.metrics.weights, run_num=branch_num, max_cycle_size=market.max_cycle_size,
+                      max_path_size=market.max_path_size)
+    for (key, value) in vars(market.metrics).items():
+        if key not in METRICS_SKIPPED:
+            setattr(metrics, key, copy.deepcopy(value))
+    market.metrics = metrics
+
+
+def branch_results(simulation, overrides):
+    """
+    :return: a dictionary of the results of a branch that has been run to the end
+    """
+    return {'overrides': overrides, 'cycle_chain_matches': simulation.cycle_chain_matches,
+            'total_num_matched': simulation.market.metrics.total_num_matched,
+            'total_wait_time': simulation.market.total_wait_time, 'total_altruists': simulation.total_altruists}
+
+
+def run_forked_branch(branch_num, overrides):
+    """
+    runs a branch in a process forked from the one that ran the burn-in
+    """
+    start_branch(_burn_in, overrides, branch_num)
+    _burn_in.run()
+    return branch_results(_burn_in, overrides)
+
+
+def run_restored_branch(path, burn_in, branch_num, overrides):
+    """
+    runs a branch in this process, from the checkpoint of the burn-in
+    :param path: the path of the checkpoint
+    :param burn_in: the simulation that ran the burn-in, whose construction arguments are reused
+    """
+    previous = apply_config(overrides)
+    try:
+        simulation = s.Simulations(altruists=burn_in.altruists, per_period=burn_in.per_period,
+                                   weights=burn_in.population.weights, seed_num=burn_in.seed,
+                                   arrival_stream=burn_in.arrival_stream)
+        simulation.next_period = load_checkpoint(path, simulation)
+        start_branch(simulation, overrides, branch_num)
+        simulation.run()
+        return branch_results(simulation, overrides)
+    finally:
+        apply_config(previous)
+
+
+def run_branches(simulation, branches, processes=None):
+    """
+    continues a simulation at the end of its burn-in with every branch, up to NUM_PERIODS
+    the simulation itself is left at the end of the burn-in, with its results file closed
+    :param simulation: a Simulations instance that has run its burn-in periods
+    :param branches: a list of dictionaries of config overrides, one per branch, with keys among CYCLE_CAP,
+           CHAIN_CAP, ALGORITHM, WEIGHTS and NUM_ALTRUISTS
+    :param processes: the number of branches run at the same time when forking, all of them if None
+    :return: a list of the results of the branches, as given by branch_results
+    """
+    global _burn_in
+    # closed before forking, so that no branch inherits the open workbook of the burn-in
+    simulation.market.metrics.close_table()
+    if 'fork' in multiprocessing.get_all_start_methods():
+        _burn_in = simulation
+        # every worker runs a single branch, so each branch is forked from the unchanged burn-in
+        context = multiprocessing.get_context('fork')
+        with context.Pool(processes or len(branches), maxtasksperchild=1) as pool:
+            results = pool.starmap(run_forked_branch, enumerate(branches), chunksize=1)
+        _burn_in = None
+        return results
+    (handle, path) = tempfile.mkstemp(suffix='.npz')
+    os.close(handle)
+    try:
+        save_checkpoint(path, simulation, simulation.next_period)
+        return [run_restored_branch(path, simulation, i, overrides) for (i, overrides) in enumerate(branches)]
+    finally:
+        os.remove(path)
+
+
+def burn_in_and_branch(branches, burn_in_periods, seed=None, altruists=NUM_ALTRUISTS, per_period=1, processes=None):
+    """
+    runs the burn-in of a simulation and continues it with every branch
+    :param branches: a list of dictionaries of config overrides, see run_branches
+    :param burn_in_periods: the number of periods run before branching
+    :param seed: the seed of the simulation
+    :param altruists: the mean number of altruists of the burn-in
+    :param per_period: altruists enter the market every per_period periods
+    :param processes: the number of branches run at the same time when forking
+    :return: a list of the results of the branches
+    """
+    simulation = s.Simulations(altruists=altruists, per_period=per_period, seed_num=seed)
+    simulation.run(min(burn_in_periods, NUM_PERIODS))
+    return run_branches(simulation, branches, processes)
+
+
+if __name__ == '__main__':
+    for result in burn_in_and_branch([{'CYCLE_CAP': i} for i in [2, 3, 4]], burn_in_periods=NUM_PERIODS // 2, seed=0):
+        print(result)
@@ -0,0 +1,175 @@
+import json
+import numpy as np
+from participant import DONOR
+from pair_graph import PairGraph
+from altruist_registry import AltruistRegistry
+from period_delta import PeriodDelta
+from random_streams import STREAM_NAMES
+
+"""
+Saves the full state of a simulation at a period boundary to a single .npz file, and restores it
+The participants, the compatibility graph and the lists of the market are stored as arrays, in the order the market
+keeps them, and the scalars (counters, random generator states, metrics accumulators) as a JSON string in the same file
+Saving and loading are O(participants + edges) and a restored simulation continues exactly as the original would have
+The results workbook of the metrics cannot be reopened, so after a restore it only has the rows of the periods run
+since then
+"""
+
+# attributes of the metrics that are not accumulators
+METRICS_SKIPPED = ['workbook', 'worksheet', 'weights']
+
+
+def to_json(value):
+    """
+    converts numpy arrays and scalars (e.g. in the state of a bit generator) into values JSON can store
+    """
+    if isinstance(value, np.ndarray):
+        return {'__array__': value.tolist(), 'dtype': str(value.dtype)}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {key: to_json(item) for (key, item) in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    return value
+
+
+def from_json(value):
+    """
+    reverses to_json
+    """
+    if isinstance(value, dict):
+        if '__array__' in value:
+            return np.array(value['__array__'], dtype=value['dtype'])
+        return {key: from_json(item) for (key, item) in value.items()}
+    if isinstance(value, list):
+        return [from_json(item) for item in value]
+    return value
+
+
+def save_checkpoint(path, simulation, next_period):
+    """
+    writes the state of a simulation between two periods
+    :param path: the path of the .npz file
+    :param simulation: a Simulations instance
+    :param next_period: the number of the next period to run
+    """
+    market = simulation.market
+    table = market.table
+    graph = market.graph
+    arrays = {'table_' + name: table.column(name) for name in table.columns}
+
+    # the edges in the order of the successors of every vertex, and the order of the predecessors of every vertex
+    vertices = graph.vertices()
+    out_edges = [index for vertex in vertices for index in graph.out_edges[vertex].values()]
+    arrays['graph_vertices'] = np.array(vertices, dtype=np.int64)
+    arrays['graph_edges'] = np.array(out_edges, dtype=np.int64)
+    for name in ['sources', 'targets', 'weights', 'donor_rows', 'recipient_rows']:
+        arrays['graph_' + name] = getattr(graph, name)[arrays['graph_edges']]
+    arrays['graph_in_degrees'] = np.array([graph.in_degree(vertex) for vertex in vertices], dtype=np.int64)
+    arrays['graph_predecessors'] = np.array([source for vertex in vertices for source in graph.in_edges[vertex]],
+                                            dtype=np.int64)
+
+    arrays['participants'] = np.array([p.row for p in market.participants], dtype=np.int64)
+    buckets = [bucket for buckets in [market.donor_buckets, market.recipient_buckets] for bucket in buckets.values()]
+    arrays['bucket_rows'] = np.array([p.row for bucket in buckets for p in bucket], dtype=np.int64)
+    arrays['bucket_orders'] = np.array([order for bucket in buckets for order in bucket.values()], dtype=np.int64)
+    arrays['pair_dict'] = np.array([p.row for p in market.pair_dict.values()], dtype=np.int64)
+    arrays['expiry_queue'] = np.array(market.expiry_queue, dtype=np.int64).reshape(-1, 3)
+    arrays['altruists'] = np.array([(recipient.row, donor.row) for (recipient, donor) in market.altruists],
+                                   dtype=np.int64).reshape(-1, 2)
+    arrays['wait_times'] = np.array(market.wait_times, dtype=np.int64)
+
+    seed_sequence = market.random_streams.seed_sequence
+    state = {
+        'next_period': next_period,
+        'population_count': simulation.population.count,
+        'table_clock': table.clock,
+        'num_entered': market.num_entered,
+        'clock': market.clock,
+        'num_added': market.num_added,
+        'total_wait_time': market.total_wait_time,
+        'cycle_chain_matches': simulation.cycle_chain_matches,
+        'total_altruists': simulation.total_altruists,
+        'metrics': {key: value for (key, value) in vars(market.metrics).items() if key not in METRICS_SKIPPED},
+        'random_streams': {name: market.random_streams.stream(name).bit_generator.state for name in STREAM_NAMES},
+        'seed_sequence': {'entropy': seed_sequence.entropy, 'spawn_key': seed_sequence.spawn_key,
+                          'pool_size': seed_sequence.pool_size,
+                          'n_children_spawned': seed_sequence.n_children_spawned},
+    }
+    arrays['state'] = np.array(json.dumps(to_json(state)))
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+def checkpoint_period(path):
+    """
+    :param path: the path of a .npz file written by save_checkpoint
+    :return: the number of the next period to run of the simulation saved, without restoring it
+    """
+    with np.load(path) as data:
+        return from_json(json.loads(str(data['state'])))['next_period']
+
+
+def load_checkpoint(path, simulation):
+    """
+    restores the state of a simulation written by save_checkpoint
+    the simulation must have been created with the same configuration (and arrival stream, if any) as the one saved
+    :param path: the path of the .npz file
+    :param simulation: a Simulations instance, whose population, market and random streams are overwritten
+    :return: the number of the next period to run
+    """
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files}
+    state = from_json(json.loads(str(arrays['state'])))
+    market = simulation.market
+    table = market.table
+
+    # the population and the market share the table, so it is restored in place
+    with table.lock:
+        for name in table.columns:
+            table.columns[name] = arrays['table_' + name].copy()
+        table.size = len(table.columns['id_num'])
+        table.clock = state['table_clock']
+    simulation.population.count = state['population_count']
+
+    graph = PairGraph(capacity=max(1024, len(arrays['graph_edges'])))
+    for vertex in arrays['graph_vertices'].tolist():
+        graph.add_vertex(vertex)
+    graph.add_edges(arrays['graph_sources'], arrays['graph_targets'], arrays['graph_weights'],
+                    arrays['graph_donor_rows'], arrays['graph_recipient_rows'])
+    start = 0
+    for (vertex, degree) in zip(arrays['graph_vertices'].tolist(), arrays['graph_in_degrees'].tolist()):
+        sources = arrays['graph_predecessors'][start:start + degree].tolist()
+        graph.in_edges[vertex] = {source: graph.out_edges[source][vertex] for source in sources}
+        start += degree
+    market.graph = graph
+
+    market.participants = table.views(arrays['participants'])
+    market.donor_buckets = {blood_type: dict() for blood_type in market.donor_buckets}
+    market.recipient_buckets = {blood_type: dict() for blood_type in market.recipient_buckets}
+    for (participant, order) in zip(table.views(arrays['bucket_rows']), arrays['bucket_orders'].tolist()):
+        buckets = market.donor_buckets if table.get(participant.row, 'flags') & DONOR else market.recipient_buckets
+        buckets[participant.blood_type][participant] = order
+    market.pair_dict = {p.id_num: p for p in table.views(arrays['pair_dict'])}
+    market.expiry_queue = [tuple(entry) for entry in arrays['expiry_queue'].tolist()]
+    market.altruists = AltruistRegistry()
+    market.altruists.extend([(table.view(recipient), table.view(donor))
+                             for (recipient, donor) in arrays['altruists'].tolist()])
+    market.wait_times = arrays['wait_times'].tolist()
+    market.num_entered = state['num_entered']
+    market.clock = state['clock']
+    market.num_added = state['num_added']
+    market.total_wait_time = state['total_wait_time']
+    market.delta = PeriodDelta()
+    market.last_delta = None
+    for (key, value) in state['metrics'].items():
+        setattr(market.metrics, key, value)
+    simulation.cycle_chain_matches = state['cycle_chain_matches']
+    simulation.total_altruists = state['total_altruists']
+
+    # the generators are shared by the simulation, the market and the population, so their states are set in place
+    for (name, generator_state) in state['random_streams'].items():
+        market.random_streams.stream(name).bit_generator.state = generator_state
+    market.random_streams.seed_sequence = np.random.SeedSequence(**state['seed_sequence'])
+    return state['next_period']
@@ -44,6 +44,10 @@ TIME_TO_CRITICAL_LOW = 70
 
 RESULTS_PATH = "Results/FinalTests"
 DATA_PATH = "data"
+# directory of the pre-generated arrival streams, one file per seed. If None, arrivals are generated while the simulation runs
+ARRIVAL_STREAM_PATH = None
+# pool snapshot the market starts from instead of START_SIZE generated pairs (see pool_loader.py), None to generate it
+INITIAL_POOL_PATH = None
 
 ### SIMULATION CONFIGURATIONS ###
 
@@ -61,6 +65,34 @@ PERIOD_LENGTH = 4
 # standard number of matching periods is 100
 NUM_PERIODS = 50
 
+# sample each period's new pairs and altruists as arrays in one batch instead of one at a time
+# note that the random numbers are consumed in a different order, so results for a given seed change
+BATCH_GENERATION = False
+# generate the next period's arrivals in a background thread while the current period is matched
+# the arrivals have their own random streams, so results for a given seed are the same with or without prefetching
+PREFETCH_ARRIVALS = False
+# crossmatch all the pairs arriving together in one vectorized block (see Market.add_pairs)
+# note that the random numbers are consumed in a different order, so results for a given seed change
+BULK_CROSSMATCH = False
+
+# directory the state of a simulation is saved to every CHECKPOINT_EVERY periods (see checkpoint.py), a simulation
+# finding its unfinished checkpoint there when it starts continues from it. Only simulations with a seed are
+# checkpointed. None to disable checkpoints
+CHECKPOINT_PATH = None
+CHECKPOINT_EVERY = 1
+
+# number of periods run once before policies are compared from the same market (see burn_in.py and testcyclesize.py)
+# 0 to run every policy from the start
+BURN_IN_PERIODS = 0
+
+# regions of the regional mode (see regions.py), each pooling the pairs of its provinces in a market of its own
+REGIONS = {'West': ['BC', 'AL', 'SK', 'MN'], 'Ontario': ['ON'], 'Quebec': ['QC'], 'Atlantic': ['NS', 'NB', 'PEI', 'NFL']}
+# the residual pools of the regions are matched together every EXCHANGE_EVERY periods, 0 for no cross-region exchange
+# (an exchange every period of all the pairs is close to a national pool)
+# only pairs whose recipient has a cpra of at least EXCHANGE_CPRA take part in it (0 for all pairs), altruists always do
+EXCHANGE_EVERY = 0
+EXCHANGE_CPRA = 0.85
+
 # number of altruists per period. If use random sample, the mean is 4.562
 NUM_ALTRUISTS = 4.562
 
@@ -86,6 +118,16 @@ ALGORITHM = "FAST"
 # either 'KPD' for the current Canadian KPD weights, 'OPT' for the optimized weights, or when training optimized weights, 'CONST' for constant weights
 WEIGHTS = "KPD"
 
+# optional terms of the KPD weights, each adds to the weight of an edge
+# KPD_AGE_TERM: 75 if the recipient is 18 or younger
+# KPD_PROVINCE_TERM: 25 if the donor and the recipient are from the same province
+# KPD_AGE_DIFFERENCE_TERM: 5 if the donor and the recipient are at most 30 years apart
+# KPD_DIALYSIS_TERM: 1 per month the recipient has been on dialysis, refreshed every period
+KPD_AGE_TERM = False
+KPD_PROVINCE_TERM = False
+KPD_AGE_DIFFERENCE_TERM = False
+KPD_DIALYSIS_TERM = False
+
 # An indicator for printing the ip solver characters
 PRINT = False
 
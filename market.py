@@ -2,11 +2,18 @@ import networkx as nx
 import matplotlib.pyplot as plt
 import numpy as np
 import numpy.random as random
-from config import PERIOD_LENGTH, PERISH, WEIGHTS, ALGORITHM, REUSE_RATE,TIME_TO_CRITICAL_LOW,ALT_WEIGHT, START_SIZE,ARRIVAL_RATE, NUM_PERIODS
+from config import BULK_CROSSMATCH, KPD_AGE_TERM, KPD_PROVINCE_TERM, KPD_AGE_DIFFERENCE_TERM, KPD_DIALYSIS_TERM, PERIOD_LENGTH, PERISH, WEIGHTS, ALGORITHM, REUSE_RATE,TIME_TO_CRITICAL_LOW,ALT_WEIGHT, START_SIZE,ARRIVAL_RATE, NUM_PERIODS
 import algorithms.max_matching as mm
 import market_metrics as met
-from participant import Participant
+from participant import BLOOD_TYPES, ABO_COMPATIBLE, DONOR, RECIPIENT, ALTRUIST
+from participant_table import ParticipantTable
+from pair_graph import PairGraph
+from altruist_registry import AltruistRegistry
+from period_delta import PeriodDelta
+from random_streams import RandomStreams
 import statistics
+import heapq
+import math
 
 
 
@@ -19,22 +26,67 @@ class Market:
     ----------
     participants: list<(Participant, Participant)>
         a list of all the participants in the market
-    graph: Digraph
-        a networkx directed graph
+    graph: PairGraph
+        the compatibility graph, with one vertex per pair or altruist (its id_num) and an edge u -> v if the donor of
+        u can give to the recipient of v. The edge weights are stored in it, computed in bulk by edge_weights
     metrics: Metrics
         a Metrics instance, which tracks all the stats for the market
-    altruists: list<(Participant, Participant)>
-        a list of all the altruists in the market
+    altruists: AltruistRegistry
+        all the altruists in the market, keyed by id_num
+    random_streams: RandomStreams
+        the random number streams of the simulation; crossmatches are drawn from random_state, its crossmatch stream
+    table: ParticipantTable
+        the table the participants are stored in, participants in the market have their alive flag set
+    recipient_buckets: dict<string, dict<Participant, int>>
+        the recipients in the market by blood type, each mapped to the order in which it entered the market
+    donor_buckets: dict<string, dict<Participant, int>>
+        the donors in the market by blood type, each mapped to the order in which it entered the market
+    pair_dict: dict<int, Participant>
+        the donors in the market keyed by id_num, in the order they entered the market
+    clock: int
+        the number of periods the market has been aged by
+    delta: PeriodDelta
+        the changes made to the graph since the end of the last period, those made before the first period (the
+        initial pool) are part of the delta of the first period
+    last_delta: PeriodDelta
+        the changes made to the graph during the last period run, None before the first period
+    delta_listeners: list<function>
+        functions called with last_delta at the end of every period
+    pending_arrivals: Future
+        the arrivals of the next period if they are being added to the table by another thread (see
+        Simulations.run), None otherwise. Rows added by the market itself wait for them, so the rows are in the same
+        order in every run
+    expiry_queue: list<(int, int, int)>
+        if PERISH is set, a heap of (expiry, order, row): the clock at which a participant will have been in the market
+        for its time_to_critical, the order in which it entered the market and its row in the table
     """
 
-    def __init__(self, pairs, num_altruists, per_period, weights=None, run_num=-1, max_cycle_size=3, max_path_size=3):
-        self.random_state = random.RandomState()
-        self.graph = nx.DiGraph()
+    def __init__(self, pairs, num_altruists, per_period, weights=None, run_num=-1, max_cycle_size=3, max_path_size=3, random_streams=None, table=None, metrics=None):
+        if random_streams is None:
+            random_streams = RandomStreams()
+        self.random_streams = random_streams
+        if table is None:
+            table = pairs[0][0].table if len(pairs) > 0 else ParticipantTable()
+        self.table = table
+        self.random_state = random_streams.crossmatch
+        self.graph = PairGraph()
         self.participants = list()
-        self.metrics = met.Metrics(num_altruists=num_altruists, per_period=per_period, weights=weights, run_num=run_num, max_cycle_size=max_cycle_size, max_path_size=max_path_size)
-        for (recipient, donor) in pairs:
-            self.add_pair((recipient, donor))
-        self.altruists = list()
+        self.recipient_buckets = {blood_type: dict() for blood_type in BLOOD_TYPES}
+        self.donor_buckets = {blood_type: dict() for blood_type in BLOOD_TYPES}
+        self.num_entered = 0
+        self.pair_dict = dict()
+        self.clock = 0
+        self.expiry_queue = list()
+        self.delta = PeriodDelta()
+        self.last_delta = None
+        self.delta_listeners = list()
+        self.pending_arrivals = None
+        # markets sharing a results file (e.g. the cross-region exchanges) are given the Metrics writing it
+        if metrics is None:
+            metrics = met.Metrics(num_altruists=num_altruists, per_period=per_period, weights=weights, run_num=run_num, max_cycle_size=max_cycle_size, max_path_size=max_path_size)
+        self.metrics = metrics
+        self.add_pairs(pairs)
+        self.altruists = AltruistRegistry()
         self.num_added = 0
         self.total_wait_time = 0
         self.wait_times = list()
@@ -49,6 +101,9 @@ class Market:
         Updates the market at the end of the period
         :param new_participants: the new agents to add to the market at the end of the matching
         """
+        # changes made since the end of the last period (e.g. the initial pool, or a cross-region exchange) belong to
+        # this period
+        self.delta.period = period_num
         # Run matching algorithms
         self.update(added_pairs=list(), matched_pairs=list(), altruists=new_altruists, update_time = False)
         bigraph = mm.MaxMatching(self, max_cycle_size=self.max_cycle_size, max_path_size=self.max_path_size)
@@ -74,24 +129,25 @@ class Market:
                 num_matches = num_matches + (i+2)*cycle_path_lengths[0][i]
             num_matches = num_matches + cycle_path_lengths[1][0]
         # preserved donor becomes new altruists
+        bridge_altruists = list()
         if REUSE_RATE != 0:
+            # the bridge rows go after those of the arrivals being prefetched, not in between them
+            if self.pending_arrivals is not None:
+                self.pending_arrivals.result()
             for donor in preserved_donors:
-                use = np.random.choice([False, True], p=[1-REUSE_RATE, REUSE_RATE])
+                use = self.random_streams.reuse.choice([False, True], p=[1-REUSE_RATE, REUSE_RATE])
                 if not use:
                    continue
                 donor.altruist = True
-                time_to_critical = int(np.random.poisson(lam=TIME_TO_CRITICAL_LOW, size=1))
-                recipient = Participant(donor.id_num, blood_type='X', donor=False, recipient=True, altruist = True,
+                time_to_critical = int(self.random_streams.bridge.poisson(lam=TIME_TO_CRITICAL_LOW, size=1))
+                recipient = self.table.add(donor.id_num, blood_type='X', donor=False, recipient=True, altruist = True,
                                        time_to_critical=time_to_critical, weight=ALT_WEIGHT, cpra=0, dialysis_days=0)
-                new_altruist = (recipient,donor)
-                new_altruists.append(new_altruist)
-        self.update(added_pairs=new_participants, matched_pairs=matches, altruists=list(),update_time = True)
+                bridge_altruists.append((recipient, donor))
+        self.update(added_pairs=new_participants, matched_pairs=matches, altruists=bridge_altruists, update_time = True)
         self.num_added = len(new_participants)
         total_unmatched_time = 0
         if period_num + 1 == NUM_PERIODS:
-            for p in self.participants:
-                if p.recipient and p.blood_type != "X":
-                    total_unmatched_time += p.time_in_market
+            total_unmatched_time = self.table.total_time_in_market()
 
         # update table
         if trial_table is None:
@@ -109,6 +165,10 @@ class Market:
 
         print("There remains {} pairs in the market (excluding altruists)".format(len(self.participants)/2))
 
+        self.last_delta = self.delta.finish()
+        self.delta = PeriodDelta(period_num + 1)
+        for listener in self.delta_listeners:
+            listener(self.last_delta)
         return cycle_path_lengths
 
 
@@ -118,50 +178,59 @@ class Market:
         adds a participant to the market
         :param participant: a participant to add to the market
         """
-        if not (participant in list(self.graph.nodes())):
+        if not participant.alive:
             self.add_node_to_graph(participant)
+        # the crossmatches are drawn one at a time, the weights of the edges found are computed together
+        neighbours = [p.row for p in self.compatible_candidates(participant)
+                      if participant.compatible(p, self.random_state) and (not participant.partner == p)]
+        if len(neighbours) == 0:
+            return
+        neighbours = np.array(neighbours)
+        this = np.full(len(neighbours), participant.row)
         if participant.donor:
-            for p in self.participants:
-                if p.recipient and participant.compatible(p,self.random_state) and (not participant.partner == p):
-                    participant.add_neighbour(p)
-                    weight = p.weight
-                    # penalize for altruist-patient edge
-                    if participant.altruist:
-                        weight = weight + ALT_WEIGHT
-                    if WEIGHTS == "KPD":
-                        weight = calculate_kpd_weight(donor=participant, recipient=p)
-                        if participant.altruist:
-                            print("altruist weight is = ", weight)
-                    # weight is determined by the recipient when determining who to match
-                    self.graph.add_weighted_edges_from([(participant, p, weight)])
+            self.add_edges(this, neighbours)
         # participant is patient
         else:
-            for p in self.participants:
-                if participant.blood_type == "X":
-                    break
-                if p.donor and participant.compatible(p, self.random_state) and (not participant.partner == p):
-                    p.add_neighbour(participant)
-                    weight = participant.weight
-                    # penalize for altruist-patient edge
-                    if p.altruist:
-                        weight = weight + ALT_WEIGHT
-                    if WEIGHTS == "KPD":
-                        weight = calculate_kpd_weight(donor=p, recipient=participant)
-                        if p.altruist:
-                            print("altruist weight is = ", weight)
-                    # weight is determined by the recipient when determining who to match
-                    self.graph.add_weighted_edges_from([(p, participant, weight)])
+            self.add_edges(neighbours, this)
 
     def add_node_to_graph(self, participant):
         """
-        adds a participant to the networkx bipartite graph
+        adds a participant to the market, and the vertex of its pair to the graph
         :param participant: participant to add to the graph
         """
-        if participant.donor:
-            self.graph.add_nodes_from([participant], bipartite=1)
-        elif participant.recipient:
-            self.graph.add_nodes_from([participant], bipartite=0)
+        if participant.id_num not in self.graph:
+            self.graph.add_vertex(participant.id_num)
+            self.delta.record_vertex_added(participant.id_num)
         self.participants.append(participant)
+        if participant.donor:
+            self.donor_buckets[participant.blood_type][participant] = self.num_entered
+            self.pair_dict[participant.id_num] = participant
+        else:
+            self.recipient_buckets[participant.blood_type][participant] = self.num_entered
+        if PERISH:
+            # the participant is checked after being aged at least once
+            periods = max(1, math.ceil((participant.time_to_critical - participant.time_in_market) / PERIOD_LENGTH))
+            heapq.heappush(self.expiry_queue, (self.clock + periods, self.num_entered, participant.row))
+        self.num_entered += 1
+        participant.alive = True
+
+    def compatible_candidates(self, participant):
+        """
+        finds the participants in the market a participant could have an edge with, based on blood types only
+        they are given in the order they entered the market, so the tissue-type tests draw from the random stream in
+        the same order as when every participant of the market was tested
+        :param participant: a donor or a recipient
+        :return: a list of the ABO-compatible recipients (if participant is a donor) or donors (if it is a recipient)
+        """
+        code = BLOOD_TYPES.index(participant.blood_type)
+        if participant.donor:
+            buckets = [self.recipient_buckets[t] for (i, t) in enumerate(BLOOD_TYPES) if ABO_COMPATIBLE[code, i]]
+        else:
+            buckets = [self.donor_buckets[t] for (i, t) in enumerate(BLOOD_TYPES) if ABO_COMPATIBLE[i, code]]
+        buckets = [[(order, p) for (p, order) in bucket.items()] for bucket in buckets if len(bucket) > 0]
+        if len(buckets) == 1:
+            return [p for (order, p) in buckets[0]]
+        return [p for (order, p) in heapq.merge(*buckets, key=lambda item: item[0])]
 
     def remove_participant(self, participant):
         """
@@ -169,47 +238,78 @@ class Market:
         :param participant: a participant to remove from the market
         """
         # avoid removing a participant more than once
-        if participant not in self.participants:
+        if not participant.alive:
+            return
+        self.detach_participant(participant)
+        self.altruists.remove_participant(participant)
+        self.participants.remove(participant)
+
+    def remove_pairs(self, matched_pairs, perished=False):
+        """
+        removes all the participants of a list of pairs or edges from the market at once
+        only the edges of the removed participants are touched, and the participant and altruist lists are
+        compacted once at the end instead of once per participant
+        :param matched_pairs: a list of tuples of participants
+        :param perished: True if the participants are removed because they perished rather than matched
+        """
+        removed = list()
+        for pair in matched_pairs:
+            for participant in pair:
+                # avoid removing a participant more than once
+                if participant.alive:
+                    self.detach_participant(participant, perished)
+                    removed.append(participant)
+        if len(removed) == 0:
             return
+        self.participants = [p for p in self.participants if p.alive]
+        for participant in removed:
+            self.altruists.remove_participant(participant)
+
+    def detach_participant(self, participant, perished=False):
+        """
+        removes a participant from the metrics, the blood type buckets and the graph, and clears its alive flag
+        the edges from a donor (or to a recipient) are removed, and the vertex of the pair once both are gone
+        :param participant: a participant in the market
+        :param perished: True if the participant is removed because it perished, for the period delta
+        """
         if participant.donor:
             # only update metrics for donors, so we don't update more than once
             self.metrics.update_blood_type_composition((participant.partner, participant), remove=True)
             self.metrics.update_cpra_composition((participant.partner, participant), remove=True)
-            for p in self.participants:
-                if p.recipient:
-                    participant.remove_neighbour(p)
-            if (participant.partner, participant) in self.altruists:
-                self.altruists.remove((participant.partner, participant))
+            del self.donor_buckets[participant.blood_type][participant]
+            del self.pair_dict[participant.id_num]
+            self.graph.remove_out_edges(participant.id_num)
         else:
-            for p in self.participants:
-                if p.donor:
-                    p.remove_neighbour(participant)
-            if (participant, participant.partner) in self.altruists:
-                self.altruists.remove((participant, participant.partner))
-        if participant in self.graph.nodes():
-            self.graph.remove_node(participant)
-        self.participants.remove(participant)
+            del self.recipient_buckets[participant.blood_type][participant]
+            self.graph.remove_in_edges(participant.id_num)
+        participant.alive = False
+        partner = participant.partner
+        if (partner is None or not partner.alive) and participant.id_num in self.graph:
+            self.graph.remove_vertex(participant.id_num)
+            self.delta.record_vertex_removed(participant.id_num, perished)
 
 
     def draw_market(self):
-        if len(self.graph.nodes()) > 0:
-            graph_pos = nx.spring_layout(self.graph, k=(1 / (0.9 * np.sqrt(len(
-                self.graph.nodes())))))
-        else:
-            graph_pos = nx.spring_layout(self.graph, k=0)
-        plt.clf()
-        plt.axis('off')
+        """
+        draws the compatibility graph of the market, with one node per pair labelled (recipient, donor)
+        """
+        graph = nx.DiGraph()
         my_labels = {}
         colours = list()
         for participant in self.participants:
-            my_labels[participant] = participant.blood_type
-            if participant.donor:
-                colours.append('y')
-            elif participant.recipient:
-                colours.append('g')
-            else:
-                colours.append('b')
-        nx.draw_networkx(self.graph, pos=graph_pos, with_labels=True, node_size=1000, node_color=colours, labels=my_labels,
+            if participant.donor and participant.id_num in self.graph:
+                graph.add_node(participant.id_num)
+                my_labels[participant.id_num] = participant.partner.blood_type + "," + participant.blood_type
+                colours.append('b' if participant.altruist else 'y')
+        graph.add_weighted_edges_from([edge for edge in self.graph.edges() if edge[0] in my_labels and edge[1] in my_labels])
+        if len(graph.nodes()) > 0:
+            graph_pos = nx.spring_layout(graph, k=(1 / (0.9 * np.sqrt(len(
+                graph.nodes())))))
+        else:
+            graph_pos = nx.spring_layout(graph, k=0)
+        plt.clf()
+        plt.axis('off')
+        nx.draw_networkx(graph, pos=graph_pos, with_labels=True, node_size=1000, node_color=colours, labels=my_labels,
                          font_size=7.5, font_weight='bold')
         plt.show()
 
@@ -220,21 +320,155 @@ class Market:
         :param recipient: Participant - the recipient of the patient-donor pair
         :param donor: Participant - the donor of the patient-donor pair
         """
-        pair[0].add_neighbour(pair[1])
         pair[0].partner = pair[1]
         pair[1].partner = pair[0]
         self.add_participant(pair[1])
         self.add_participant(pair[0])
-        self.graph.add_weighted_edges_from([(pair[0], pair[1], 1)])
         self.metrics.update_blood_type_composition(pair, remove=False)
         self.metrics.update_cpra_composition(pair, remove=False)
 
+    def add_pairs(self, pairs):
+        """
+        adds patient-donor pairs to the market
+        if BULK_CROSSMATCH is set, the pairs are crossmatched in one block: the ABO compatibility of the new donors with
+        all the recipients and of the old donors with the new recipients is looked up as a boolean matrix and all the
+        tissue-type tests are drawn at once. Every donor-recipient pair is still tested exactly once and with the same
+        probability as by add_pair, so the edges have the same distribution, but the draws are made in a different
+        order and the edges are not the same as those of calling add_pair for each of the pairs
+        :param pairs: a list of tuples of participants in the form (recipient, donor)
+        """
+        if not BULK_CROSSMATCH:
+            for pair in pairs:
+                self.add_pair(pair)
+            return
+        if len(pairs) == 0:
+            return
+        old_donors = self.table.live_rows(DONOR)
+        old_recipients = self.table.live_rows(RECIPIENT)
+        for (recipient, donor) in pairs:
+            recipient.partner = donor
+            donor.partner = recipient
+            self.add_node_to_graph(donor)
+            self.add_node_to_graph(recipient)
+            self.metrics.update_blood_type_composition((recipient, donor), remove=False)
+            self.metrics.update_cpra_composition((recipient, donor), remove=False)
+        new_donors = np.array([donor.row for (recipient, donor) in pairs])
+        new_recipients = np.array([recipient.row for (recipient, donor) in pairs])
+        all_recipients = np.concatenate((old_recipients, new_recipients))
+        donors, recipients = self.crossmatch(new_donors, all_recipients)
+        old_donors, new_recipients = self.crossmatch(old_donors, new_recipients)
+        donors = np.concatenate((donors, old_donors))
+        recipients = np.concatenate((recipients, new_recipients))
+        self.add_edges(donors, recipients)
+
+    def import_pairs(self, pairs, altruists=list(), donors=None, recipients=None, weights=None, block_size=2000):
+        """
+        adds a whole pool of pairs and altruists to the market at once, e.g. a snapshot read by pool_loader
+        if the edges are given they are added as they are, without crossmatching. The pool is then expected to be the
+        only thing in the market, edges with participants already in it are not looked for
+        otherwise the pairs are crossmatched block_size donors at a time, as with BULK_CROSSMATCH
+        :param pairs: a list of tuples of participants in the form (recipient, donor)
+        :param altruists: a list of tuples of participants in the form ("fake recipient", altruistic donor)
+        :param donors: array of the table rows of the donors of the edges, or None to crossmatch
+        :param recipients: array of the table rows of the recipients of the edges
+        :param weights: array of the weights of the edges, computed by edge_weights where missing (NaN) or if None
+        """
+        old_donors = self.table.live_rows(DONOR)
+        old_recipients = self.table.live_rows(RECIPIENT)
+        for (recipient, donor) in pairs + altruists:
+            recipient.partner = donor
+            donor.partner = recipient
+            self.add_node_to_graph(donor)
+            self.add_node_to_graph(recipient)
+            self.metrics.update_blood_type_composition((recipient, donor), remove=False)
+            self.metrics.update_cpra_composition((recipient, donor), remove=False)
+        self.altruists.extend(altruists)
+        if donors is not None:
+            if weights is None:
+                weights = self.edge_weights(donors, recipients)
+            else:
+                weights = np.array(weights, dtype=np.float64)
+                missing = np.isnan(weights)
+                if np.any(missing):
+                    weights[missing] = self.edge_weights(donors[missing], recipients[missing])
+            id_num = self.table.column('id_num')
+            self.graph.add_edges(id_num[donors], id_num[recipients], weights, donors, recipients)
+            self.delta.record_edges(id_num[donors], id_num[recipients], weights)
+            return
+        new_donors = np.array([donor.row for (recipient, donor) in pairs + altruists], dtype=np.int64)
+        new_recipients = np.array([recipient.row for (recipient, donor) in pairs], dtype=np.int64)
+        all_recipients = np.concatenate((old_recipients, new_recipients))
+        for start in range(0, len(new_donors), block_size):
+            self.add_edges(*self.crossmatch(new_donors[start:start + block_size], all_recipients))
+        for start in range(0, len(old_donors), block_size):
+            self.add_edges(*self.crossmatch(old_donors[start:start + block_size], new_recipients))
+
+    def crossmatch(self, donors, recipients):
+        """
+        tests every donor against every recipient, the tissue-type tests of all the ABO-compatible pairs are drawn in
+        one call to the crossmatch stream
+        :param donors: array of the table rows of the donors
+        :param recipients: array of the table rows of the recipients
+        :return: the arrays of donor rows and of recipient rows of the edges found
+        """
+        blood_type = self.table.column('blood_type')
+        abo = ABO_COMPATIBLE[blood_type[donors][:, None], blood_type[recipients][None, :]]
+        # a donor can't give to its own recipient
+        abo &= self.table.column('partner')[donors][:, None] != recipients[None, :]
+        (donor_idx, recipient_idx) = np.nonzero(abo)
+        donors = donors[donor_idx]
+        recipients = recipients[recipient_idx]
+        cpra = self.table.column('cpra')[recipients]
+        compatible = self.random_state.random(len(recipients)) < 1 - cpra
+        return donors[compatible], recipients[compatible]
+
+    def add_edges(self, donors, recipients):
+        """
+        adds the edges from donors to recipients to the market
+        :param donors: array of the table rows of the donors
+        :param recipients: array of the table rows of the recipients
+        """
+        id_num = self.table.column('id_num')
+        weights = self.edge_weights(donors, recipients)
+        self.graph.add_edges(id_num[donors], id_num[recipients], weights, donors, recipients)
+        self.delta.record_edges(id_num[donors], id_num[recipients], weights)
+
+    def edge_weights(self, donors, recipients):
+        """
+        calculates the weights of many edges at once from the columns of the table
+        :param donors: array of the table rows of the donors
+        :param recipients: array of the table rows of the recipients
+        :return: an array of weights
+        """
+        altruist = (self.table.column('flags')[donors] & ALTRUIST) != 0
+        if WEIGHTS != "KPD":
+            # weight is determined by the recipient when determining who to match
+            return self.table.column('weight')[recipients] + np.where(altruist, ALT_WEIGHT, 0)
+        blood_type = self.table.column('blood_type')
+        age = self.table.column('age')
+        province = self.table.column('province')
+        return calculate_kpd_weights(blood_type[donors], blood_type[recipients], self.table.column('cpra')[recipients],
+                                     altruist, donor_ages=age[donors], recipient_ages=age[recipients],
+                                     donor_provinces=province[donors], recipient_provinces=province[recipients],
+                                     dialysis_days=self.table.aged_column('dialysis_days')[recipients])
+
+    def refresh_weights(self):
+        """
+        recalculates the weights of all the edges of the market in one pass, for the terms that change over time
+        the new weights are recorded in the delta of the period
+        """
+        edges = self.graph.live_edges()
+        self.graph.weights[edges] = self.edge_weights(self.graph.donor_rows[edges], self.graph.recipient_rows[edges])
+        self.delta.record_weights(self.graph.sources[edges], self.graph.targets[edges], self.graph.weights[edges])
+
     def get_adj_list2(self):
         """
-        gets the adjacency matrix of the bipartite graph of this market
-        :return: the adjacency matrix
+        gets the weighted adjacency matrix of the pair graph of this market
+        :return: a scipy sparse matrix, whose rows and columns are the vertices in the order of graph.vertices()
         """
-        return nx.adjacency_matrix(self.graph)
+        from scipy.sparse import csr_matrix
+        vertices, indptr, indices, weights = self.graph.to_csr()
+        return csr_matrix((weights, indices, indptr), shape=(len(vertices), len(vertices)))
 
     def to_bipartite(self):
         """
@@ -243,28 +477,32 @@ class Market:
         """
         donors = list(filter(lambda x: x.donor, self.participants))
         recipients = list(filter(lambda x: x.recipient, self.participants))
+        recipient_of = {recipient.id_num: recipient for recipient in recipients}
         B = nx.DiGraph()
         B.add_nodes_from(recipients, bipartite=0)
         B.add_nodes_from(donors, bipartite=1)
-        for participant in self.participants:
-            for neighbour in participant.neighbours:
-                if participant.recipient:
-                    B.add_weighted_edges_from([(participant, neighbour, 0)])
-                else:
-                    B.add_weighted_edges_from([(participant, neighbour, 1)])
+        for recipient in recipients:
+            if recipient.partner is not None and recipient.partner.alive:
+                B.add_weighted_edges_from([(recipient, recipient.partner, 0)])
+        for donor in donors:
+            for id_num in self.graph.successors(donor.id_num):
+                B.add_weighted_edges_from([(donor, recipient_of[id_num], 1)])
         return B
 
     def remove_perished(self):
         """
         removes pairs from the market that have been in the market for their time_to_critical amount of time
+        only the participants due by the current clock are popped from the expiry queue, entries of participants that
+        have left the market since (or left and entered again) are skipped
         """
-        participants = self.participants
-        perished = list()
-        for p in participants:
-            if p.time_in_market >= p.time_to_critical:
-                perished.append(p)
-        for p in perished:
-            self.remove_participant(p)
+        rows = list()
+        while len(self.expiry_queue) > 0 and self.expiry_queue[0][0] <= self.clock:
+            (expiry, order, row) = heapq.heappop(self.expiry_queue)
+            participant = self.table.view(row)
+            buckets = self.donor_buckets if participant.donor else self.recipient_buckets
+            if participant.alive and buckets[participant.blood_type].get(participant) == order:
+                rows.append(row)
+        self.remove_pairs([(p,) for p in self.table.views(sorted(rows))], perished=True)
 
     def update(self, added_pairs=list(), matched_pairs=list(), altruists=list(), update_time=False):
         """
@@ -276,92 +514,70 @@ class Market:
         :return:
         """
         if update_time:
-            for p in self.participants:
-                p.time_in_market = p.time_in_market + PERIOD_LENGTH
-                if p.recipient:
-                    p.dialysis_days = p.dialysis_days + 30 * PERIOD_LENGTH
+            self.table.advance_time(PERIOD_LENGTH)
+            self.clock += 1
+            if WEIGHTS == "KPD" and KPD_DIALYSIS_TERM:
+                self.refresh_weights()
         if PERISH & update_time:
             self.remove_perished()
-        for pair in added_pairs:
-            self.add_pair(pair)
+        self.add_pairs(added_pairs)
         for pair in matched_pairs:
             if pair[0].recipient and (pair[0].blood_type!="X") and update_time:
                 self.wait_times.append(pair[0].time_in_market)
                 self.total_wait_time = self.total_wait_time + pair[0].time_in_market
-            self.remove_participant(pair[0])
-            self.remove_participant(pair[1])
-            if pair in altruists:
-                self.altruists.remove(pair)
-        for a in altruists:
-            self.add_pair(a)
-            self.altruists.append(a)
+        self.remove_pairs(matched_pairs)
+        self.add_pairs(altruists)
+        self.altruists.extend(altruists)
 
 
     def get_adj_list(self):
         """
-        Creates an adjacency list of all the participants in the market
+        Gives the adjacency list of all the participants in the market
         Each patient-donor pair is represented with their unique id_num
+        pair_dict is kept up to date as pairs enter and leave the market and the weights are stored in the graph,
+        so this only copies them and reads the successors of every donor from the graph, in O(E)
         :return: a dictionary where the id_nums are keys and the values are
-        the id_nums of the patients that the donor points to and a dictionary of
-        all the pair id and their pairs
-        """
-        # pairs are the keys
-        weights_list = {}
-        adj_list = {}
-        pair_dict = {}
-        vertex_list = list()
-        for participant in self.participants:
-            if participant.donor:
-                neigh_list = list()
-                for patient in participant.neighbours:
-                    neigh_list.append(patient.id_num)
-                    if WEIGHTS == 'KPD':
-                        weight = calculate_kpd_weight(participant, patient)
-                    else:
-                        weight = patient.weight
-                        if participant.altruist:
-                            weight += ALT_WEIGHT
-                    weights_list[(participant.id_num, patient.id_num)] = weight
-                adj_list[participant.id_num] = neigh_list
-                pair_dict[participant.id_num] = participant
-            if participant.id_num not in vertex_list:
-                vertex_list.append(participant.id_num)
-        return adj_list, pair_dict, weights_list, vertex_list
-
-    def get_alt_list(self):
-        """
-        :return: a list of the id_nums of all altruists
-        """
-        alt_list = list()
-        for alt in self.altruists:
-            alt_list.append(alt[1].id_num)
-        return alt_list
-
-
-def calculate_kpd_weight(donor, recipient):
-        """
-        calculates the weight of the edge connecting the donor to the recipient
-        this is the weight that the current canadian KPD program uses
-        :param donor: a participant object
-        :param recipient: a recipient object
-        :return: the weight as an float
-        """
-        
-        weight = 100
-        if recipient.cpra >= 0.80:
-            weight += 125
-        #if recipient.age <= 18:
-            #weight += 75
-        #if recipient.province == donor.province:
-           # weight += 25
-        #if abs(recipient.age - donor.age) <= 30:
-            #weight += 5
-        #weight += recipient.dialysis_days/30
-        if recipient.blood_type == 'O' and donor.blood_type == 'O':
-            weight += 75
-        elif donor.blood_type == recipient.blood_type:
-            weight += 5
-        if donor.altruist:
-            weight += ALT_WEIGHT
-        return int(weight)
+        the id_nums of the patients that the donor points to, a dictionary of
+        all the pair id and their pairs, a dictionary of the edge weights and a list of the vertices
+        """
+        adj_list = {id_num: self.graph.successors(id_num) for id_num in self.pair_dict}
+        edges = self.graph.live_edges()
+        weights_list = dict(zip(zip(self.graph.sources[edges].tolist(), self.graph.targets[edges].tolist()),
+                                self.graph.weights[edges].tolist()))
+        return adj_list, dict(self.pair_dict), weights_list, self.graph.vertices()
+
 
+def calculate_kpd_weights(donor_types, recipient_types, recipient_cpra, altruist, donor_ages=None, recipient_ages=None,
+                          donor_provinces=None, recipient_provinces=None, dialysis_days=None):
+        """
+        calculates the weights of many edges at once
+        this is the weight that the current canadian KPD program uses
+        the optional terms are added when their flag is set in config and their arrays are given
+        :param donor_types: array of donor blood type codes (see participant.BLOOD_TYPES)
+        :param recipient_types: array of recipient blood type codes
+        :param recipient_cpra: array of recipient cpra values
+        :param altruist: array of booleans, True if the donor is an altruist
+        :param donor_ages: array of donor ages
+        :param recipient_ages: array of recipient ages
+        :param donor_provinces: array of donor province codes
+        :param recipient_provinces: array of recipient province codes
+        :param dialysis_days: array of the days the recipients have been on dialysis
+        :return: an array of integer weights
+        """
+        weight = np.full(len(donor_types), 100, dtype=np.int64)
+        weight += np.where(recipient_cpra >= 0.80, 125, 0)
+        if KPD_AGE_TERM and recipient_ages is not None:
+            weight += np.where(recipient_ages <= 18, 75, 0)
+        if KPD_PROVINCE_TERM and donor_provinces is not None:
+            weight += np.where(donor_provinces == recipient_provinces, 25, 0)
+        if KPD_AGE_DIFFERENCE_TERM and donor_ages is not None:
+            age_difference = np.abs(recipient_ages.astype(np.int64) - donor_ages)
+            weight += np.where(age_difference <= 30, 5, 0)
+        o = BLOOD_TYPES.index('O')
+        both_o = (recipient_types == o) & (donor_types == o)
+        weight += np.where(both_o, 75, np.where(donor_types == recipient_types, 5, 0))
+        weight += np.where(altruist, ALT_WEIGHT, 0)
+        if KPD_DIALYSIS_TERM and dialysis_days is not None:
+            # the weight is truncated to an integer after the dialysis term is added
+            weight = (weight + dialysis_days / 30).astype(np.int64)
+        return weight
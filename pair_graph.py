@@ -0,0 +1,213 @@
+import numpy as np
+
+"""
+The compatibility graph of a market at the level of patient-donor pairs
+"""
+
+
+class PairGraph:
+    """
+    A directed graph with one vertex per patient-donor pair (or altruist), identified by the id_num of the pair
+    An edge u -> v means that the donor of u can give to the recipient of v
+    The adjacency is kept as insertion-ordered dicts, in both directions, and the edge data in numpy arrays, so adding
+    or removing an edge is O(1) amortized and removing a vertex is O(degree)
+    ----------
+    out_edges: dict<int, dict<int, int>>
+        for every vertex, the index of the edge to each of its successors
+    in_edges: dict<int, dict<int, int>>
+        for every vertex, the index of the edge from each of its predecessors
+    sources: array
+        the source of every edge, by edge index
+    targets: array
+        the target of every edge, by edge index
+    weights: array
+        the weight of every edge, by edge index
+    donor_rows: array
+        the table row of the donor of every edge, by edge index
+    recipient_rows: array
+        the table row of the recipient of every edge, by edge index
+    free_edges: list<int>
+        the indices of removed edges, which are reused by the next edges added
+    """
+
+    def __init__(self, capacity=1024):
+        self.out_edges = dict()
+        self.in_edges = dict()
+        self.sources = np.zeros(capacity, dtype=np.int64)
+        self.targets = np.zeros(capacity, dtype=np.int64)
+        self.weights = np.zeros(capacity)
+        self.donor_rows = np.zeros(capacity, dtype=np.int64)
+        self.recipient_rows = np.zeros(capacity, dtype=np.int64)
+        self.free_edges = list()
+        self.next_edge = 0
+
+    def __len__(self):
+        return len(self.out_edges)
+
+    def __contains__(self, vertex):
+        return vertex in self.out_edges
+
+    @property
+    def num_edges(self):
+        return self.next_edge - len(self.free_edges)
+
+    def vertices(self):
+        """
+        :return: a list of the vertices, in the order they were added
+        """
+        return list(self.out_edges)
+
+    def add_vertex(self, vertex):
+        """
+        adds a vertex, if it is not in the graph already
+        :param vertex: the id_num of a pair
+        """
+        if vertex not in self.out_edges:
+            self.out_edges[vertex] = dict()
+            self.in_edges[vertex] = dict()
+
+    def remove_vertex(self, vertex):
+        """
+        removes a vertex and all its edges, if it is in the graph
+        :param vertex: the id_num of a pair
+        """
+        if vertex not in self.out_edges:
+            return
+        self.remove_out_edges(vertex)
+        self.remove_in_edges(vertex)
+        del self.out_edges[vertex]
+        del self.in_edges[vertex]
+
+    def allocate_edges(self, n):
+        """
+        finds room for n new edges, reusing the indices of removed edges first and growing the arrays as needed
+        :param n: the number of edges
+        :return: an array of n edge indices
+        """
+        reused = self.free_edges[len(self.free_edges) - min(n, len(self.free_edges)):]
+        del self.free_edges[len(self.free_edges) - len(reused):]
+        start = self.next_edge
+        self.next_edge += n - len(reused)
+        if self.next_edge > len(self.weights):
+            capacity = max(2 * len(self.weights), self.next_edge)
+            for name in ['sources', 'targets', 'weights', 'donor_rows', 'recipient_rows']:
+                column = getattr(self, name)
+                new_column = np.zeros(capacity, dtype=column.dtype)
+                new_column[:start] = column[:start]
+                setattr(self, name, new_column)
+        return np.concatenate((np.array(reused, dtype=np.int64), np.arange(start, self.next_edge)))
+
+    def add_edge(self, source, target, weight, donor_row=-1, recipient_row=-1):
+        """
+        adds an edge, or changes its weight if the graph already has it
+        both vertices must be in the graph
+        """
+        if target in self.out_edges[source]:
+            self.weights[self.out_edges[source][target]] = weight
+            return
+        self.add_edges([source], [target], [weight], [donor_row], [recipient_row])
+
+    def add_edges(self, sources, targets, weights, donor_rows, recipient_rows):
+        """
+        adds many new edges at once, the edges must not be in the graph already
+        :param sources: array of source vertices
+        :param targets: array of target vertices
+        :param weights: array of edge weights
+        :param donor_rows: array of the table rows of the donors
+        :param recipient_rows: array of the table rows of the recipients
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        targets = np.asarray(targets, dtype=np.int64)
+        indices = self.allocate_edges(len(sources))
+        self.sources[indices] = sources
+        self.targets[indices] = targets
+        self.weights[indices] = weights
+        self.donor_rows[indices] = donor_rows
+        self.recipient_rows[indices] = recipient_rows
+        for (index, source, target) in zip(indices.tolist(), sources.tolist(), targets.tolist()):
+            self.out_edges[source][target] = index
+            self.in_edges[target][source] = index
+
+    def remove_edge(self, source, target):
+        """
+        removes an edge, if it is in the graph
+        """
+        index = self.out_edges.get(source, dict()).pop(target, None)
+        if index is not None:
+            del self.in_edges[target][source]
+            self.free_edges.append(index)
+
+    def remove_out_edges(self, vertex):
+        """
+        removes all the edges leaving a vertex, i.e. the edges from the donor of the pair
+        """
+        for (target, index) in self.out_edges[vertex].items():
+            del self.in_edges[target][vertex]
+            self.free_edges.append(index)
+        self.out_edges[vertex] = dict()
+
+    def remove_in_edges(self, vertex):
+        """
+        removes all the edges entering a vertex, i.e. the edges to the recipient of the pair
+        """
+        for (source, index) in self.in_edges[vertex].items():
+            del self.out_edges[source][vertex]
+            self.free_edges.append(index)
+        self.in_edges[vertex] = dict()
+
+    def has_edge(self, source, target):
+        return source in self.out_edges and target in self.out_edges[source]
+
+    def weight(self, source, target):
+        """
+        :return: the weight of the edge from source to target
+        """
+        return self.weights[self.out_edges[source][target]].item()
+
+    def successors(self, vertex):
+        """
+        :return: a list of the vertices the donor of the pair can give to, in the order the edges were added
+        """
+        return list(self.out_edges[vertex])
+
+    def predecessors(self, vertex):
+        """
+        :return: a list of the vertices whose donors can give to the recipient of the pair
+        """
+        return list(self.in_edges[vertex])
+
+    def out_degree(self, vertex):
+        return len(self.out_edges[vertex])
+
+    def in_degree(self, vertex):
+        return len(self.in_edges[vertex])
+
+    def live_edges(self):
+        """
+        :return: an array of the indices of the edges in the graph, in increasing order
+        """
+        live = np.ones(self.next_edge, dtype=bool)
+        live[self.free_edges] = False
+        return np.flatnonzero(live)
+
+    def edges(self):
+        """
+        :return: a list of all the edges, as tuples (source, target, weight)
+        """
+        return [(source, target, self.weights[index].item())
+                for (source, targets) in self.out_edges.items() for (target, index) in targets.items()]
+
+    def to_csr(self):
+        """
+        exports the graph in compressed sparse row form
+        :return: the array of vertices (row i is vertex vertices[i]), the row pointers, the column indices and the
+                 edge weights. The edges of row i are indices[indptr[i]:indptr[i + 1]], in the order they were added
+        """
+        vertices = np.array(self.vertices(), dtype=np.int64)
+        position = {vertex: i for (i, vertex) in enumerate(vertices.tolist())}
+        degrees = np.array([len(self.out_edges[vertex]) for vertex in vertices.tolist()], dtype=np.int64)
+        indptr = np.concatenate(([0], np.cumsum(degrees)))
+        edge_indices = np.array([index for targets in self.out_edges.values() for index in targets.values()],
+                                dtype=np.int64)
+        indices = np.array([position[target] for target in self.targets[edge_indices].tolist()], dtype=np.int64)
+        return vertices, indptr, indices, self.weights[edge_indices]
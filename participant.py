@@ -1,4 +1,64 @@
-import numpy.random as random
+import numpy as np
+
+# integer codes used wherever participants are handled as arrays
+# the order of the blood types matches the rows and columns of the weight matrices (O, A, B, AB)
+# 'X' is the blood type of a "fake participant"
+BLOOD_TYPES = ['O', 'A', 'B', 'AB', 'X']
+PROVINCES = ['BC', 'AL', 'SK', 'MN', 'ON', 'QC', 'NS', 'NB', 'PEI', 'NFL']
+
+# ABO_COMPATIBLE[donor code][recipient code] is True if the donor can give to the recipient
+ABO_COMPATIBLE = np.array([[True, True, True, True, False],
+                           [False, True, False, True, False],
+                           [False, False, True, True, False],
+                           [False, False, False, True, False],
+                           [False, False, False, False, False]])
+
+# bits of the flags of a participant, as stored in a ParticipantTable
+DONOR = 1
+RECIPIENT = 2
+ALTRUIST = 4
+
+# province of the participants created without one (e.g. altruists)
+DEFAULT_PROVINCE = 'QB'
+
+
+def _column(name):
+    """
+    :param name: the name of a column of a ParticipantTable
+    :return: a property reading and writing the column for the row of a Participant
+    """
+    def getter(self):
+        return self.table.columns[name].item(self.row)
+
+    def setter(self, value):
+        self.table.set(self.row, name, value)
+    return property(getter, setter)
+
+
+def _aged_column(name):
+    """
+    :param name: a column of a ParticipantTable that grows while the participant is in the market (see AGED_COLUMNS)
+    :return: a property reading and writing the current value of the column for the row of a Participant
+    """
+    def getter(self):
+        return self.table.get(self.row, name)
+
+    def setter(self, value):
+        self.table.set(self.row, name, value)
+    return property(getter, setter)
+
+
+def _flag(flag):
+    """
+    :param flag: one of the bits DONOR, RECIPIENT or ALTRUIST
+    :return: a property reading and writing the bit in the flags of the row of a Participant
+    """
+    def getter(self):
+        return (self.table.columns['flags'].item(self.row) & flag) != 0
+
+    def setter(self, value):
+        self.table.set_flag(self.row, flag, value)
+    return property(getter, setter)
 
 
 class Participant:
@@ -6,8 +66,14 @@ class Participant:
         A participant in a kidney paired donation program
         This could be either a patient or donor of a patient donor pair or an altruistic donor
         It could also be a "fake participant", which is used for the implementation of altruists
+        A Participant is a view of one row of a ParticipantTable, where its attributes are stored. Two views of the
+        same row are equal, so views can be created whenever they are needed
         Attributes
         ---------
+        table: ParticipantTable
+            the table the participant is stored in
+        row: int
+            the row of the participant in the table
         id_num: int
             unique identification number of the pair, which the participant is in
         blood_type: char
@@ -23,9 +89,6 @@ class Participant:
             True if the node is a recipient type
         altruist: boolean
             True if the node is a altruist
-        neighbours: list<Participant>
-            list of all the nodes that can be reached from this node
-            if this is a recipient in a patient-donor pair, the only node that can be reached will be the donor
         time_to_critical: int
             the time the participant can stay in the market
         time_in_market: int
@@ -41,40 +104,63 @@ class Participant:
             the age of the participant
         dialysis_days: int
             the number of days that the participant has been on dialysis
+        alive: boolean
+            True while the participant is in the market
         """
-    def __init__(self, id_num, blood_type, donor, recipient, altruist, time_to_critical, weight, cpra=0, province='QB', age=30, dialysis_days = 30):
-        #random.seed(5)
-        #random_state = random.RandomState()
-        self.id_num = id_num
-        self.blood_type = blood_type
-        self.partner = None
-        self.donor = donor
-        self.recipient = recipient
-        self.altruist = altruist
-        self.neighbours = list()
-        self.time_in_market = 0
-        self.time_to_critical = time_to_critical
-        self.weight = weight
-        self.cpra = cpra
-        self.province = province
-        self.age = age
-        self.dialysis_days = dialysis_days
-
-    def add_neighbour(self, neighbour):
-        """
-        Adds a neighbour to the participant
-        :param neighbour: a Participant
-        """
-        if not (neighbour in self.neighbours):
-            self.neighbours.append(neighbour)
+    __slots__ = ('table', 'row')
 
-    def remove_neighbour(self, neighbour):
-        """
-        Removes a neighbour from self.neighbour
-        :param neighbour: a participant
-        """
-        if neighbour in self.neighbours:
-            self.neighbours.remove(neighbour)
+    def __init__(self, table, row):
+        self.table = table
+        self.row = row
+
+    def __eq__(self, other):
+        return isinstance(other, Participant) and self.row == other.row and self.table is other.table
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.row)
+
+    def __repr__(self):
+        return "Participant({}, {})".format(self.id_num, self.blood_type)
+
+    id_num = _column('id_num')
+    donor = _flag(DONOR)
+    recipient = _flag(RECIPIENT)
+    altruist = _flag(ALTRUIST)
+    time_in_market = _aged_column('time_in_market')
+    time_to_critical = _column('time_to_critical')
+    weight = _column('weight')
+    cpra = _column('cpra')
+    age = _column('age')
+    dialysis_days = _aged_column('dialysis_days')
+
+    @property
+    def alive(self):
+        return self.table.columns['alive'].item(self.row)
+
+    @alive.setter
+    def alive(self, value):
+        self.table.set_alive(self.row, value)
+
+    @property
+    def blood_type(self):
+        return BLOOD_TYPES[self.table.columns['blood_type'].item(self.row)]
+
+    @property
+    def province(self):
+        code = self.table.columns['province'].item(self.row)
+        return PROVINCES[code] if code >= 0 else DEFAULT_PROVINCE
+
+    @property
+    def partner(self):
+        row = self.table.columns['partner'].item(self.row)
+        return Participant(self.table, row) if row >= 0 else None
+
+    @partner.setter
+    def partner(self, partner):
+        self.table.set(self.row, 'partner', -1 if partner is None else partner.row)
 
     def compatible(self, participant,random_state):
         """
@@ -0,0 +1,246 @@
+import threading
+import numpy as np
+from participant import Participant, BLOOD_TYPES, PROVINCES, DONOR, RECIPIENT, ALTRUIST
+
+"""
+Columnar storage of the participants of a simulation
+Every donor and recipient is a row of a ParticipantTable and Participant objects are views of a row, so the market
+can age, scan and filter all the participants with array operations instead of going through them one at a time
+"""
+
+# columns of the table and the type they are stored with
+# flags hold the bits participant.DONOR, RECIPIENT and ALTRUIST, blood types and provinces are stored as their index
+# in participant.BLOOD_TYPES and participant.PROVINCES (-1 if the province is not in PROVINCES), partner is the row of
+# the other participant of the pair (-1 if none), alive is True while the participant is in the market and entered_at
+# is the clock of the table when it last entered the market
+COLUMNS = {'id_num': np.int32, 'flags': np.uint8, 'blood_type': np.int8, 'partner': np.int32,
+           'cpra': np.float64, 'weight': np.float64, 'time_in_market': np.int32, 'time_to_critical': np.int32,
+           'dialysis_days': np.int32, 'age': np.int16, 'province': np.int8, 'alive': np.bool_, 'entered_at': np.int32}
+
+# columns that grow while a participant is in the market, and by how much per month of the clock
+# the stored value is the value when the participant last entered the market, the time since then is added on read
+# dialysis_days only grows for recipients
+AGED_COLUMNS = {'time_in_market': 1, 'dialysis_days': 30}
+
+
+class ParticipantTable:
+    """
+    The attributes of all the participants of a simulation, one numpy array per attribute
+    Rows are never reused, so a row number identifies a participant for the whole simulation
+    ----------
+    columns: dict<string, array>
+        the columns in COLUMNS, each with room for capacity participants
+    size: int
+        the number of rows in use
+    lock: RLock
+        held while rows are added or values are changed, as rows may be added by another thread (see PREFETCH_ARRIVALS)
+    clock: int
+        the number of months the market has been aged by, so ageing all the participants is a single addition
+    """
+
+    def __init__(self, capacity=1024):
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for (name, dtype) in COLUMNS.items()}
+        self.columns['partner'][:] = -1
+        self.size = 0
+        self.lock = threading.RLock()
+        self.clock = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self.columns['id_num'])
+
+    def reserve(self, n):
+        """
+        makes sure there is room for n more rows, doubling the capacity as needed
+        :param n: the number of rows to add
+        """
+        with self.lock:
+            if self.size + n <= self.capacity:
+                return
+            capacity = max(self.capacity * 2, self.size + n)
+            for (name, column) in self.columns.items():
+                new_column = np.zeros(capacity, dtype=column.dtype)
+                new_column[:self.size] = column[:self.size]
+                if name == 'partner':
+                    new_column[self.size:] = -1
+                self.columns[name] = new_column
+
+    def add_rows(self, n, **values):
+        """
+        adds n participants to the table
+        :param n: the number of participants
+        :param values: the value (or array of n values) of each column, keyed by column name
+               blood types and provinces are given as codes, missing columns are left at 0 (partner at -1)
+        :return: an array of the rows of the new participants
+        """
+        with self.lock:
+            self.reserve(n)
+            start = self.size
+            for (name, value) in values.items():
+                self.columns[name][start:start + n] = value
+            self.size += n
+        return np.arange(start, start + n)
+
+    def add(self, id_num, blood_type, donor, recipient, altruist, time_to_critical, weight, cpra=0, province='QB', age=30, dialysis_days=30):
+        """
+        adds one participant to the table, with the same arguments the Participant constructor used to take
+        :return: a Participant view of the new row
+        """
+        flags = (DONOR if donor else 0) | (RECIPIENT if recipient else 0) | (ALTRUIST if altruist else 0)
+        province_code = PROVINCES.index(province) if province in PROVINCES else -1
+        rows = self.add_rows(1, id_num=id_num, flags=flags, blood_type=BLOOD_TYPES.index(blood_type),
+                             cpra=cpra, weight=weight, time_to_critical=time_to_critical, dialysis_days=dialysis_days,
+                             age=age, province=province_code)
+        return Participant(self, int(rows[0]))
+
+    def add_pairs(self, id_nums, donor_types, recipient_types, cpra, weight, time_to_critical, donor_ages, patient_ages,
+                  dialysis_days, provinces, altruist=False):
+        """
+        adds patient-donor pairs to the table, the donors first and then the recipients
+        :param id_nums: array of the ids of the pairs
+        :param donor_types: array of donor blood type codes
+        :param recipient_types: array of recipient blood type codes
+        :param cpra: array of cpra values
+        :param weight: array of pair weights
+        :param time_to_critical: array of the time the pairs can stay in the market
+        :param donor_ages: array of donor ages
+        :param patient_ages: array of patient ages
+        :param dialysis_days: array of the days on dialysis
+        :param provinces: array of province codes
+        :param altruist: True if the donors are altruists and the recipients are "fake participants"
+        :return: the array of donor rows and the array of recipient rows
+        """
+        n = len(id_nums)
+        altruist_flag = ALTRUIST if altruist else 0
+        with self.lock:
+            self.reserve(2 * n)
+            start = self.size
+            donors = self.add_rows(n, id_num=id_nums, flags=DONOR | altruist_flag, blood_type=donor_types,
+                                   partner=np.arange(start + n, start + 2 * n), cpra=cpra, weight=weight,
+                                   time_to_critical=time_to_critical, dialysis_days=dialysis_days, age=donor_ages,
+                                   province=provinces)
+            recipients = self.add_rows(n, id_num=id_nums, flags=RECIPIENT | altruist_flag,
+                                       blood_type=recipient_types, partner=donors, cpra=cpra, weight=weight,
+                                       time_to_critical=time_to_critical, dialysis_days=dialysis_days,
+                                       age=patient_ages, province=provinces)
+        return donors, recipients
+
+    def column(self, name):
+        """
+        :param name: the name of a column
+        :return: the rows in use of the column. Rows may be added between two calls, so columns combined element by
+                 element should be read under the lock
+        """
+        return self.columns[name][:self.size]
+
+    def get(self, row, name):
+        """
+        :return: the value of a column for one participant, as a python scalar
+        """
+        value = self.columns[name].item(row)
+        if name in AGED_COLUMNS:
+            value += self.aged_by(row, name)
+        return value
+
+    def set(self, row, name, value):
+        """
+        sets the value of a column for one participant
+        """
+        with self.lock:
+            if name in AGED_COLUMNS:
+                value -= self.aged_by(row, name)
+            self.columns[name][row] = value
+
+    def aged_by(self, row, name):
+        """
+        :return: how much a column in AGED_COLUMNS of one participant has grown since it last entered the market
+        """
+        if not self.columns['alive'].item(row):
+            return 0
+        if name == 'dialysis_days' and not self.columns['flags'].item(row) & RECIPIENT:
+            return 0
+        return AGED_COLUMNS[name] * (self.clock - self.columns['entered_at'].item(row))
+
+    def aged_column(self, name):
+        """
+        :param name: the name of a column in AGED_COLUMNS
+        :return: the current values of the column for all the rows in use
+        """
+        # the columns are read together under the lock, rows added by another thread meanwhile would change their length
+        with self.lock:
+            n = self.size
+            growing = self.columns['alive'][:n]
+            if name == 'dialysis_days':
+                growing = growing & ((self.columns['flags'][:n] & RECIPIENT) != 0)
+            aged_by = np.where(growing, AGED_COLUMNS[name] * (self.clock - self.columns['entered_at'][:n]), 0)
+            return self.columns[name][:n] + aged_by
+
+    def set_alive(self, row, value):
+        """
+        sets whether one participant is in the market
+        on entering, the participant starts ageing from the current clock, on leaving its aged columns are frozen
+        """
+        with self.lock:
+            if value == self.columns['alive'].item(row):
+                return
+            if value:
+                self.columns['entered_at'][row] = self.clock
+            else:
+                for name in AGED_COLUMNS:
+                    self.columns[name][row] += self.aged_by(row, name)
+            self.columns['alive'][row] = value
+
+    def set_flag(self, row, flag, value):
+        """
+        sets or clears one bit of the flags of one participant
+        """
+        with self.lock:
+            if value:
+                self.columns['flags'][row] |= flag
+            else:
+                self.columns['flags'][row] &= ~flag & 0xff
+
+    def view(self, row):
+        """
+        :param row: a row of the table
+        :return: a Participant view of the row
+        """
+        return Participant(self, int(row))
+
+    def views(self, rows):
+        """
+        :param rows: an array of rows of the table
+        :return: a list of Participant views of the rows
+        """
+        return [Participant(self, row) for row in np.asarray(rows).tolist()]
+
+    def live_rows(self, flag):
+        """
+        :param flag: participant.DONOR or RECIPIENT
+        :return: the rows of the participants in the market with the flag set
+        """
+        with self.lock:
+            n = self.size
+            return np.flatnonzero(self.columns['alive'][:n] & ((self.columns['flags'][:n] & flag) != 0))
+
+    def advance_time(self, period_length):
+        """
+        ages all the participants in the market by one period, and the dialysis time of their recipients
+        only the clock is moved, the aged columns are computed from it when they are read
+        :param period_length: the length of a period in months
+        """
+        with self.lock:
+            self.clock += period_length
+
+    def total_time_in_market(self):
+        """
+        :return: the total time in the market of all the real recipients still in the market
+        """
+        with self.lock:
+            n = self.size
+            recipients = self.columns['alive'][:n] & ((self.columns['flags'][:n] & RECIPIENT) != 0) & \
+                (self.columns['blood_type'][:n] != BLOOD_TYPES.index('X'))
+            return int(np.sum(self.aged_column('time_in_market')[recipients]))
@@ -0,0 +1,111 @@
+import numpy as np
+
+"""
+The changes made to the compatibility graph of a market during one period
+"""
+
+
+class PeriodDelta:
+    """
+    The vertices and edges added to and removed from the PairGraph of a market during one period, so that solvers,
+    metrics or checkpoints can follow the market without rebuilding it from scratch
+    Vertices are id_nums. A vertex can appear both as added and removed if it entered and left the market in the same
+    period (e.g. an altruist matched in the period it arrived, or a matched donor coming back as a bridge donor)
+    The changes are recorded with the record_ methods and turned into arrays by finish
+    ----------
+    period: int
+        the number of the period
+    added: array
+        the vertices added to the graph
+    matched: array
+        the vertices removed from the graph because they were matched
+    perished: array
+        the vertices removed from the graph because they perished
+    edge_sources: array
+        the source of every edge created
+    edge_targets: array
+        the target of every edge created
+    edge_weights: array
+        the weight of every edge created, when it was created
+    reweighed_sources: array
+        the source of every edge whose weight was recalculated (see Market.refresh_weights), in the order of the
+        recalculations
+    reweighed_targets: array
+        the target of every edge whose weight was recalculated
+    reweighed_weights: array
+        the new weight of every edge whose weight was recalculated
+    reweighed_at: array
+        for every recalculated weight, the number of edges created in the period before it was recalculated. Replaying
+        the edges created up to it and then the new weight gives the weights of the graph at the end of the period
+    """
+
+    def __init__(self, period=-1):
+        self.period = period
+        self.added = list()
+        self.matched = list()
+        self.perished = list()
+        self.edge_sources = list()
+        self.edge_targets = list()
+        self.edge_weights = list()
+        self.reweighed_sources = list()
+        self.reweighed_targets = list()
+        self.reweighed_weights = list()
+        self.reweighed_at = list()
+
+    def record_vertex_added(self, vertex):
+        self.added.append(vertex)
+
+    def record_vertex_removed(self, vertex, perished=False):
+        if perished:
+            self.perished.append(vertex)
+        else:
+            self.matched.append(vertex)
+
+    def record_edges(self, sources, targets, weights):
+        """
+        :param sources: array of source vertices
+        :param targets: array of target vertices
+        :param weights: array of edge weights
+        """
+        self.edge_sources.append(np.asarray(sources, dtype=np.int64))
+        self.edge_targets.append(np.asarray(targets, dtype=np.int64))
+        self.edge_weights.append(np.asarray(weights, dtype=np.float64))
+
+    def record_weights(self, sources, targets, weights):
+        """
+        records new weights of existing edges
+        :param sources: array of source vertices
+        :param targets: array of target vertices
+        :param weights: array of the new edge weights
+        """
+        self.reweighed_sources.append(np.asarray(sources, dtype=np.int64))
+        self.reweighed_targets.append(np.asarray(targets, dtype=np.int64))
+        self.reweighed_weights.append(np.asarray(weights, dtype=np.float64))
+        self.reweighed_at.append(np.full(len(self.reweighed_sources[-1]), sum(len(e) for e in self.edge_sources),
+                                         dtype=np.int64))
+
+    def finish(self):
+        """
+        turns the recorded changes into arrays
+        :return: this PeriodDelta
+        """
+        self.added = np.array(self.added, dtype=np.int64)
+        self.matched = np.array(self.matched, dtype=np.int64)
+        self.perished = np.array(self.perished, dtype=np.int64)
+        self.edge_sources = np.concatenate([np.zeros(0, dtype=np.int64)] + self.edge_sources)
+        self.edge_targets = np.concatenate([np.zeros(0, dtype=np.int64)] + self.edge_targets)
+        self.edge_weights = np.concatenate([np.zeros(0)] + self.edge_weights)
+        self.reweighed_sources = np.concatenate([np.zeros(0, dtype=np.int64)] + self.reweighed_sources)
+        self.reweighed_targets = np.concatenate([np.zeros(0, dtype=np.int64)] + self.reweighed_targets)
+        self.reweighed_weights = np.concatenate([np.zeros(0)] + self.reweighed_weights)
+        self.reweighed_at = np.concatenate([np.zeros(0, dtype=np.int64)] + self.reweighed_at)
+        return self
+
+    @property
+    def num_edges(self):
+        return len(self.edge_sources)
+
+    def __repr__(self):
+        return "PeriodDelta(period={}, added={}, matched={}, perished={}, edges={}, reweighed={})".format(
+            self.period, len(self.added), len(self.matched), len(self.perished), self.num_edges,
+            len(self.reweighed_sources))
@@ -0,0 +1,119 @@
+import os
+import numpy as np
+from numpy.lib.format import open_memmap
+from participant import ABO_COMPATIBLE
+from population import Population
+from random_streams import RandomStreams
+from arrival_stream import PAIR_COLUMNS, ALTRUIST_COLUMNS
+from market import calculate_kpd_weights
+from config import WEIGHTS, ALT_WEIGHT
+
+"""
+Generates synthetic pools that are too large to hold in memory, for stress testing the market and the solvers
+A pool is written to a directory:
+    pairs/<column>.npy      one memory-mappable array per pair attribute (see arrival_stream.PAIR_COLUMNS)
+    altruists/<column>.npy  one memory-mappable array per altruist attribute
+    pool.input              the edges between pairs, in the format read by kidney_digraph.read_digraph
+    pool.ndds               the edges from altruists to pairs, in the format read by kidney_ndds.read_ndds
+Pair i of the pool is vertex i of pool.input and altruist j is NDD j of pool.ndds
+Note that the number of edges grows with the square of the pool size
+"""
+
+# width reserved for the edge count in the first line of the edge files, which is only known at the end
+COUNT_WIDTH = 20
+
+
+def generate_large_pool(directory, num_pairs, num_altruists, population=None, chunk_size=10000, block_size=2000, random_streams=None):
+    """
+    generates a synthetic pool and writes it to directory, a chunk at a time
+    pair attributes are sampled chunk_size pairs at a time, and compatibilities are drawn for blocks of block_size
+    donors against block_size recipients, so memory use does not depend on the size of the pool
+    :param directory: the directory to write the pool to
+    :param num_pairs: the number of patient-donor pairs
+    :param num_altruists: the number of altruistic donors
+    :param population: the Population to sample from
+    :param chunk_size: the number of pairs sampled at a time
+    :param block_size: the number of donors and recipients crossmatched at a time
+    :param random_streams: the RandomStreams to draw from
+    :return: the number of edges between pairs and the number of edges from altruists
+    """
+    if population is None:
+        population = Population()
+    if random_streams is None:
+        random_streams = RandomStreams()
+    for sub_directory in ['pairs', 'altruists']:
+        path = os.path.join(directory, sub_directory)
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    pairs = {key: open_memmap(os.path.join(directory, 'pairs', key + '.npy'), mode='w+', dtype=dtype, shape=(num_pairs,))
+             for (key, dtype) in PAIR_COLUMNS.items()}
+    for start in range(0, num_pairs, chunk_size):
+        end = min(start + chunk_size, num_pairs)
+        cohort = population.sample_cohort(end - start, first_flag=False, rng=random_streams.arrivals, perish_rng=random_streams.perish)
+        for key in PAIR_COLUMNS:
+            pairs[key][start:end] = cohort[key]
+    altruists = {key: open_memmap(os.path.join(directory, 'altruists', key + '.npy'), mode='w+', dtype=dtype, shape=(num_altruists,))
+                 for (key, dtype) in ALTRUIST_COLUMNS.items()}
+    for start in range(0, num_altruists, chunk_size):
+        end = min(start + chunk_size, num_altruists)
+        cohort = population.sample_altruists(end - start, random_streams.altruists, random_streams.perish)
+        for key in ALTRUIST_COLUMNS:
+            altruists[key][start:end] = cohort[key]
+    for column in list(pairs.values()) + list(altruists.values()):
+        column.flush()
+
+    rng = random_streams.crossmatch
+    with open(os.path.join(directory, 'pool.input'), 'w') as f:
+        num_edges = write_edges(f, num_pairs, pairs['donor_type'], False, pairs, population, block_size, rng, same_pool=True)
+    with open(os.path.join(directory, 'pool.ndds'), 'w') as f:
+        num_ndd_edges = write_edges(f, num_altruists, altruists['donor_type'], True, pairs, population, block_size, rng, same_pool=False)
+    return num_edges, num_ndd_edges
+
+
+def write_edges(f, num_sources, donor_types, altruist, pairs, population, block_size, rng, same_pool):
+    """
+    crossmatches every donor against every recipient of the pool a block at a time and writes the edges found
+    the first line holds the number of sources and of edges and the last line is "-1 -1 -1"
+    :param f: the file to write to
+    :param num_sources: the number of donors
+    :param donor_types: array of donor blood type codes
+    :param altruist: True if the donors are altruists
+    :param pairs: the pair columns of the pool
+    :param population: the Population giving the weights of the pairs, used unless WEIGHTS is "KPD"
+    :param block_size: the number of donors and recipients crossmatched at a time
+    :param rng: the random generator the crossmatches are drawn from
+    :param same_pool: True if the donors are the donors of the pairs, so that a donor is not matched to its partner
+    :return: the number of edges written
+    """
+    num_pairs = len(pairs['recipient_type'])
+    f.write(("{}\t{:<" + str(COUNT_WIDTH) + "}\n").format(num_sources, 0))
+    num_edges = 0
+    for source_start in range(0, num_sources, block_size):
+        source_end = min(source_start + block_size, num_sources)
+        donors = np.asarray(donor_types[source_start:source_end])
+        for target_start in range(0, num_pairs, block_size):
+            target_end = min(target_start + block_size, num_pairs)
+            recipients = np.asarray(pairs['recipient_type'][target_start:target_end])
+            cpra = np.asarray(pairs['cpra'][target_start:target_end])
+            compatible = ABO_COMPATIBLE[donors[:, None], recipients[None, :]]
+            compatible &= rng.random(compatible.shape) < 1 - cpra[None, :]
+            if same_pool:
+                sources = np.arange(source_start, source_end)
+                compatible &= sources[:, None] != np.arange(target_start, target_end)[None, :]
+            (source_idx, target_idx) = np.nonzero(compatible)
+            if len(source_idx) == 0:
+                continue
+            if WEIGHTS == "KPD":
+                weights = calculate_kpd_weights(donors[source_idx], recipients[target_idx], cpra[target_idx], np.full(len(source_idx), altruist))
+            else:
+                # the weight is determined by the recipient's pair
+                pair_weights = population.cohort_weights({key: np.asarray(pairs[key][target_start:target_end])
+                                                          for key in ['cpra_index', 'cpra', 'donor_type', 'recipient_type']})
+                weights = pair_weights[target_idx] + (ALT_WEIGHT if altruist else 0)
+            np.savetxt(f, np.column_stack((source_start + source_idx, target_start + target_idx, weights)), fmt='%d\t%d\t%.10g')
+            num_edges += len(source_idx)
+    f.write("-1\t-1\t-1\n")
+    f.seek(0)
+    f.write(("{}\t{:<" + str(COUNT_WIDTH) + "}\n").format(num_sources, num_edges))
+    return num_edges
@@ -0,0 +1,219 @@
+import csv
+import os
+import numpy as np
+from population import cpra_band
+from arrival_stream import PAIR_COLUMNS, ALTRUIST_COLUMNS, parse_rows
+
+"""
+Loads snapshots of real (or previously generated) pools into a Market in one pass
+A pool can be given as:
+    a directory written by pool_generator.generate_large_pool
+    a .npz file with one array per pair attribute ('pair_<column>', see arrival_stream.PAIR_COLUMNS) and per altruist
+        attribute ('altruist_<column>'), and optionally the edges between pairs ('edge_sources', 'edge_targets',
+        'edge_weights') and from altruists ('ndd_sources', 'ndd_targets', 'ndd_weights')
+    a .csv file with one row per pair or altruist and the columns recipient_type, donor_type, cpra, patient_age,
+        donor_age, dialysis_days, province and optionally time_to_critical and altruist (0 or 1), as in
+        arrival_stream.read_arrival_trace. The edges can be given in a separate .csv file (source, target and
+        optionally weight columns) or in the format of kidney_digraph.read_digraph
+Edges are given by position: pair i is vertex i and altruist j is NDD j. If a pool has no edges, the pairs are
+crossmatched when they are imported
+"""
+
+
+class Pool:
+    """
+    A pool snapshot read from a file, before it is imported into a market
+    ----------
+    pairs: dict<string, array>
+        the attributes of the pairs, blood types and provinces as integer codes
+    altruists: dict<string, array>
+        the attributes of the altruists
+    edges: (array, array, array)
+        the sources, targets and weights of the edges between pairs, None if the pool has no edges
+        weights are NaN where the file does not give them
+    ndd_edges: (array, array, array)
+        the sources (altruist positions), targets and weights of the edges from altruists, None if not given
+    """
+
+    def __init__(self, pairs, altruists, edges=None, ndd_edges=None):
+        self.pairs = pairs
+        self.altruists = altruists
+        self.edges = edges
+        self.ndd_edges = ndd_edges
+
+    @property
+    def num_pairs(self):
+        return len(self.pairs['recipient_type'])
+
+    @property
+    def num_altruists(self):
+        return len(self.altruists['donor_type'])
+
+
+def read_pool(path, edge_path=None, perish_rng=np.random):
+    """
+    reads a pool snapshot
+    :param path: the path of a pool directory, .npz file or .csv file
+    :param edge_path: the path of a file with the edges between pairs, overriding those of the pool
+    :param perish_rng: the random generator the time_to_critical values missing from a .csv file are drawn from
+    :return: a Pool
+    """
+    if os.path.isdir(path):
+        pool = read_pool_directory(path)
+    elif path.endswith('.npz'):
+        pool = read_pool_npz(path)
+    else:
+        pool = read_pool_csv(path, perish_rng)
+    if edge_path is not None:
+        pool.edges = read_edges(edge_path)
+    return pool
+
+
+def read_pool_directory(path):
+    """
+    reads a pool written by pool_generator.generate_large_pool, the attribute arrays are memory-mapped
+    """
+    pairs = {key: np.load(os.path.join(path, 'pairs', key + '.npy'), mmap_mode='r') for key in PAIR_COLUMNS}
+    altruists = {key: np.load(os.path.join(path, 'altruists', key + '.npy'), mmap_mode='r') for key in ALTRUIST_COLUMNS}
+    edges = None
+    ndd_edges = None
+    if os.path.exists(os.path.join(path, 'pool.input')):
+        edges = read_edges(os.path.join(path, 'pool.input'))
+    if os.path.exists(os.path.join(path, 'pool.ndds')):
+        ndd_edges = read_edges(os.path.join(path, 'pool.ndds'))
+    return Pool(pairs, altruists, edges, ndd_edges)
+
+
+def read_pool_npz(path):
+    """
+    reads a pool from a .npz file, cpra_index is derived from cpra if it is missing
+    """
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files}
+    pairs = {key[len('pair_'):]: value for (key, value) in arrays.items() if key.startswith('pair_')}
+    if 'cpra_index' not in pairs:
+        pairs['cpra_index'] = cpra_band(pairs['cpra']).astype(PAIR_COLUMNS['cpra_index'])
+    altruists = {key[len('altruist_'):]: value for (key, value) in arrays.items() if key.startswith('altruist_')}
+    if len(altruists) == 0:
+        altruists = {key: np.zeros(0, dtype=dtype) for (key, dtype) in ALTRUIST_COLUMNS.items()}
+    return Pool(pairs, altruists, edge_arrays(arrays, 'edge_'), edge_arrays(arrays, 'ndd_'))
+
+
+def edge_arrays(arrays, prefix):
+    """
+    :return: the sources, targets and weights stored under prefix in a .npz file, None if there are none
+    """
+    if prefix + 'sources' not in arrays:
+        return None
+    sources = arrays[prefix + 'sources'].astype(np.int64)
+    weights = arrays.get(prefix + 'weights')
+    if weights is None:
+        weights = np.full(len(sources), np.nan)
+    return sources, arrays[prefix + 'targets'].astype(np.int64), weights.astype(np.float64)
+
+
+def read_pool_csv(path, perish_rng=np.random):
+    """
+    reads a pool from a .csv file with one row per pair or altruist, the pool has no edges
+    time_to_critical may be missing (e.g. in a registry extract), it is then drawn from perish_rng, see parse_rows
+    """
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    is_altruist = [int(row.get('altruist') or 0) == 1 for row in rows]
+    pair_rows = [row for (row, altruist) in zip(rows, is_altruist) if not altruist]
+    altruist_rows = [row for (row, altruist) in zip(rows, is_altruist) if altruist]
+    (pairs, altruists) = parse_rows(pair_rows, altruist_rows, perish_rng)
+    return Pool(pairs, altruists)
+
+
+def read_edges(path):
+    """
+    reads an edge list, either in the format of kidney_digraph.read_digraph (a first line with the number of vertices
+    and of edges, one "source target weight" line per edge and a last line "-1 -1 -1") or a .csv file with a header
+    and the columns source, target and optionally weight
+    the whole file is split and converted in one call, so large edge lists are read at the speed of numpy
+    :param path: the path of the file
+    :return: the arrays of sources, targets and weights, weights are NaN if the file does not give them
+    """
+    with open(path) as f:
+        header = f.readline()
+        text = f.read()
+    if path.endswith('.csv'):
+        columns = [column.strip() for column in header.split(',')]
+        values = np.array(text.replace(',', ' ').split(), dtype=np.float64).reshape(-1, len(columns))
+        sources = values[:, columns.index('source')].astype(np.int64)
+        targets = values[:, columns.index('target')].astype(np.int64)
+        if 'weight' in columns:
+            weights = values[:, columns.index('weight')]
+        else:
+            weights = np.full(len(sources), np.nan)
+        return sources, targets, weights
+    values = np.array(text.split(), dtype=np.float64).reshape(-1, 3)
+    # only the last line ends the list, other negative indices are left for check_edges
+    if len(values) > 0 and values[-1, 0] == -1:
+        values = values[:-1]
+    return values[:, 0].astype(np.int64), values[:, 1].astype(np.int64), values[:, 2]
+
+
+def check_edges(edges, num_sources, num_pairs, same_pool, name):
+    """
+    checks an edge list of a pool the way kidney_digraph.read_digraph and kidney_ndds.read_ndds check theirs
+    :param edges: the sources, targets and weights of the edges
+    :param num_sources: the number of donors the sources index (pairs or altruists)
+    :param num_pairs: the number of pairs the targets index
+    :param same_pool: True if the sources are the pairs, so that a source can't be its own target
+    :param name: the name of the edge list in error messages
+    :raise ValueError: if an index is out of range, an edge is a self-loop or an edge is given twice
+    """
+    (sources, targets) = (edges[0], edges[1])
+    for (indices, count, kind) in [(sources, num_sources, 'source'), (targets, num_pairs, 'target')]:
+        bad = np.flatnonzero((indices < 0) | (indices >= count))
+        if len(bad) > 0:
+            raise ValueError("{} edge {} has {} {} out of range [0, {})".format(name, bad[0], kind, indices[bad[0]], count))
+    if same_pool:
+        loops = np.flatnonzero(sources == targets)
+        if len(loops) > 0:
+            raise ValueError("{} edge {} is a self-loop on {}".format(name, loops[0], sources[loops[0]]))
+    keys = sources * max(num_pairs, 1) + targets
+    (unique, counts) = np.unique(keys, return_counts=True)
+    if np.any(counts > 1):
+        duplicate = unique[np.argmax(counts > 1)]
+        raise ValueError("{} has a duplicate edge from {} to {}".format(name, duplicate // max(num_pairs, 1),
+                                                                         duplicate % max(num_pairs, 1)))
+
+
+def load_pool(market, population, pool, edge_path=None):
+    """
+    adds all the pairs and altruists of a pool snapshot to a market, with the edges of the pool if it has any
+    the time_to_critical values missing from a .csv pool are drawn from the perish stream of the market
+    :param market: the Market to add the pool to, whose table is the table of population
+    :param population: the Population giving the pairs their ids and weights
+    :param pool: a Pool, or the path of a pool (see read_pool)
+    :param edge_path: the path of a file with the edges between pairs, see read_pool
+    :return: the list of pairs and the list of altruists added, as tuples (recipient, donor)
+    :raise ValueError: if an edge list of the pool is not valid, see check_edges
+    """
+    if not isinstance(pool, Pool):
+        pool = read_pool(pool, edge_path, market.random_streams.perish)
+    if pool.edges is not None:
+        check_edges(pool.edges, pool.num_pairs, pool.num_pairs, True, "The pair edge list")
+    if pool.ndd_edges is not None:
+        check_edges(pool.ndd_edges, pool.num_altruists, pool.num_pairs, False, "The altruist edge list")
+    pairs = population.build_pairs(pool.pairs)
+    altruists = population.build_altruists(pool.altruists)
+    if pool.edges is None and pool.ndd_edges is None:
+        market.import_pairs(pairs, altruists)
+        return pairs, altruists
+
+    # pair i is at position i and altruist j at position num_pairs + j
+    donor_rows = np.array([donor.row for (recipient, donor) in pairs + altruists], dtype=np.int64)
+    recipient_rows = np.array([recipient.row for (recipient, donor) in pairs], dtype=np.int64)
+    edges = [edge for edge in [pool.edges, pool.ndd_edges] if edge is not None]
+    sources = [pool.edges[0]] if pool.edges is not None else list()
+    if pool.ndd_edges is not None:
+        sources.append(pool.ndd_edges[0] + pool.num_pairs)
+    sources = np.concatenate(sources)
+    targets = np.concatenate([edge[1] for edge in edges])
+    weights = np.concatenate([edge[2] for edge in edges])
+    market.import_pairs(pairs, altruists, donor_rows[sources], recipient_rows[targets], weights)
+    return pairs, altruists
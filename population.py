@@ -1,9 +1,66 @@
-from participant import Participant
+from participant import BLOOD_TYPES, PROVINCES, ABO_COMPATIBLE
+from participant_table import ParticipantTable
 import os
 from config import PER_A, PER_B, PER_AB, PER_O, PER_CPRA, CPRA, TIME_TO_CRITICAL_LOW, ALT_WEIGHT, ARRIVAL_RATE, WEIGHTS, DATA_PATH, PER_BC, PER_AL, PER_SK, PER_MN, PER_ON, PER_QC, PER_NS, PER_NB, PER_PEI, PER_NFL
 from config import CPRA1, CPRA2, CPRA3, CPRA4, CPRA5
 import numpy as np
 
+# probabilities of the blood type and province codes in participant.BLOOD_TYPES and participant.PROVINCES
+BLOOD_TYPE_P = [PER_O, PER_A, PER_B, PER_AB]
+PROVINCE_P = [PER_BC, PER_AL, PER_SK, PER_MN, PER_ON, PER_QC, PER_NS, PER_NB, PER_PEI, PER_NFL]
+
+
+# bootstrap samples that have already been loaded in this process, keyed by path
+_bootstrap_cache = {}
+
+
+def load_bootstrap(file_name):
+    """
+    loads one of the bootstrap samples in DATA_PATH, at most once per process
+    the array is memory-mapped read-only, so every Population of the process uses the same array and worker processes
+    (forked from this one or reading the same file) share its pages instead of each holding a copy
+    :param file_name: the name of the .npy file
+    :return: a read-only array
+    """
+    path = os.path.join(DATA_PATH, file_name)
+    if path not in _bootstrap_cache:
+        _bootstrap_cache[path] = np.load(path, mmap_mode='r')
+    return _bootstrap_cache[path]
+
+
+def acceptance_rate():
+    """
+    the probability that a sampled patient-donor pair is kept, i.e. that it is blood-type incompatible
+    or that it is blood-type compatible but tissue-type incompatible
+    :return: a float
+    """
+    p_abo = np.outer(BLOOD_TYPE_P, BLOOD_TYPE_P)
+    p_compatible = np.sum(p_abo[ABO_COMPATIBLE[:4, :4]])
+    mean_cpra = np.array([(low + high) / 2.0 for (low, high) in CPRA])
+    return float(np.dot(PER_CPRA, (1 - p_compatible) + p_compatible * mean_cpra))
+
+
+def cpra_band(cpra):
+    """
+    finds the cpra level in CPRA that a cpra value falls in
+    :param cpra: a float or an array of floats
+    :return: the index of the cpra level (or an array of indices)
+    """
+    return np.searchsorted([level[1] for level in CPRA[:-1]], cpra, side='left')
+
+
+def draw_time_to_critical(n, first_flag, perish_rng):
+    """
+    draws how long participants can stay in the market
+    :param n: the number of values
+    :param first_flag: True for the pairs of the starting pool, whose time is uniform, False for arrivals and altruists
+    :param perish_rng: the random generator to draw from
+    :return: an array of n ints
+    """
+    if first_flag:
+        return perish_rng.uniform(low=10, high=70, size=n).astype(int)
+    return perish_rng.poisson(TIME_TO_CRITICAL_LOW, size=n)
+
 
 class Population:
     """
@@ -11,71 +68,164 @@ class Population:
     ---------
     count: int
         count that keeps track of how many pairs have entered the market and ensures that each pair is given a unique id
+    table: ParticipantTable
+        the table the participants created by the population are stored in
     """
 
     def __init__(self, weights=None):
         #self.random_state = np.random.RandomState()
         self.count = 0
-        dialysis_days_file_path = os.path.join(DATA_PATH, "patient_days_bootstring.npy")
-        donor_ages_file_path = os.path.join(DATA_PATH, "donor_ages_bootstring.npy")
-        patient_ages_file_path = os.path.join(DATA_PATH, "patient_ages_bootstring.npy")
-
-        self.dialysis_days = np.load(dialysis_days_file_path)
-        self.donor_ages = np.load(donor_ages_file_path)
-        self.patient_ages = np.load(patient_ages_file_path)
+        self.table = ParticipantTable()
+        self.dialysis_days = load_bootstrap("patient_days_bootstring.npy")
+        self.donor_ages = load_bootstrap("donor_ages_bootstring.npy")
+        self.patient_ages = load_bootstrap("patient_ages_bootstring.npy")
 
         self.weights = weights
+        self.weight_tensor = self.build_weight_tensor()
 
 
 
-    def generate_pairs(self, num_pairs,first_flag):
+    def generate_pairs(self, num_pairs,first_flag, rng=np.random, perish_rng=None):
         """
         generates new patient-donor pairs based on the distribution of the population
         :param num_pairs: int - the number of pairs to generate
                first_flag: boolean - a boolean indicating the first period
+               rng: a numpy Generator or RandomState (or the np.random module) to draw from
+               perish_rng: the random generator time_to_critical values are drawn from, rng if None
         :return: a list of tuples of participants in the form (recipient, donor)
         """
+        if perish_rng is None:
+            perish_rng = rng
         new_pairs = list()
         i = 0
         while i < num_pairs:
-            index = np.random.choice(len(CPRA), p=PER_CPRA)
+            index = rng.choice(len(CPRA), p=PER_CPRA)
             cpra_range = CPRA[index]
-            cpra = np.random.uniform(cpra_range[0], cpra_range[1])
-            donor_type = np.random.choice(['A', 'B', 'O', 'AB'], p=[PER_A, PER_B, PER_O, PER_AB])
-            recipient_type = np.random.choice(['A', 'B', 'O', 'AB'], p=[PER_A, PER_B, PER_O, PER_AB])
+            cpra = rng.uniform(cpra_range[0], cpra_range[1])
+            donor_type = rng.choice(['A', 'B', 'O', 'AB'], p=[PER_A, PER_B, PER_O, PER_AB])
+            recipient_type = rng.choice(['A', 'B', 'O', 'AB'], p=[PER_A, PER_B, PER_O, PER_AB])
             weight = self.calculate_weight(donor_type, recipient_type, cpra, index)
 
-            dialysis_day = np.random.choice(self.dialysis_days)
-            donor_age = np.random.choice(self.donor_ages)
-            patient_age = np.random.choice(self.patient_ages)
+            dialysis_day = rng.choice(self.dialysis_days)
+            donor_age = rng.choice(self.donor_ages)
+            patient_age = rng.choice(self.patient_ages)
 
             # generate a random time_to_critical value using a uniform distribution
             if first_flag:
                 upper = 70
                 lower = 10
-                time_to_critical = int(np.random.uniform(low = lower, high = upper, size = 1))
+                time_to_critical = int(perish_rng.uniform(low = lower, high = upper, size = 1))
             else:
                 #a = 1
-                time_to_critical = int(np.random.poisson(TIME_TO_CRITICAL_LOW, size = 1))
+                time_to_critical = int(perish_rng.poisson(TIME_TO_CRITICAL_LOW, size = 1))
 
-            province = np.random.choice(['BC', 'AL', 'SK', 'MN', 'ON', 'QC', 'NS', 'NB', 'PEI', 'NFL'], p=[PER_BC, PER_AL, PER_SK, PER_MN, PER_ON, PER_QC, PER_NS, PER_NB, PER_PEI, PER_NFL])
+            province = rng.choice(['BC', 'AL', 'SK', 'MN', 'ON', 'QC', 'NS', 'NB', 'PEI', 'NFL'], p=[PER_BC, PER_AL, PER_SK, PER_MN, PER_ON, PER_QC, PER_NS, PER_NB, PER_PEI, PER_NFL])
 
             # if they are blood type compatible, only create new participant pairs if they are tissue type incompatible
             if donor_type == 'O' or recipient_type == 'AB' or donor_type == recipient_type:
-                if np.random.choice([True, False], p=[cpra, 1-cpra]):
-                    donor = Participant(self.count, donor_type, donor=True, recipient=False, altruist = False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=donor_age, dialysis_days=dialysis_day, province=province)
-                    recipient = Participant(self.count, recipient_type, donor=False, recipient=True, altruist = False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=patient_age, dialysis_days=dialysis_day, province=province)
+                if rng.choice([True, False], p=[cpra, 1-cpra]):
+                    donor = self.table.add(self.count, donor_type, donor=True, recipient=False, altruist = False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=donor_age, dialysis_days=dialysis_day, province=province)
+                    recipient = self.table.add(self.count, recipient_type, donor=False, recipient=True, altruist = False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=patient_age, dialysis_days=dialysis_day, province=province)
                     new_pairs.append((recipient, donor))
                     i += 1
                     self.count += 1
             else:
-                donor = Participant(self.count, donor_type, donor=True, recipient=False, altruist = False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=donor_age, dialysis_days=dialysis_day, province=province)
-                recipient = Participant(self.count, recipient_type, donor=False, recipient=True, altruist = False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=patient_age, dialysis_days=dialysis_day,province=province)
+                donor = self.table.add(self.count, donor_type, donor=True, recipient=False, altruist = False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=donor_age, dialysis_days=dialysis_day, province=province)
+                recipient = self.table.add(self.count, recipient_type, donor=False, recipient=True, altruist = False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=patient_age, dialysis_days=dialysis_day,province=province)
                 new_pairs.append((recipient, donor))
                 i += 1
                 self.count += 1
         return new_pairs
 
+    def generate_pairs_batch(self, num_pairs, first_flag, rng=np.random, perish_rng=None):
+        """
+        generates new patient-donor pairs based on the distribution of the population
+        the whole cohort is sampled as arrays and only turned into Participants at the end
+        :param num_pairs: int - the number of pairs to generate
+               first_flag: boolean - a boolean indicating the first period
+               rng: a numpy Generator or RandomState (or the np.random module) to draw from
+               perish_rng: the random generator time_to_critical values are drawn from, rng if None
+        :return: a list of tuples of participants in the form (recipient, donor)
+        """
+        return self.build_pairs(self.sample_cohort(num_pairs, first_flag, rng, perish_rng))
+
+    def sample_cohort(self, num_pairs, first_flag, rng=np.random, perish_rng=None):
+        """
+        samples the attributes of num_pairs patient-donor pairs as arrays
+        cpra levels and blood types are drawn first for a batch of candidates and the tissue-type test is applied
+        to the whole batch at once; candidates are drawn until num_pairs of them are kept. The remaining attributes
+        are only drawn for the kept pairs
+        :param num_pairs: int - the number of pairs to generate
+               first_flag: boolean - a boolean indicating the first period
+               rng: a numpy Generator or RandomState (or the np.random module) to draw from
+               perish_rng: the random generator time_to_critical values are drawn from, rng if None
+        :return: a dictionary of arrays of length num_pairs, blood types and provinces are given as integer codes
+        """
+        cpra_index = [np.zeros(0, dtype=int)]
+        cpra = [np.zeros(0)]
+        donor_type = [np.zeros(0, dtype=int)]
+        recipient_type = [np.zeros(0, dtype=int)]
+        kept = 0
+        rate = acceptance_rate()
+        while kept < num_pairs:
+            size = int((num_pairs - kept) / rate * 1.1) + 8
+            index = rng.choice(len(CPRA), size=size, p=PER_CPRA)
+            bounds = np.array(CPRA)[index]
+            values = rng.uniform(bounds[:, 0], bounds[:, 1])
+            donors = rng.choice(4, size=size, p=BLOOD_TYPE_P)
+            recipients = rng.choice(4, size=size, p=BLOOD_TYPE_P)
+            # if they are blood type compatible, only keep pairs that are tissue type incompatible
+            keep = ~ABO_COMPATIBLE[donors, recipients] | (rng.uniform(size=size) < values)
+            keep = np.flatnonzero(keep)[:num_pairs - kept]
+            cpra_index.append(index[keep])
+            cpra.append(values[keep])
+            donor_type.append(donors[keep])
+            recipient_type.append(recipients[keep])
+            kept += len(keep)
+
+        # generate a random time_to_critical value using a uniform distribution
+        if perish_rng is None:
+            perish_rng = rng
+        time_to_critical = draw_time_to_critical(num_pairs, first_flag, perish_rng)
+        return {
+            'cpra_index': np.concatenate(cpra_index),
+            'cpra': np.concatenate(cpra),
+            'donor_type': np.concatenate(donor_type),
+            'recipient_type': np.concatenate(recipient_type),
+            'dialysis_days': rng.choice(self.dialysis_days, size=num_pairs),
+            'donor_age': rng.choice(self.donor_ages, size=num_pairs),
+            'patient_age': rng.choice(self.patient_ages, size=num_pairs),
+            'time_to_critical': time_to_critical,
+            'province': rng.choice(len(PROVINCES), size=num_pairs, p=PROVINCE_P),
+        }
+
+    def cohort_weights(self, cohort):
+        """
+        :param cohort: a dictionary of attribute arrays, as sampled by sample_cohort
+        :return: the array of the weights of the pairs of the cohort
+        """
+        if WEIGHTS == "OPT" and self.weights is not None:
+            # trained weights are selected by the cpra value
+            cpra_index = cpra_band(cohort['cpra'])
+        else:
+            cpra_index = cohort['cpra_index']
+        return self.calculate_weights(cpra_index, cohort['donor_type'], cohort['recipient_type'])
+
+    def build_pairs(self, cohort):
+        """
+        creates the Participants of a cohort sampled by sample_cohort and gives each pair a unique id
+        :param cohort: a dictionary of attribute arrays
+        :return: a list of tuples of participants in the form (recipient, donor)
+        """
+        weights = self.cohort_weights(cohort)
+        n = len(cohort['cpra'])
+        donors, recipients = self.table.add_pairs(np.arange(self.count, self.count + n), cohort['donor_type'],
+                                                  cohort['recipient_type'], cohort['cpra'], weights,
+                                                  cohort['time_to_critical'], cohort['donor_age'], cohort['patient_age'],
+                                                  cohort['dialysis_days'], cohort['province'])
+        self.count += n
+        return list(zip(self.table.views(recipients), self.table.views(donors)))
+
     def gen_rand_population_size(self):
         """
         gets a random population size centered around the arrival rate
@@ -84,446 +234,109 @@ class Population:
         difference = int(float(ARRIVAL_RATE) / 3.0)
         return np.random.choice([ARRIVAL_RATE - (difference * 2), ARRIVAL_RATE - difference, ARRIVAL_RATE, ARRIVAL_RATE + difference, ARRIVAL_RATE + (difference * 2)], p=[0.1, 0.2, 0.4, 0.2, 0.1])
 
-    def generate_altruist(self, random_state):
+    def generate_altruist(self, random_state, perish_rng=None):
         """
         generates an altruistic donor
+        :param random_state: the random generator to draw from
+        :param perish_rng: the random generator the time_to_critical value is drawn from, random_state if None
         :return: a tuple of Participants in the form ("fake recipient", altruisitc donor)
         """
+        if perish_rng is None:
+            perish_rng = random_state
         donor_age = random_state.choice(self.donor_ages)
         donor_type = random_state.choice(['A', 'B', 'O', 'AB'], p=[PER_A, PER_B, PER_O, PER_AB])
-        time_to_critical = int(random_state.poisson(lam = TIME_TO_CRITICAL_LOW, size = 1))
-        altruistic_donor = Participant(self.count, donor_type, donor=True, recipient=False, altruist = True, time_to_critical=time_to_critical, weight=ALT_WEIGHT, cpra=0, age=donor_age, dialysis_days=0)
-        recipient = Participant(self.count, blood_type='X', donor=False, recipient=True,  altruist = True, time_to_critical=time_to_critical, weight=ALT_WEIGHT, cpra=0, dialysis_days=0)
+        time_to_critical = int(perish_rng.poisson(lam = TIME_TO_CRITICAL_LOW, size = 1))
+        altruistic_donor = self.table.add(self.count, donor_type, donor=True, recipient=False, altruist = True, time_to_critical=time_to_critical, weight=ALT_WEIGHT, cpra=0, age=donor_age, dialysis_days=0)
+        recipient = self.table.add(self.count, blood_type='X', donor=False, recipient=True,  altruist = True, time_to_critical=time_to_critical, weight=ALT_WEIGHT, cpra=0, dialysis_days=0)
         self.count += 1
         return recipient, altruistic_donor
 
+    def generate_altruists(self, n, rng, perish_rng=None):
+        """
+        generates n altruistic donors in one vectorized pass
+        the random stream is consumed in a fixed order: n donor ages, then n blood types, then n time_to_critical
+        values (from perish_rng if it is given), so the same rng state always gives the same altruists
+        :param n: int - the number of altruists to generate
+        :param rng: a numpy Generator or RandomState to draw from
+        :param perish_rng: the random generator time_to_critical values are drawn from, rng if None
+        :return: a list of tuples of Participants in the form ("fake recipient", altruistic donor)
+        """
+        return self.build_altruists(self.sample_altruists(n, rng, perish_rng))
+
+    def sample_altruists(self, n, rng, perish_rng=None):
+        """
+        samples the attributes of n altruistic donors as arrays, in the order documented in generate_altruists
+        :param n: int - the number of altruists to generate
+        :param rng: a numpy Generator or RandomState to draw from
+        :param perish_rng: the random generator time_to_critical values are drawn from, rng if None
+        :return: a dictionary of arrays of length n, blood types are given as integer codes
+        """
+        if perish_rng is None:
+            perish_rng = rng
+        donor_age = rng.choice(self.donor_ages, size=n)
+        donor_type = rng.choice(4, size=n, p=BLOOD_TYPE_P)
+        return {
+            'donor_age': donor_age,
+            'donor_type': donor_type,
+            'time_to_critical': draw_time_to_critical(n, False, perish_rng),
+        }
+
+    def build_altruists(self, cohort):
+        """
+        creates the Participants of altruists sampled by sample_altruists and gives each one a unique id
+        :param cohort: a dictionary of attribute arrays
+        :return: a list of tuples of Participants in the form ("fake recipient", altruistic donor)
+        """
+        n = len(cohort['donor_type'])
+        donors, recipients = self.table.add_pairs(np.arange(self.count, self.count + n), cohort['donor_type'],
+                                                  BLOOD_TYPES.index('X'), 0, ALT_WEIGHT, cohort['time_to_critical'],
+                                                  cohort['donor_age'], 30, 0, -1, altruist=True)
+        self.count += n
+        return list(zip(self.table.views(recipients), self.table.views(donors)))
+
+    def build_weight_tensor(self):
+        """
+        builds the table of pair weights used by calculate_weight and calculate_weights
+        :return: an array of shape (5, 4, 4) where entry [cpra level][donor type][recipient type] is the weight of
+                 the pair, blood types are indexed by their codes in participant.BLOOD_TYPES
+        """
+        if WEIGHTS == "OPT":
+            if self.weights is not None:
+                # weights obtained while training
+                matrices = [self.weights.w_cpra1, self.weights.w_cpra2, self.weights.w_cpra3, self.weights.w_cpra4, self.weights.w_cpra5]
+            else:
+                # specify the weights you want here - usually use those found by training
+                matrices = [CPRA1, CPRA2, CPRA3, CPRA4, CPRA5]
+            # the matrices have recipients as rows and donors as columns
+            return np.array([np.array(matrix)[:4, :4].T for matrix in matrices])
+        return np.full((len(CPRA), 4, 4), 2)
+
+    def update_weight_tensor(self):
+        """
+        rebuilds the weight table, e.g. after the trained weights have changed
+        """
+        self.weight_tensor = self.build_weight_tensor()
+
     def calculate_weight(self, donor_type, recipient_type, cpra, index):
         """
         determines the weight of a pair based on blood type of patient and donor and cpra
         :param donor_type: blood type of the donor
         :param recipient_type: blood type of the recipient
         :param cpra: the cpra
-        :return: a weight in the form of an int
+        :param index: the cpra level the cpra was drawn from
+        :return: a weight
         """
-        if WEIGHTS == "CONST":
-            return 2
-        elif WEIGHTS == "OPT":
-            # weights obtained while training
-            if self.weights is not None:
-                if cpra == CPRA[0][1]:
-                    if donor_type == 'O':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra1[0][0]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra1[1][0]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra1[2][0]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra1[3][0]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra1[4][0]
-                    if donor_type == 'A':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra1[0][1]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra1[1][1]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra1[2][1]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra1[3][1]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra1[4][1]
-                    if donor_type == 'B':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra1[0][2]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra1[1][2]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra1[2][2]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra1[3][2]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra1[4][2]
-                    if donor_type == 'AB':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra1[0][3]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra1[1][3]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra1[2][3]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra1[3][3]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra1[4][3]
-                elif cpra <= CPRA[1][1]:
-                    if donor_type == 'O':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra2[0][0]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra2[1][0]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra2[2][0]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra2[3][0]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra2[4][0]
-                    if donor_type == 'A':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra2[0][1]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra2[1][1]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra2[2][1]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra2[3][1]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra2[4][1]
-                    if donor_type == 'B':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra2[0][2]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra2[1][2]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra2[2][2]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra2[3][2]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra2[4][2]
-                    if donor_type == 'AB':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra2[0][3]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra2[1][3]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra2[2][3]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra2[3][3]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra2[4][3]
-                elif cpra <= CPRA[2][1]:
-                    if donor_type == 'O':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra3[0][0]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra3[1][0]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra3[2][0]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra3[3][0]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra3[4][0]
-                    if donor_type == 'A':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra3[0][1]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra3[1][1]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra3[2][1]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra3[3][1]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra3[4][1]
-                    if donor_type == 'B':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra3[0][2]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra3[1][2]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra3[2][2]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra3[3][2]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra3[4][2]
-                    if donor_type == 'AB':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra3[0][3]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra3[1][3]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra3[2][3]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra3[3][3]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra3[4][3]
-                elif cpra <= CPRA[3][1]:
-                    if donor_type == 'O':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra4[0][0]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra4[1][0]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra4[2][0]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra4[3][0]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra4[4][0]
-                    if donor_type == 'A':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra4[0][1]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra4[1][1]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra4[2][1]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra4[3][1]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra4[4][1]
-                    if donor_type == 'B':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra4[0][2]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra4[1][2]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra4[2][2]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra4[3][2]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra4[4][2]
-                    if donor_type == 'AB':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra4[0][3]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra4[1][3]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra4[2][3]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra4[3][3]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra4[4][3]
-                elif cpra <= CPRA[4][1]:
-                    if donor_type == 'O':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra5[0][0]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra5[1][0]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra5[2][0]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra5[3][0]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra5[4][0]
-                    if donor_type == 'A':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra5[0][1]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra5[1][1]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra5[2][1]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra5[3][1]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra5[4][1]
-                    if donor_type == 'B':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra5[0][2]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra5[1][2]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra5[2][2]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra5[3][2]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra5[4][2]
-                    if donor_type == 'AB':
-                        if recipient_type == 'O':
-                            return self.weights.w_cpra5[0][3]
-                        elif recipient_type == 'A':
-                            return self.weights.w_cpra5[1][3]
-                        elif recipient_type == 'B':
-                            return self.weights.w_cpra5[2][3]
-                        elif recipient_type == 'AB':
-                            return self.weights.w_cpra5[3][3]
-                        elif recipient_type == 'X':
-                            return self.weights.w_cpra5[4][3]
-            else:
-                # specify the weights you want here - usually use those found by training
-                # initialize 5 cpra matrices
-                # select the weights according to the input, search by cpra first
-                if index == 0:
-                    if recipient_type == "O":
-                        if donor_type == "O":
-                            return CPRA1[0][0]
-                        elif donor_type == "A":
-                            return CPRA1[0][1]
-                        elif donor_type == "B":
-                            return CPRA1[0][2]
-                        elif donor_type == "AB":
-                            return CPRA1[0][3]
-                    if recipient_type == "A":
-                        if donor_type == "O":
-                            return CPRA1[1][0]
-                        elif donor_type == "A":
-                            return CPRA1[1][1]
-                        elif donor_type == "B":
-                            return CPRA1[1][2]
-                        elif donor_type == "AB":
-                            return CPRA1[1][3]
-                    if recipient_type == "B":
-                        if donor_type == "O":
-                            return CPRA1[2][0]
-                        elif donor_type == "A":
-                            return CPRA1[2][1]
-                        elif donor_type == "B":
-                            return CPRA1[2][2]
-                        elif donor_type == "AB":
-                            return CPRA1[2][3]
-                    if recipient_type == "AB":
-                        if donor_type == "O":
-                            return CPRA1[3][0]
-                        elif donor_type == "A":
-                            return CPRA1[3][1]
-                        elif donor_type == "B":
-                            return CPRA1[3][2]
-                        elif donor_type == "AB":
-                            return CPRA1[3][3]
-                elif index == 1:
-                    if recipient_type == "O":
-                        if donor_type == "O":
-                            return CPRA2[0][0]
-                        elif donor_type == "A":
-                            return CPRA2[0][1]
-                        elif donor_type == "B":
-                            return CPRA2[0][2]
-                        elif donor_type == "AB":
-                            return CPRA2[0][3]
-                    if recipient_type == "A":
-                        if donor_type == "O":
-                            return CPRA2[1][0]
-                        elif donor_type == "A":
-                            return CPRA2[1][1]
-                        elif donor_type == "B":
-                            return CPRA2[1][2]
-                        elif donor_type == "AB":
-                            return CPRA2[1][3]
-                    if recipient_type == "B":
-                        if donor_type == "O":
-                            return CPRA2[2][0]
-                        elif donor_type == "A":
-                            return CPRA2[2][1]
-                        elif donor_type == "B":
-                            return CPRA2[2][2]
-                        elif donor_type == "AB":
-                            return CPRA2[2][3]
-                    if recipient_type == "AB":
-                        if donor_type == "O":
-                            return CPRA2[3][0]
-                        elif donor_type == "A":
-                            return CPRA2[3][1]
-                        elif donor_type == "B":
-                            return CPRA2[3][2]
-                        elif donor_type == "AB":
-                            return CPRA2[3][3]
-                elif index == 2:
-                    if recipient_type == "O":
-                        if donor_type == "O":
-                            return CPRA3[0][0]
-                        elif donor_type == "A":
-                            return CPRA3[0][1]
-                        elif donor_type == "B":
-                            return CPRA3[0][2]
-                        elif donor_type == "AB":
-                            return CPRA3[0][3]
-                    if recipient_type == "A":
-                        if donor_type == "O":
-                            return CPRA3[1][0]
-                        elif donor_type == "A":
-                            return CPRA3[1][1]
-                        elif donor_type == "B":
-                            return CPRA3[1][2]
-                        elif donor_type == "AB":
-                            return CPRA3[1][3]
-                    if recipient_type == "B":
-                        if donor_type == "O":
-                            return CPRA3[2][0]
-                        elif donor_type == "A":
-                            return CPRA3[2][1]
-                        elif donor_type == "B":
-                            return CPRA3[2][2]
-                        elif donor_type == "AB":
-                            return CPRA3[2][3]
-                    if recipient_type == "AB":
-                        if donor_type == "O":
-                            return CPRA3[3][0]
-                        elif donor_type == "A":
-                            return CPRA3[3][1]
-                        elif donor_type == "B":
-                            return CPRA3[3][2]
-                        elif donor_type == "AB":
-                            return CPRA3[3][3]
-                elif index == 3:
-                    if recipient_type == "O":
-                        if donor_type == "O":
-                            return CPRA4[0][0]
-                        elif donor_type == "A":
-                            return CPRA4[0][1]
-                        elif donor_type == "B":
-                            return CPRA4[0][2]
-                        elif donor_type == "AB":
-                            return CPRA4[0][3]
-                    if recipient_type == "A":
-                        if donor_type == "O":
-                            return CPRA4[1][0]
-                        elif donor_type == "A":
-                            return CPRA4[1][1]
-                        elif donor_type == "B":
-                            return CPRA4[1][2]
-                        elif donor_type == "AB":
-                            return CPRA4[1][3]
-                    if recipient_type == "B":
-                        if donor_type == "O":
-                            return CPRA4[2][0]
-                        elif donor_type == "A":
-                            return CPRA4[2][1]
-                        elif donor_type == "B":
-                            return CPRA4[2][2]
-                        elif donor_type == "AB":
-                            return CPRA4[2][3]
-                    if recipient_type == "AB":
-                        if donor_type == "O":
-                            return CPRA4[3][0]
-                        elif donor_type == "A":
-                            return CPRA4[3][1]
-                        elif donor_type == "B":
-                            return CPRA4[3][2]
-                        elif donor_type == "AB":
-                            return CPRA4[3][3]
-                elif index == 4:
-                    if recipient_type == "O":
-                        if donor_type == "O":
-                            return CPRA5[0][0]
-                        elif donor_type == "A":
-                            return CPRA5[0][1]
-                        elif donor_type == "B":
-                            return CPRA5[0][2]
-                        elif donor_type == "AB":
-                            return CPRA5[0][3]
-                    if recipient_type == "A":
-                        if donor_type == "O":
-                            return CPRA5[1][0]
-                        elif donor_type == "A":
-                            return CPRA5[1][1]
-                        elif donor_type == "B":
-                            return CPRA5[1][2]
-                        elif donor_type == "AB":
-                            return CPRA5[1][3]
-                    if recipient_type == "B":
-                        if donor_type == "O":
-                            return CPRA5[2][0]
-                        elif donor_type == "A":
-                            return CPRA5[2][1]
-                        elif donor_type == "B":
-                            return CPRA5[2][2]
-                        elif donor_type == "AB":
-                            return CPRA5[2][3]
-                    if recipient_type == "AB":
-                        if donor_type == "O":
-                            return CPRA5[3][0]
-                        elif donor_type == "A":
-                            return CPRA5[3][1]
-                        elif donor_type == "B":
-                            return CPRA5[3][2]
-                        elif donor_type == "AB":
-                            return CPRA5[3][3]
-                return 2
-        return 2
+        if WEIGHTS == "OPT" and self.weights is not None:
+            # trained weights are selected by the cpra value
+            index = cpra_band(cpra)
+        return self.weight_tensor[index, BLOOD_TYPES.index(donor_type), BLOOD_TYPES.index(recipient_type)].item()
 
+    def calculate_weights(self, cpra_idx, donor_codes, recipient_codes):
+        """
+        determines the weights of a whole cohort of pairs at once
+        :param cpra_idx: array of cpra levels, as given by cpra_band
+        :param donor_codes: array of donor blood type codes
+        :param recipient_codes: array of recipient blood type codes
+        :return: an array of weights
+        """
+        return self.weight_tensor[cpra_idx, donor_codes, recipient_codes]
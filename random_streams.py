@@ -0,0 +1,71 @@
+import numpy as np
+
+"""
+Independent random number streams for the different parts of a simulation
+All the streams are derived from a single seed, so a simulation is reproducible from its seed alone, and changing how
+many numbers one part of the simulation draws does not change the numbers drawn by the other parts
+The arrivals, altruists and perish streams are only used to generate arrivals, so the arrivals of the next period can
+be generated in another thread while the market runs
+"""
+
+# the names of the streams, in the order they are spawned from the seed
+STREAM_NAMES = ['arrivals', 'altruists', 'crossmatch', 'perish', 'reuse', 'bridge']
+
+
+class RandomStreams:
+    """
+    A set of named, independent random number generators derived from one seed
+    Every stream is a numpy Generator on a Philox bit generator
+    ----------
+    seed_sequence: SeedSequence
+        the seed sequence all the streams are spawned from
+    arrivals: Generator
+        the number of new pairs in a period and their attributes
+    altruists: Generator
+        the number of altruists in a period and their attributes
+    crossmatch: Generator
+        the tissue-type compatibility tests between donors and recipients
+    perish: Generator
+        the time_to_critical of new pairs and altruists
+    reuse: Generator
+        whether the last donor of a chain stays in the market as a bridge donor
+    bridge: Generator
+        the time_to_critical of bridge donors
+    """
+
+    def __init__(self, seed=None, seed_sequence=None, generators=None):
+        if seed_sequence is None:
+            seed_sequence = np.random.SeedSequence(seed)
+        self.seed_sequence = seed_sequence
+        if generators is None:
+            children = seed_sequence.spawn(len(STREAM_NAMES))
+            generators = [np.random.Generator(np.random.Philox(child)) for child in children]
+        for (name, generator) in zip(STREAM_NAMES, generators):
+            setattr(self, name, generator)
+
+    def stream(self, name):
+        """
+        :param name: one of STREAM_NAMES
+        :return: the Generator of the stream
+        """
+        return getattr(self, name)
+
+    def spawn(self, n):
+        """
+        creates independent child streams, e.g. one set for every worker process
+        the children only depend on the seed and on how many children were spawned before, so handing child i to
+        worker i gives the same results however the workers are scheduled
+        :param n: the number of children
+        :return: a list of RandomStreams
+        """
+        return [RandomStreams(seed_sequence=child) for child in self.seed_sequence.spawn(n)]
+
+    def jumped(self, jumps=1):
+        """
+        creates a copy of the streams with every generator advanced by jumps * 2^128 draws
+        the copies never overlap with the original streams, so they can be used by another thread or process
+        :param jumps: the number of jumps
+        :return: a RandomStreams
+        """
+        generators = [np.random.Generator(self.stream(name).bit_generator.jumped(jumps)) for name in STREAM_NAMES]
+        return RandomStreams(seed_sequence=self.seed_sequence, generators=generators)
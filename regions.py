@@ -0,0 +1,442 @@
+import multiprocessing
+import traceback
+import numpy as np
+import algorithms.max_matching as mm
+import market_metrics as met
+from market import Market
+from population import Population, PROVINCE_P, cpra_band
+from participant import ABO_COMPATIBLE, PROVINCES, ALTRUIST
+from arrival_stream import ArrivalStream, PAIR_COLUMNS, ALTRUIST_COLUMNS, generate_arrival_stream, read_arrival_stream
+from random_streams import RandomStreams
+from config import REGIONS, EXCHANGE_EVERY, EXCHANGE_CPRA, NUM_PERIODS, START_SIZE, ARRIVAL_RATE, NUM_ALTRUISTS, \
+    CYCLE_CAP, CHAIN_CAP
+
+"""
+Runs a simulation as several regional sub-markets, e.g. one per province or group of provinces, each in a worker
+process of its own with its own solver
+The arrivals are drawn for the whole country, as in a national simulation with the same seed and per_period (see
+arrival_stream.generate_arrival_stream), and every pair goes to the region of its province. Altruists have no province and go to a region drawn with the
+probability of its provinces. Every EXCHANGE_EVERY periods the residual pools of all the regions (the pairs whose
+recipient has a cpra of at least EXCHANGE_CPRA, and the altruists) are merged and matched together, and the pairs
+matched in this exchange leave their regional markets
+"""
+
+# the multiplier of the donor key and of the recipient key in the hash of a cross-region tissue-type test
+DONOR_KEY_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+RECIPIENT_KEY_MULTIPLIER = np.uint64(0xD1B54A32D192ED03)
+
+
+def stable_uniforms(seed, donor_keys, recipient_keys):
+    """
+    gives every (donor, recipient) a uniform number that only depends on the seed and on the two keys, with the
+    finaliser of splitmix64. A pair offered at several exchanges is then tested against the same recipients with the
+    same outcome every time, as it would be in a national market, instead of being crossmatched again
+    :param seed: an unsigned 64-bit integer
+    :param donor_keys: array of the keys of the donors
+    :param recipient_keys: array of the keys of the recipients
+    :return: an array of floats in [0, 1)
+    """
+    with np.errstate(over='ignore'):
+        x = (np.uint64(seed) + donor_keys.astype(np.uint64) * DONOR_KEY_MULTIPLIER +
+             recipient_keys.astype(np.uint64) * RECIPIENT_KEY_MULTIPLIER)
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xBF58476D1CE4E5B9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+    return (x >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+def select(cohort, mask):
+    """
+    :return: the rows of a dictionary of attribute arrays where mask is True
+    """
+    return {key: np.asarray(column)[mask] for (key, column) in cohort.items()}
+
+
+class Region:
+    """
+    A regional sub-market, living in a worker process of a RegionalSimulation
+    ----------
+    name: string
+        the name of the region, which names its results file
+    population: Population
+        the population the participants of the region are created by, its ids are only unique within the region
+    market: Market
+        the market of the region
+    """
+
+    def __init__(self, name, initial_pairs, altruists, per_period, weights, max_cycle_size, max_path_size, random_streams):
+        self.name = name
+        self.population = Population(weights=weights)
+        pairs = self.population.build_pairs(initial_pairs)
+        self.market = Market(pairs, altruists, per_period, weights, run_num=name, max_cycle_size=max_cycle_size,
+                             max_path_size=max_path_size, random_streams=random_streams, table=self.population.table)
+
+    def run_period(self, period_num, pairs, altruists):
+        """
+        runs a period of the regional market
+        :param period_num: the period number
+        :param pairs: a dictionary of the attribute arrays of the pairs arriving in the region
+        :param altruists: a dictionary of the attribute arrays of the altruists arriving in the region
+        :return: the cycle and chain lengths of the matching, as given by Market.run_period
+        """
+        new_pairs = self.population.build_pairs(pairs)
+        new_altruists = self.population.build_altruists(altruists)
+        return self.market.run_period(new_participants=new_pairs, new_altruists=new_altruists, period_num=period_num)
+
+    def residual_pool(self, min_cpra):
+        """
+        the pairs and altruists of the region offered to the cross-region exchange
+        :param min_cpra: the lowest cpra of the recipient of a pair offered
+        :return: a dictionary with the attribute arrays of the pairs ('pairs') and of the altruists ('altruists'), their
+                 id_nums ('pair_ids' and 'altruist_ids') and the edges of the region between them ('edges': the arrays
+                 of sources, targets and weights)
+        """
+        table = self.market.table
+        donors = np.array([p.row for p in self.market.pair_dict.values()], dtype=np.int64)
+        recipients = table.column('partner')[donors]
+        altruist = (table.column('flags')[donors] & ALTRUIST) != 0
+        offered = table.column('alive')[recipients] & (altruist | (table.column('cpra')[recipients] >= min_cpra))
+        (pair_donors, pair_recipients) = (donors[offered & ~altruist], recipients[offered & ~altruist])
+        altruist_donors = donors[offered & altruist]
+        blood_type = table.column('blood_type')
+        age = table.column('age')
+        cpra = table.column('cpra')[pair_recipients]
+        pairs = {'cpra_index': cpra_band(cpra), 'cpra': cpra, 'donor_type': blood_type[pair_donors],
+                 'recipient_type': blood_type[pair_recipients],
+                 'dialysis_days': table.aged_column('dialysis_days')[pair_recipients],
+                 'donor_age': age[pair_donors], 'patient_age': age[pair_recipients],
+                 'time_to_critical': table.column('time_to_critical')[pair_donors],
+                 'province': table.column('province')[pair_donors]}
+        altruists = {'donor_age': age[altruist_donors], 'donor_type': blood_type[altruist_donors],
+                     'time_to_critical': table.column('time_to_critical')[altruist_donors]}
+        id_num = table.column('id_num')
+        (pair_ids, altruist_ids) = (id_num[pair_donors], id_num[altruist_donors])
+        graph = self.market.graph
+        edges = graph.live_edges()
+        (sources, targets) = (graph.sources[edges], graph.targets[edges])
+        keep = np.isin(sources, np.concatenate((pair_ids, altruist_ids))) & np.isin(targets, pair_ids)
+        return {'pairs': {key: pairs[key].astype(dtype) for (key, dtype) in PAIR_COLUMNS.items()},
+                'altruists': {key: altruists[key].astype(dtype) for (key, dtype) in ALTRUIST_COLUMNS.items()},
+                'pair_ids': pair_ids.astype(np.int64), 'altruist_ids': altruist_ids.astype(np.int64),
+                'edges': (sources[keep], targets[keep], graph.weights[edges][keep])}
+
+    def remove_exchanged(self, id_nums):
+        """
+        removes the pairs and altruists matched by the cross-region exchange from the market of the region
+        donors at the end of a chain of the exchange leave the market, they do not stay as bridge donors
+        :param id_nums: the id_nums of the pairs and altruists matched
+        :return: the number of pairs removed, not counting altruists
+        """
+        matched = list()
+        for id_num in id_nums:
+            donor = self.market.pair_dict[id_num]
+            recipient = donor.partner
+            if recipient.blood_type != 'X':
+                self.market.wait_times.append(recipient.time_in_market)
+                self.market.total_wait_time += recipient.time_in_market
+            matched.append((recipient, donor))
+        self.market.remove_pairs(matched)
+        return len([pair for pair in matched if pair[0].blood_type != 'X'])
+
+    def finish(self):
+        """
+        writes the results file of the region
+        :return: a dictionary of the totals of the region
+        """
+        self.market.metrics.close_table()
+        return {'name': self.name, 'total_num_matched': self.market.metrics.total_num_matched,
+                'total_wait_time': self.market.total_wait_time, 'num_remaining': len(self.market.participants) // 2}
+
+
+def serve(connection, region_args):
+    """
+    the loop of a worker process: creates its Region and calls the methods the RegionalSimulation asks for
+    every request is a tuple (method name, arguments) and is answered with (True, result), or (False, traceback) if
+    the method raised. A method name of None stops the worker
+    """
+    try:
+        region = Region(*region_args)
+        connection.send((True, None))
+    except Exception:
+        connection.send((False, traceback.format_exc()))
+        return
+    while True:
+        (method, args) = connection.recv()
+        if method is None:
+            break
+        try:
+            connection.send((True, getattr(region, method)(*args)))
+        except Exception:
+            connection.send((False, traceback.format_exc()))
+
+
+class RegionalSimulation:
+    """
+    A simulation with one market per region, each run in its own worker process, and a periodic cross-region exchange
+    ----------
+    regions: dict<string, list<string>>
+        the provinces of every region, every province of participant.PROVINCES must be in exactly one region
+    altruists: int
+        a mean parameter of # altruists that enter the country every "per_period" periods
+    per_period: int
+        altruists enter the market every "per_period"
+    exchange_every: int
+        the residual pools are matched together every exchange_every periods, 0 for never
+    exchange_cpra: float
+        the lowest cpra of the recipient of a pair offered to the exchange, 0 to offer all the pairs
+    arrival_stream: ArrivalStream
+        the arrivals of the whole country. A Simulations given the same stream runs the national market on them
+    cycle_chain_matches:
+        an array [x,x,x] of the matches by cycles and chains of all the regions and exchanges, as in Simulations
+    exchange_matches: list<int>
+        the number of transplants of every exchange
+    exchange_metrics: Metrics
+        the results of the exchanges, one row per exchange in a single workbook, None before the first exchange
+    """
+
+    def __init__(self, regions=REGIONS, altruists=NUM_ALTRUISTS, per_period=1, weights=None, seed_num=None,
+                 max_cycle_size=CYCLE_CAP, max_path_size=CHAIN_CAP, exchange_every=EXCHANGE_EVERY,
+                 exchange_cpra=EXCHANGE_CPRA, arrival_stream=None):
+        self.regions = regions
+        self.altruists = altruists
+        self.per_period = per_period
+        self.weights = weights
+        self.max_cycle_size = max_cycle_size
+        self.max_path_size = max_path_size
+        self.exchange_every = exchange_every
+        self.exchange_cpra = exchange_cpra
+        random_streams = RandomStreams(seed_num)
+        if arrival_stream is None:
+            # the arrivals a Simulations with the same seed would generate
+            arrival_stream = generate_arrival_stream(Population(weights=weights), NUM_PERIODS, START_SIZE, ARRIVAL_RATE,
+                                                     altruists, rng=random_streams.arrivals,
+                                                     altruist_rng=random_streams.altruists,
+                                                     perish_rng=random_streams.perish, per_period=per_period)
+        elif not isinstance(arrival_stream, ArrivalStream):
+            arrival_stream = read_arrival_stream(arrival_stream, random_streams.perish)
+        self.arrival_stream = arrival_stream
+        (region_streams, exchange_streams) = (random_streams.spawn(len(regions)), random_streams.spawn(1)[0])
+        self.region_rng = exchange_streams.altruists
+        self.exchange_seed = int(exchange_streams.seed_sequence.generate_state(1, dtype=np.uint64)[0])
+        self.exchange_streams = exchange_streams
+
+        self.region_of_province = np.full(len(PROVINCES), -1)
+        region_p = np.zeros(len(regions))
+        for (i, provinces) in enumerate(regions.values()):
+            for province in provinces:
+                code = PROVINCES.index(province)
+                if self.region_of_province[code] != -1:
+                    raise ValueError("Province {} is in more than one region".format(province))
+                self.region_of_province[code] = i
+                region_p[i] += PROVINCE_P[code]
+        if np.any(self.region_of_province == -1):
+            raise ValueError("Provinces {} are in no region".format(
+                [PROVINCES[code] for code in np.flatnonzero(self.region_of_province == -1)]))
+        self.region_p = region_p / region_p.sum()
+
+        self.cycle_chain_matches = [[0, 0, 0, 0, 0], [0], [0, 0, 0, 0, 0]]
+        self.exchange_matches = list()
+        self.exchange_metrics = None
+        self.total_altruists = 0
+        self.connections = list()
+        self.workers = list()
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        initial_pairs = self.arrival_stream.initial_pairs()
+        for (i, name) in enumerate(regions):
+            (connection, worker_connection) = context.Pipe()
+            region_args = (name, self.split_pairs(initial_pairs)[i], altruists, per_period, weights, max_cycle_size,
+                           max_path_size, region_streams[i])
+            worker = context.Process(target=serve, args=(worker_connection, region_args), daemon=True)
+            worker.start()
+            self.connections.append(connection)
+            self.workers.append(worker)
+        for connection in self.connections:
+            self.receive(connection)
+
+    def receive(self, connection):
+        """
+        :return: the answer of a worker, raising an error if its method raised
+        """
+        (ok, result) = connection.recv()
+        if not ok:
+            self.stop()
+            raise RuntimeError("A regional market failed:\n" + result)
+        return result
+
+    def call_all(self, method, args):
+        """
+        calls a method of every Region at the same time
+        :param method: the name of the method
+        :param args: a list with the tuple of arguments of every region
+        :return: the list of the results of every region
+        """
+        for (connection, region_args) in zip(self.connections, args):
+            connection.send((method, region_args))
+        return [self.receive(connection) for connection in self.connections]
+
+    def stop(self):
+        """
+        stops the worker processes
+        """
+        for (connection, worker) in zip(self.connections, self.workers):
+            if worker.is_alive():
+                connection.send((None, ()))
+            worker.join()
+        self.connections = list()
+        self.workers = list()
+
+    def split_pairs(self, cohort):
+        """
+        :param cohort: a dictionary of the attribute arrays of pairs
+        :return: a list of the dictionaries of the pairs of every region, by province
+        """
+        region = self.region_of_province[np.asarray(cohort['province'])]
+        return [select(cohort, region == i) for i in range(len(self.regions))]
+
+    def split_altruists(self, cohort):
+        """
+        :param cohort: a dictionary of the attribute arrays of altruists
+        :return: a list of the dictionaries of the altruists of every region, drawn with the probabilities of the regions
+        """
+        region = self.region_rng.choice(len(self.regions), size=len(cohort['donor_type']), p=self.region_p)
+        return [select(cohort, region == i) for i in range(len(self.regions))]
+
+    def add_joint_edges(self, market, donors, donor_keys, recipients, recipient_keys, block_size=2000):
+        """
+        crossmatches the donors of one region against the recipients of the other regions of a joint market, with
+        tissue-type tests given by stable_uniforms
+        :param market: the joint Market
+        :param donors: array of the table rows of the donors
+        :param donor_keys: array of the keys of the donors
+        :param recipients: array of the table rows of the recipients
+        :param recipient_keys: array of the keys of the recipients
+        :param block_size: the number of donors crossmatched at a time
+        """
+        blood_type = market.table.column('blood_type')
+        cpra = market.table.column('cpra')
+        for start in range(0, len(donors), block_size):
+            block = slice(start, start + block_size)
+            abo = ABO_COMPATIBLE[blood_type[donors[block]][:, None], blood_type[recipients][None, :]]
+            (donor_idx, recipient_idx) = np.nonzero(abo)
+            draws = stable_uniforms(self.exchange_seed, donor_keys[block][donor_idx], recipient_keys[recipient_idx])
+            compatible = draws < 1 - cpra[recipients[recipient_idx]]
+            market.add_edges(donors[block][donor_idx][compatible], recipients[recipient_idx][compatible])
+
+    def exchange(self, period_num):
+        """
+        matches the residual pools of all the regions together and removes the pairs matched from their regions
+        the edges within a region are those of its market, the edges between regions are crossmatched here
+        :param period_num: the period number
+        :return: the number of transplants of the exchange
+        """
+        residuals = self.call_all('residual_pool', [(self.exchange_cpra,)] * len(self.regions))
+        population = Population(weights=self.weights)
+        if self.exchange_metrics is None:
+            self.exchange_metrics = met.Metrics(self.altruists, self.per_period, self.weights, run_num='Exchange',
+                                                max_cycle_size=self.max_cycle_size, max_path_size=self.max_path_size)
+        market = Market(list(), self.altruists, self.per_period, self.weights, max_cycle_size=self.max_cycle_size,
+                        max_path_size=self.max_path_size, random_streams=self.exchange_streams,
+                        table=population.table, metrics=self.exchange_metrics)
+        # owners[id_num] is the region and the id_num in the region of a participant of the joint market
+        owners = list()
+        pairs = list()
+        altruists = list()
+        edges = (list(), list(), list())
+        regions = list()
+        for (i, residual) in enumerate(residuals):
+            region_pairs = population.build_pairs(residual['pairs'])
+            region_altruists = population.build_altruists(residual['altruists'])
+            ids = np.concatenate((residual['pair_ids'], residual['altruist_ids']))
+            owners.extend((i, id_num) for id_num in ids.tolist())
+            donors = np.array([donor.row for (recipient, donor) in region_pairs + region_altruists], dtype=np.int64)
+            recipients = np.array([recipient.row for (recipient, donor) in region_pairs], dtype=np.int64)
+            (sources, targets, weights) = residual['edges']
+            order = np.argsort(ids)
+            edges[0].append(donors[order[np.searchsorted(ids[order], sources)]])
+            edges[1].append(recipients[order[np.searchsorted(ids[order], targets)]])
+            edges[2].append(weights)
+            # keys unique over all the regions, the id_nums are int32
+            keys = np.int64(i) << 32 | ids
+            regions.append((donors, keys, recipients, keys[:len(recipients)]))
+            pairs.extend(region_pairs)
+            altruists.extend(region_altruists)
+        market.import_pairs(pairs, altruists, *[np.concatenate([np.zeros(0, dtype=dtype)] + edge)
+                                                for (edge, dtype) in zip(edges, [np.int64, np.int64, np.float64])])
+        for (i, (donors, donor_keys, _, _)) in enumerate(regions):
+            others = [j for j in range(len(regions)) if j != i]
+            recipients = np.concatenate([np.zeros(0, dtype=np.int64)] + [regions[j][2] for j in others])
+            recipient_keys = np.concatenate([np.zeros(0, dtype=np.int64)] + [regions[j][3] for j in others])
+            self.add_joint_edges(market, donors, donor_keys, recipients, recipient_keys)
+        # altruists alone can't be matched
+        if len(pairs) == 0:
+            return 0
+
+        print("Cross-region exchange of period " + str(period_num))
+        matching = mm.MaxMatching(market, self.max_cycle_size, self.max_path_size)
+        (matches, preserved_donors) = matching.maximum_matching()
+        cycle_path_lengths = matching.cycle_lengths
+        matched = [list() for _ in self.regions]
+        for id_num in sorted({participant.id_num for match in matches for participant in match}):
+            (region, region_id) = owners[id_num]
+            matched[region].append(region_id)
+        removed = self.call_all('remove_exchanged', [(ids,) for ids in matched])
+        num_altruists_in_matching = sum(1 for match in matches if match[0].blood_type == 'X')
+        self.exchange_metrics.update_table(num_matches=sum(removed), num_participants=len(market.participants),
+                                           num_added=0, num_altruists_in_market=len(market.altruists),
+                                           num_altruists_in_matching=num_altruists_in_matching, total_wait_time=0,
+                                           median_wait_time=0, total_remaining_time=0,
+                                           cycle_lengths=cycle_path_lengths)
+        # the joint pool only lives for this exchange, the composition of the next row is that of the next pool
+        for pair in pairs + altruists:
+            self.exchange_metrics.update_blood_type_composition(pair, remove=True)
+            self.exchange_metrics.update_cpra_composition(pair, remove=True)
+        for j in range(0, 5):
+            self.cycle_chain_matches[0][j] += cycle_path_lengths[0][j]
+            self.cycle_chain_matches[2][j] += cycle_path_lengths[2][j]
+        self.cycle_chain_matches[1][0] += cycle_path_lengths[1][0]
+        self.exchange_matches.append(sum(removed))
+        return sum(removed)
+
+    def run(self):
+        """
+        runs all the regions for NUM_PERIODS periods, with the cross-region exchanges, and stops the workers
+        :return: a dictionary of the totals of every region ('regions', as given by Region.finish), the matches by
+                 cycles and chains and the transplants of every exchange
+        """
+        try:
+            for i in range(NUM_PERIODS):
+                pairs = self.split_pairs(self.arrival_stream.pair_cohort(i))
+                altruists = [select(self.arrival_stream.altruist_cohort(i), slice(0, 0))] * len(self.regions)
+                self.total_altruists += int(self.arrival_stream.altruist_counts[i])
+                if i % self.per_period == 0:
+                    altruists = self.split_altruists(self.arrival_stream.altruist_cohort(i))
+                results = self.call_all('run_period', [(i, pairs[r], altruists[r]) for r in range(len(self.regions))])
+                for cycle_path_lengths in results:
+                    for j in range(0, 5):
+                        self.cycle_chain_matches[0][j] += cycle_path_lengths[0][j]
+                        self.cycle_chain_matches[2][j] += cycle_path_lengths[2][j]
+                    self.cycle_chain_matches[1][0] += cycle_path_lengths[1][0]
+                if self.exchange_every > 0 and (i + 1) % self.exchange_every == 0:
+                    self.exchange(i)
+            totals = self.call_all('finish', [()] * len(self.regions))
+        finally:
+            self.stop()
+            if self.exchange_metrics is not None:
+                self.exchange_metrics.close_table()
+        return {'regions': totals, 'cycle_chain_matches': self.cycle_chain_matches,
+                'exchange_matches': self.exchange_matches, 'total_altruists': self.total_altruists}
+
+
+if __name__ == '__main__':
+    # the same arrivals pooled regionally, regionally with exchanges of the highly sensitized pairs, and nationally
+    random_streams = RandomStreams(0)
+    stream = generate_arrival_stream(Population(), NUM_PERIODS, START_SIZE, ARRIVAL_RATE, NUM_ALTRUISTS,
+                                     rng=random_streams.arrivals, altruist_rng=random_streams.altruists,
+                                     perish_rng=random_streams.perish)
+    for (regions, exchange_every, exchange_cpra) in [(REGIONS, 0, 0), (REGIONS, 4, 0.85), ({'Canada': PROVINCES}, 0, 0)]:
+        results = RegionalSimulation(regions=regions, seed_num=0, exchange_every=exchange_every,
+                                     exchange_cpra=exchange_cpra, arrival_stream=stream).run()
+        print(len(regions), "regions, exchange every", exchange_every, "periods from cpra", exchange_cpra, ":",
+              results['cycle_chain_matches'], results['exchange_matches'])
@@ -1,7 +1,14 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from market import Market
 from population import Population
-from config import START_SIZE, NUM_PERIODS, ARRIVAL_RATE, CYCLE_CAP, CHAIN_CAP, RANDOM_SAMPLE
+from arrival_stream import ArrivalStream, generate_arrival_stream, read_arrival_stream
+from random_streams import RandomStreams
+from checkpoint import save_checkpoint, load_checkpoint, checkpoint_period
+from pool_loader import load_pool
+from config import START_SIZE, NUM_PERIODS, ARRIVAL_RATE, CYCLE_CAP, CHAIN_CAP, RANDOM_SAMPLE, BATCH_GENERATION, \
+    PREFETCH_ARRIVALS, CHECKPOINT_PATH, CHECKPOINT_EVERY, ALGORITHM, WEIGHTS, INITIAL_POOL_PATH
 import testaltruists as ta
 import testweights as tw
 import testcyclesize as tcs
@@ -19,55 +26,194 @@ class Simulations:
         altruists enter the market every "per_period"
     market: Market
         the kidney exchange market that we run simulations on
+    total_altruists: int
+        the number of altruists drawn in the periods run so far
+    next_period: int
+        the number of the next period to run
     cycle_chain_matches:
         an array [x,x] keep track of matches by cycles and chains (don't include cycle size >6 now)
+    run_num:
+        the number of the run in a sweep (see testweights.py), -1 if the simulation is not part of one
     test_trial_num:
         int if this is a test using different seeds, indicating the number of trial
         None if this is not a trial test using different seeds
     trial_table:
         xslx Worksheet object for seed trial test
+    arrival_stream:
+        ArrivalStream the arrivals are replayed from, or None if arrivals are generated while the simulation runs
+    random_streams:
+        RandomStreams all the randomness of the simulation is drawn from, derived from seed_num unless given
+    initial_pool:
+        a pool_loader.Pool or the path of a pool snapshot the market starts from, instead of the starting pool of the
+        arrival stream or of START_SIZE generated pairs
     """
-    def __init__(self, altruists, per_period, weights=None, run_num=-1, max_cycle_size=CYCLE_CAP, max_path_size=CHAIN_CAP, test_trial_num=None, trial_table=None, seed_num = None):
-        self.random_state = np.random.RandomState()
+    def __init__(self, altruists, per_period, weights=None, run_num=-1, max_cycle_size=CYCLE_CAP, max_path_size=CHAIN_CAP, test_trial_num=None, trial_table=None, seed_num = None, arrival_stream=None, random_streams=None, initial_pool=INITIAL_POOL_PATH):
+        if random_streams is None:
+            random_streams = RandomStreams(seed_num)
+        self.random_streams = random_streams
+        self.random_state = random_streams.altruists
         self.seed = seed_num
+        self.run_num = run_num
         self.test_trial_num = test_trial_num
         self.trial_table = trial_table
         self.population = Population(weights=weights)
         self.altruists = altruists
         self.per_period = per_period
-        self.market = Market(self.population.generate_pairs(START_SIZE,first_flag=True), self.altruists, self.per_period, weights, run_num, max_cycle_size=max_cycle_size, max_path_size=max_path_size)
+        self.arrival_stream = None
+        if arrival_stream is not None:
+            self.arrival_stream = self.load_arrival_stream(arrival_stream)
+        if initial_pool is not None:
+            initial_pairs = list()
+        elif self.arrival_stream is not None:
+            initial_pairs = self.population.build_pairs(self.arrival_stream.initial_pairs())
+        else:
+            initial_pairs = self.generate_pairs(START_SIZE, first_flag=True)
+        self.market = Market(initial_pairs, self.altruists, self.per_period, weights, run_num, max_cycle_size=max_cycle_size, max_path_size=max_path_size, random_streams=self.random_streams, table=self.population.table)
+        if initial_pool is not None:
+            load_pool(self.market, self.population, initial_pool)
         self.cycle_chain_matches = [[0,0,0,0,0],[0],[0,0,0,0,0]]
+        self.total_altruists = 0
+        self.next_period = 0
 
 
-    def run(self):
+    def generate_pairs(self, num_pairs, first_flag):
         """
-        runs the simulations
-        adds participants every matching period and adds altruists depending on settings
+        generates new pairs from the population, in one batch if BATCH_GENERATION is set
+        :param num_pairs: int - the number of pairs to generate
+        :param first_flag: boolean - a boolean indicating the first period
+        :return: a list of tuples of participants in the form (recipient, donor)
+        """
+        rng = self.random_streams.arrivals
+        perish_rng = self.random_streams.perish
+        if BATCH_GENERATION:
+            return self.population.generate_pairs_batch(num_pairs, first_flag=first_flag, rng=rng, perish_rng=perish_rng)
+        return self.population.generate_pairs(num_pairs, first_flag=first_flag, rng=rng, perish_rng=perish_rng)
+
+    def load_arrival_stream(self, arrival_stream):
+        """
+        gets the arrival stream to replay
+        if a path is given and the file does not exist yet, the arrivals of the whole simulation are generated first
+        and written to the file, so that later simulations with the same seed can replay them
+        :param arrival_stream: an ArrivalStream or the path of a .npz or .csv file
+        :return: an ArrivalStream
+        """
+        if isinstance(arrival_stream, ArrivalStream):
+            stream = arrival_stream
+        elif os.path.exists(arrival_stream):
+            stream = read_arrival_stream(arrival_stream, self.random_streams.perish)
+        else:
+            stream = generate_arrival_stream(self.population, NUM_PERIODS, START_SIZE, ARRIVAL_RATE, self.altruists,
+                                             rng=self.random_streams.arrivals, altruist_rng=self.random_streams.altruists,
+                                             perish_rng=self.random_streams.perish, per_period=self.per_period)
+            stream.save(arrival_stream)
+        if stream.num_periods < NUM_PERIODS:
+            raise ValueError("The arrival stream only has {} periods, {} are needed".format(stream.num_periods, NUM_PERIODS))
+        return stream
+
+    def get_arrivals(self, period_num):
+        """
+        gets the new pairs and altruists of a period
+        they are replayed from the arrival stream if there is one, otherwise they are generated
+        :param period_num: the period number
+        :return: the new pairs, the new altruists and the number of altruists drawn for the period
         """
-        total_altruists = 0
-        for i in range(NUM_PERIODS):
-            print("Starting period " + str(i) + " - Trial number" + str(self.test_trial_num))
-            num_pairs = np.random.poisson(ARRIVAL_RATE,None)
-            new_pairs = self.population.generate_pairs(num_pairs, first_flag=False)
-            altruists = list()
-            if RANDOM_SAMPLE:
-                num_altruists = self.random_state.poisson(self.altruists,None)
+        altruists = list()
+        if self.arrival_stream is not None:
+            new_pairs = self.population.build_pairs(self.arrival_stream.pair_cohort(period_num))
+            num_altruists = int(self.arrival_stream.altruist_counts[period_num])
+            if period_num % self.per_period == 0:
+                altruists = self.population.build_altruists(self.arrival_stream.altruist_cohort(period_num))
+            return new_pairs, altruists, num_altruists
+        num_pairs = self.random_streams.arrivals.poisson(ARRIVAL_RATE,None)
+        new_pairs = self.generate_pairs(num_pairs, first_flag=False)
+        if RANDOM_SAMPLE:
+            num_altruists = self.random_state.poisson(self.altruists,None)
+        else:
+            num_altruists = self.altruists
+        if period_num % self.per_period == 0:
+            if BATCH_GENERATION:
+                altruists = self.population.generate_altruists(num_altruists, self.random_state, self.random_streams.perish)
             else:
-                num_altruists = self.altruists
-            total_altruists += num_altruists
-            x = np.random.randint(0,100,size=1)
-            if i % self.per_period == 0:
                 for j in range(num_altruists):
-                    altruists.append(self.population.generate_altruist(self.random_state))
-            y = np.random.randint(0, 100, size=1)
-            cycle_path_lengths = self.market.run_period(new_participants=new_pairs,
-                                   new_altruists=altruists, period_num=i, seed = self.seed, test_trial_num = self.test_trial_num, trial_table = self.trial_table)
-            for i in range(0,5):
-                self.cycle_chain_matches[0][i] += cycle_path_lengths[0][i]
-                self.cycle_chain_matches[2][i] += cycle_path_lengths[2][i]
-            self.cycle_chain_matches[1][0] += cycle_path_lengths[1][0]
+                    altruists.append(self.population.generate_altruist(self.random_state, self.random_streams.perish))
+        return new_pairs, altruists, num_altruists
+
+    def checkpoint_file(self):
+        """
+        :return: the path of the checkpoint of this simulation in CHECKPOINT_PATH
+        """
+        return os.path.join(CHECKPOINT_PATH, "CheckpointSeed" + str(self.seed) +
+                            ("" if self.run_num == -1 else "RN" + str(self.run_num)) +
+                            ("" if self.test_trial_num is None else "Trial" + str(self.test_trial_num)) +
+                            "Weights" + WEIGHTS + ALGORITHM + str(self.altruists) + "AltruistsPer" +
+                            str(self.per_period) + "Periods" + str(self.market.max_cycle_size) +
+                            str(self.market.max_path_size) + "CS.npz")
+
+    def checkpointing(self):
+        """
+        :return: True if the simulation is saved to and continued from checkpoints
+                 a simulation without a seed draws other arrivals every time it is created, so it has none
+        """
+        return CHECKPOINT_PATH is not None and self.seed is not None
+
+    def checkpoint_due(self, period_num):
+        """
+        :return: True if a checkpoint is saved at the end of the period
+        """
+        return self.checkpointing() and (period_num + 1) % CHECKPOINT_EVERY == 0
+
+    def run(self, num_periods=NUM_PERIODS):
+        """
+        runs the simulations, from next_period up to num_periods
+        adds participants every matching period and adds altruists depending on settings
+        the results are only written once the last of the NUM_PERIODS periods has been run, so a simulation can be run
+        part of the way (e.g. the burn-in of burn_in.py) and continued by calling run again
+        if PREFETCH_ARRIVALS is set, the arrivals of period i + 1 are generated in a worker thread while period i is
+        matched. They do not depend on the matching and are drawn from their own random streams. If REUSE_RATE is set, the
+        bridge donors of period i are added to the table after them
+        if CHECKPOINT_PATH is set and the simulation has a seed, it continues from its checkpoint if there is one that
+        stops before num_periods, and saves one every CHECKPOINT_EVERY periods. The arrivals of the period after a checkpoint are not prefetched, so that the
+        checkpoint holds the random streams as they are between the two periods
+        """
+        executor = None
+        next_arrivals = None
+        # a checkpoint at or past num_periods is that of a simulation already run, not one to continue
+        if self.checkpointing() and os.path.exists(self.checkpoint_file()) and \
+                checkpoint_period(self.checkpoint_file()) < num_periods:
+            self.next_period = load_checkpoint(self.checkpoint_file(), self)
+            print("Continuing from the checkpoint of period " + str(self.next_period - 1))
+        if PREFETCH_ARRIVALS and self.next_period < num_periods:
+            executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            for i in range(self.next_period, num_periods):
+                print("Starting period " + str(i) + " - Trial number" + str(self.test_trial_num))
+                if next_arrivals is not None:
+                    new_pairs, altruists, num_altruists = next_arrivals.result()
+                    next_arrivals = None
+                else:
+                    new_pairs, altruists, num_altruists = self.get_arrivals(i)
+                if executor is not None and i + 1 < num_periods and not self.checkpoint_due(i):
+                    next_arrivals = executor.submit(self.get_arrivals, i + 1)
+                # the market adds the rows of its bridge donors once those of the prefetched arrivals are in the table
+                self.market.pending_arrivals = next_arrivals
+                self.total_altruists += num_altruists
+                cycle_path_lengths = self.market.run_period(new_participants=new_pairs,
+                                       new_altruists=altruists, period_num=i, seed = self.seed, test_trial_num = self.test_trial_num, trial_table = self.trial_table)
+                for j in range(0,5):
+                    self.cycle_chain_matches[0][j] += cycle_path_lengths[0][j]
+                    self.cycle_chain_matches[2][j] += cycle_path_lengths[2][j]
+                self.cycle_chain_matches[1][0] += cycle_path_lengths[1][0]
+                self.next_period = i + 1
+                if self.checkpoint_due(i):
+                    save_checkpoint(self.checkpoint_file(), self, self.next_period)
+        finally:
+            self.market.pending_arrivals = None
+            if executor is not None:
+                executor.shutdown()
+        if self.next_period < NUM_PERIODS:
+            return
         if self.trial_table is not None:
-            self.trial_table.write(self.test_trial_num, 2, total_altruists)
+            self.trial_table.write(self.test_trial_num, 2, self.total_altruists)
             self.trial_table.write(self.test_trial_num, 32, self.cycle_chain_matches[0][0])
             self.trial_table.write(self.test_trial_num, 33, self.cycle_chain_matches[0][1])
             self.trial_table.write(self.test_trial_num, 34, self.cycle_chain_matches[0][2])
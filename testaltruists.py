@@ -1,6 +1,6 @@
 import time
 import simulations as s
-from config import NUM_ALTRUISTS, RESULTS_PATH, CYCLE_CAP, CHAIN_CAP, ALGORITHM, NUM_ALTRUISTS, WEIGHTS
+from config import NUM_ALTRUISTS, RESULTS_PATH, CYCLE_CAP, CHAIN_CAP, ALGORITHM, NUM_ALTRUISTS, WEIGHTS, ARRIVAL_STREAM_PATH
 import numpy as np
 import xlsxwriter
 import os
@@ -18,8 +18,12 @@ def test_altruists(seed=None, test_trial_num=None, trial_table=None):
     for i in [NUM_ALTRUISTS]:
         for j in [1]:
             print("Starting Simulations with " + str(i) + " altruists every " + str(j) + " periods")
+            arrival_stream = None
+            if ARRIVAL_STREAM_PATH is not None and seed is not None:
+                # the same arrivals are replayed for every algorithm, cycle cap and chain cap
+                arrival_stream = os.path.join(ARRIVAL_STREAM_PATH, "ArrivalsSeed" + str(seed) + "Altruists" + str(i) + ".npz")
             sim = s.Simulations(altruists=i, per_period=j, test_trial_num=test_trial_num, trial_table=trial_table,
-                                seed_num=seed)
+                                seed_num=seed, arrival_stream=arrival_stream)
             sim.run()
             for i in range(0,4):
                 cycle_matches += sim.cycle_chain_matches[0][i]*(i+2)
@@ -1,4 +1,6 @@
 import simulations as s
+import burn_in
+from config import BURN_IN_PERIODS
 """
 Has all the functionalities for running tests on the affects of altruists in the market
 """
@@ -8,6 +10,12 @@ def test_cycle_sizes():
     # print("Starting Simulations with 0 altruists")
     # sim = Simulations(altruists=0, per_period=1)
     # sim.run()
+    if BURN_IN_PERIODS > 0:
+        # the cycle sizes are compared from the same market after the burn-in
+        print("Starting Simulations with a burn-in of " + str(BURN_IN_PERIODS) + " periods")
+        for result in burn_in.burn_in_and_branch([{'CYCLE_CAP': i} for i in [2, 3, 4]], BURN_IN_PERIODS, altruists=5):
+            print(result)
+        return
     for i in [2, 3, 4]:
         print("Starting Simulations with " + str(i) + " cycles ")
         sim = s.Simulations(altruists=5, per_period=1, max_cycle_size=i)
@@ -0,0 +1,82 @@
+import tracemalloc
+import numpy as np
+from population import Population
+from random_streams import RandomStreams
+from participant import BLOOD_TYPES, PROVINCES
+"""
+Measures the memory used by the participants of a market, before and after they were stored in a ParticipantTable
+"""
+
+
+class LegacyParticipant:
+    """
+    The participant as it was stored before the ParticipantTable: one object per participant with a dict of python
+    attributes, string blood types and provinces, separate donor / recipient / altruist booleans and a neighbours list
+    """
+    def __init__(self, id_num, blood_type, donor, recipient, altruist, time_to_critical, weight, cpra=0, province='QB', age=30, dialysis_days=30):
+        self.id_num = id_num
+        self.blood_type = blood_type
+        self.partner = None
+        self.donor = donor
+        self.recipient = recipient
+        self.altruist = altruist
+        self.neighbours = list()
+        self.time_in_market = 0
+        self.time_to_critical = time_to_critical
+        self.weight = weight
+        self.cpra = cpra
+        self.province = province
+        self.age = age
+        self.dialysis_days = dialysis_days
+
+
+def legacy_pairs(cohort, weights):
+    """
+    creates the pairs of a cohort the way Population did before the ParticipantTable
+    :return: a list of tuples of LegacyParticipants in the form (recipient, donor)
+    """
+    pairs = list()
+    columns = zip(weights.tolist(), cohort['cpra'].tolist(), cohort['donor_type'].tolist(),
+                  cohort['recipient_type'].tolist(), cohort['dialysis_days'].tolist(), cohort['donor_age'].tolist(),
+                  cohort['patient_age'].tolist(), cohort['time_to_critical'].tolist(), cohort['province'].tolist())
+    for (i, (weight, cpra, donor_code, recipient_code, dialysis_day, donor_age, patient_age, time_to_critical, province_code)) in enumerate(columns):
+        donor = LegacyParticipant(i, BLOOD_TYPES[donor_code], donor=True, recipient=False, altruist=False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=donor_age, dialysis_days=dialysis_day, province=PROVINCES[province_code])
+        recipient = LegacyParticipant(i, BLOOD_TYPES[recipient_code], donor=False, recipient=True, altruist=False, time_to_critical=time_to_critical, weight=weight, cpra=cpra, age=patient_age, dialysis_days=dialysis_day, province=PROVINCES[province_code])
+        donor.partner = recipient
+        recipient.partner = donor
+        recipient.neighbours.append(donor)
+        pairs.append((recipient, donor))
+    return pairs
+
+
+def measure(build):
+    """
+    :param build: a function creating the participants
+    :return: the number of bytes allocated by build that are still in use, and what build returned
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def test_memory(num_pairs=10000, seed=0):
+    population = Population()
+    cohort = population.sample_cohort(num_pairs, first_flag=True, rng=RandomStreams(seed).arrivals)
+    weights = population.calculate_weights(cohort['cpra_index'], cohort['donor_type'], cohort['recipient_type'])
+
+    legacy_bytes, legacy = measure(lambda: legacy_pairs(cohort, weights))
+
+    table_bytes, pairs = measure(lambda: population.build_pairs(cohort))
+
+    print("Memory used by the participants of a {}-pair market".format(num_pairs))
+    print("Participant objects:  {:.0f} bytes per pair".format(legacy_bytes / num_pairs))
+    print("ParticipantTable:     {:.0f} bytes per pair".format(table_bytes / num_pairs))
+    print("(of which table rows: {:.0f} bytes per pair)".format(2 * sum(column.itemsize for column in population.table.columns.values())))
+    return legacy_bytes, table_bytes
+
+
+if __name__ == '__main__':
+    test_memory()
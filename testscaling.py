@@ -0,0 +1,103 @@
+import contextlib
+import multiprocessing
+import os
+import resource
+import time
+import numpy as np
+import algorithms.max_matching as mm
+from market import Market
+from population import Population
+from participant import ABO_COMPATIBLE
+from random_streams import RandomStreams
+from pool_loader import Pool, load_pool
+from config import CYCLE_CAP, CHAIN_CAP
+"""
+Measures how the time of a period and the peak memory of a market grow with the size of the pool, for national-scale
+pools of tens of thousands of pairs
+The simulated crossmatch gives a dense compatibility graph (about a third of all donor-recipient pairs are compatible),
+which real pools of this size are not, so the edges are drawn with a fixed mean out-degree instead
+Market.crossmatch is therefore not measured here: it is quadratic in the size of the pool, and pools of this size are
+only supported with sparse edges supplied from outside (e.g. a pool snapshot with its edge list, see pool_loader.py)
+Every pool size runs in a process of its own, so that its peak resident set size is not hidden by a larger one
+"""
+
+
+def sparse_edges(pairs, altruists, degree, rng):
+    """
+    draws degree candidate recipients for every donor of a pool and keeps the ABO-compatible ones
+    :param pairs: the pair columns of the pool
+    :param altruists: the altruist columns of the pool
+    :param degree: the number of candidate recipients of every donor
+    :param rng: the random generator to draw from
+    :return: the sources, targets and weights of the edges between pairs and of the edges from altruists, weights
+             are NaN so that the market computes them
+    """
+    num_pairs = len(pairs['recipient_type'])
+    edges = list()
+    for (donor_types, same_pool) in [(pairs['donor_type'], True), (altruists['donor_type'], False)]:
+        sources = np.repeat(np.arange(len(donor_types)), degree)
+        targets = rng.integers(0, num_pairs, len(sources))
+        keep = ABO_COMPATIBLE[np.asarray(donor_types)[sources], np.asarray(pairs['recipient_type'])[targets]]
+        if same_pool:
+            keep &= sources != targets
+        # a donor drawing the same recipient twice has a single edge to it
+        (sources, targets) = np.unique(np.column_stack((sources[keep], targets[keep])), axis=0).T
+        edges.append((sources, targets, np.full(len(sources), np.nan)))
+    return edges
+
+
+def measure_period(num_pairs, num_altruists, degree, seed):
+    """
+    builds a market from a pool of num_pairs pairs and runs one period on it
+    :return: a dictionary of the number of edges, the time to import the pool, to build the solver input and to run
+             the period, and the peak resident set size of the process in MB
+    """
+    random_streams = RandomStreams(seed)
+    population = Population()
+    pairs = population.sample_cohort(num_pairs, first_flag=True, rng=random_streams.arrivals,
+                                     perish_rng=random_streams.perish)
+    altruists = population.sample_altruists(num_altruists, random_streams.altruists, random_streams.perish)
+    (edges, ndd_edges) = sparse_edges(pairs, altruists, degree, random_streams.crossmatch)
+    market = Market(list(), num_altruists, 1, max_cycle_size=CYCLE_CAP, max_path_size=CHAIN_CAP,
+                    random_streams=random_streams, table=population.table)
+
+    start = time.time()
+    load_pool(market, population, Pool(pairs, altruists, edges, ndd_edges))
+    import_time = time.time() - start
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.time()
+        mm.MaxMatching(market, CYCLE_CAP, CHAIN_CAP).kidney_instance()
+        instance_time = time.time() - start
+        start = time.time()
+        market.run_period(period_num=0)
+        period_time = time.time() - start
+    # ru_maxrss is in kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return {'num_pairs': num_pairs, 'num_edges': len(edges[0]) + len(ndd_edges[0]), 'import_time': import_time,
+            'instance_time': instance_time, 'period_time': period_time, 'peak_rss': peak_rss}
+
+
+def test_scaling(sizes=(1000, 5000, 10000, 25000, 50000), num_altruists=10, degree=20, seed=0):
+    """
+    runs one period on pools of every size and prints the time and peak memory of each
+    :param sizes: the numbers of pairs in the pool
+    :param num_altruists: the number of altruists in every pool
+    :param degree: the number of candidate recipients drawn for every donor, see sparse_edges
+    :param seed: the seed of the pools
+    :return: the list of the measures of every size, as given by measure_period
+    """
+    results = list()
+    print("{:>8} {:>10} {:>10} {:>12} {:>10} {:>12}".format("pairs", "edges", "import s", "instance s", "period s",
+                                                           "peak RSS MB"))
+    for num_pairs in sizes:
+        # a fresh process for every size, so the peak memory is its own
+        with multiprocessing.get_context('spawn').Pool(1) as pool:
+            result = pool.apply(measure_period, (num_pairs, num_altruists, degree, seed))
+        print("{num_pairs:>8} {num_edges:>10} {import_time:>10.2f} {instance_time:>12.2f} {period_time:>10.2f} "
+              "{peak_rss:>12.0f}".format(**result))
+        results.append(result)
+    return results
+
+
+if __name__ == '__main__':
+    test_scaling()